@@ -13,9 +13,25 @@
 #  DB 0x0a   ; a hex byte
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
+#
+#  BANK 3   ; what follows goes into memory bank 3 (binary images only)
+#  Table:
+#  DB 0x2a
+#  BANK 0   ; back to main memory
+#  LDI R0,Table.BANK  ; the number of the bank Table is in
+#  LDI R1,Table       ; its address within that bank
+#
+# With -O, a peephole optimizer shrinks the code of bank 0 between pass 1 and
+# pass 2 -- see optimize().
 
 import sys
 import re
+from collections import namedtuple
+from pathlib import Path
+
+# The binary image format is defined by the emulator, next to this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "ls8"))
+import image  # noqa: E402
 
 # Opcodes
 OPCODES = {
@@ -55,20 +71,69 @@ OPCODES = {
     "XOR":  {"type": 2, "code": "10101011"},
 }
 
+# Output files with this extension are written as binary images (see
+# ls8/image.py)
+IMAGE_EXTENSION = image.EXTENSION
+
+# Size of a memory bank, and the number of banks labels can be placed in
+BANK_SIZE = 256
+MAX_BANKS = 256
+
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
-REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+# (the second operand may be a bank-qualified label, e.g. Table.BANK)
+REGEX = re.compile(r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*([\w.]+))?)?)?")
 
 # Regex for capturing DS and DB data
-REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
-REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
+REGEX_DS = re.compile(r"(?:(\w+?):)?\s*DS\s*(.+)", re.IGNORECASE)
+REGEX_DB = re.compile(r"(?:(\w+?):)?\s*DB\s*(.+)", re.IGNORECASE)
+
+# Regex for register operands
+REGEX_REG = re.compile(r"R([0-7])")
+
+# Opcode name -> machine code byte
+OPCODE_BYTES = {opcode: int(info["code"], 2) for opcode, info in OPCODES.items()}
+
+
+# Registers the optimizer never assumes it knows the value of: IS (R6) is set
+# by the hardware whenever an interrupt is raised
+VOLATILE_REGISTERS = {6}
+
+# Opcodes that write their first operand register
+WRITES_REG_A = {
+    OPCODE_BYTES[opcode] for opcode in (
+        "ADD", "AND", "DEC", "DIV", "INC", "LD", "LDI", "MOD", "MUL", "NOT",
+        "OR", "POP", "SHL", "SHR", "SUB", "XOR",
+    )
+}
+
+# Opcodes after which execution never falls through to the next instruction
+UNCONDITIONAL = {OPCODE_BYTES[opcode] for opcode in ("HLT", "IRET", "JMP", "RET")}
+
+
+# Annotations for a text listing, keyed by code offset
+# * labels -- offset -> list of labels at that offset
+# * comments -- offset -> comment for the byte at that offset
+Listing = namedtuple("Listing", ["labels", "comments"])
+
+# An instruction, or the data of a DS or DB, emitted by pass 1 into bank 0
+# * offset -- where it starts
+# * size -- how many bytes it takes
+# * instruction -- True for instructions, False for data
+Item = namedtuple("Item", ["offset", "size", "instruction"])
 
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-O] [inputfile] [outputfile]
+
+    If outputfile ends in .ls8b, a binary image is written instead of text.
+    -O runs the peephole optimizer.
     """
 
+    optimized = "-O" in argv[1:]
+    argv = [arg for arg in argv if arg != "-O"]
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,16 +147,18 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-O] [infile.asm] [outfile.ls8|outfile.ls8b]", file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    return inputfile, outputfile, optimized
 
 
-def open_files(inputfile, outputfile):
+def open_files(inputfile, outputfile, binary=False):
     """
     Open files for reading and writing. If either of the files are named "-",
     stdin or stdout is returned as appropriate.
+
+    If binary is true, the output file is opened in binary mode.
     """
 
     if inputfile == "-":
@@ -100,9 +167,9 @@ def open_files(inputfile, outputfile):
         inputfile = open(inputfile)
 
     if outputfile == "-":
-        outputfile = sys.stdout
+        outputfile = sys.stdout.buffer if binary else sys.stdout
     else:
-        outputfile = open(outputfile, "w")
+        outputfile = open(outputfile, "wb" if binary else "w")
 
     return inputfile, outputfile
 
@@ -127,28 +194,41 @@ def p8(v):
     return "{:08b}".format(v)
 
 
-def pass1(inputfile, sym, code):
+def pass1(inputfile, sym, code, fixups, listing=None, banks=None, items=None,
+          main_labels=None):
     """
     Pass 1
 
     * Read the source code lines
     * Parse labels, opcodes, and operands
     * Record label offsets
-    * Emit machine code
+    * Emit machine code straight into the code bytearray
+    * Record a fixup (bank, offset, symbol) for every symbolic operand
+
+    If listing is given, it is filled in with Listing annotations so pass2 can
+    write a commented text listing.
+
+    If banks is given, BANK directives are allowed, and it is filled in with
+    bank number -> bytearray for every bank other than 0. Labels in bank n get
+    the address n << 8 | offset.
+
+    If items is given, it is filled in with an Item for every instruction and
+    piece of data emitted into bank 0, for optimize(). If main_labels is given,
+    it is filled in with the name of every label in bank 0, also for
+    optimize().
     """
 
     # Source line number
     line_num = 0
 
-    # Current code address (for labels)
-    addr = 0
+    # Current code address (for labels) is always len(code), in the current bank
+    bank = 0
+    main_code = code
 
     def get_reg(op, fatal=True):
         """Get a register number from a string, e.g. "R2" -> 2"""
 
-        nonlocal line_num
-
-        m = re.match(r"R([0-7])", op)
+        m = REGEX_REG.match(op)
 
         if m is None:
             if fatal:
@@ -160,67 +240,69 @@ def pass1(inputfile, sym, code):
 
         return int(m.group(1))
 
+    def record(size, instruction=True):
+        """Record an Item for what is about to be emitted, if it goes into bank 0"""
+
+        if items is not None and code is main_code:
+            items.append(Item(len(code), size, instruction))
+
     def out0(opcode, op_a, op_b, machine_code):
         """Handle opcodes with zero operands"""
 
-        nonlocal addr
-
-        code.append(f"{machine_code} # {opcode}")
-        addr += 1
+        record(1)
+        if listing is not None:
+            listing.comments[len(code)] = opcode
+        code.append(machine_code)
 
     def out1(opcode, op_a, op_b, machine_code):
         """Handle opcodes with one operand"""
 
-        nonlocal addr
-
         reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
-        addr += 2
+        record(2)
+        if listing is not None:
+            listing.comments[len(code)] = f"{opcode} {op_a}"
+        code.append(machine_code)
+        code.append(reg_a)
 
     def out2(opcode, op_a, op_b, machine_code):
         """Handle opcodes with two operands"""
 
-        nonlocal addr
-
         reg_a = get_reg(op_a)
         reg_b = get_reg(op_b)
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
-
-        addr += 3
+        record(3)
+        if listing is not None:
+            listing.comments[len(code)] = f"{opcode} {op_a},{op_b}"
+        code.append(machine_code)
+        code.append(reg_a)
+        code.append(reg_b)
 
     def out8(opcode, op_a, op_b, machine_code):
         """Handle LDI opcode (type 8)"""
 
-        nonlocal addr
-
         reg_a = get_reg(op_a)
 
         try:
-            val_b = int(op_b, 0)
-            out_b = p8(val_b)
+            val_b = int(op_b, 0) & 0xff
 
         except ValueError:
             # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
+            val_b = 0
+            fixups.append((bank, len(code) + 2, op_b))
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(out_b)
-
-        addr += 3
+        record(3)
+        if listing is not None:
+            listing.comments[len(code)] = f"{opcode} {op_a},{op_b}"
+        code.append(machine_code)
+        code.append(reg_a)
+        code.append(val_b)
 
     def handle_ds(line):
         """
         Handle DS pseudo-opcode
         """
 
-        nonlocal addr
-
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+        m = REGEX_DS.match(line)
 
         if m is None or m.group(2) is None:
             print(f"line {line_num}: missing argument to DS", file=sys.stderr)
@@ -228,24 +310,23 @@ def pass1(inputfile, sym, code):
 
         data = m.group(2)
 
-        for i in range(len(data)):
-            print_char = data[i]
+        record(len(data), instruction=False)
+        if listing is not None:
+            for i, print_char in enumerate(data):
+                if print_char == ' ':
+                    print_char = '[space]'
 
-            if print_char == ' ':
-                print_char = '[space]'
+                listing.comments[len(code) + i] = print_char
 
-            code.append(f"{p8(ord(data[i]))} # {print_char}")
-
-        addr += len(data)
+        for c in data:
+            code.append(ord(c) & 0xff)
 
     def handle_db(line):
         """
         Handle the DB pseudo-opcode
         """
 
-        nonlocal addr
-
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+        m = REGEX_DB.match(line)
 
         if m is None or m.group(2) is None:
             print(f"line {line}: missing argument to DB", file=sys.stderr)
@@ -264,9 +345,37 @@ def pass1(inputfile, sym, code):
         # Force to byte size
         val &= 0xff
 
-        code.append(f"{p8(val)} # {data}")
+        record(1, instruction=False)
+        if listing is not None:
+            listing.comments[len(code)] = data
+        code.append(val)
 
-        addr += 1
+    def select_bank(op_a):
+        """
+        Handle the BANK pseudo-opcode, returning the bank's code bytearray
+        """
+
+        if banks is None:
+            print(f"line {line_num}: BANK needs binary image ({IMAGE_EXTENSION}) output",
+                  file=sys.stderr)
+            sys.exit(2)
+
+        try:
+            number = int(op_a, 0)
+
+        except (TypeError, ValueError):
+            print(f"line {line_num}: invalid bank number", file=sys.stderr)
+            sys.exit(2)
+
+        if not 0 <= number < MAX_BANKS:
+            print(f"line {line_num}: bank must be between 0 and {MAX_BANKS - 1}",
+                  file=sys.stderr)
+            sys.exit(2)
+
+        if number == 0:
+            return number, main_code
+
+        return number, banks.setdefault(number, bytearray())
 
     def check_ops(opcode, op_a, op_b):
         """Check operands for sanity with a particular opcode"""
@@ -313,6 +422,8 @@ def pass1(inputfile, sym, code):
         8: out8,
     }
 
+    match = REGEX.match
+
     for line in inputfile:
         line_num += 1
 
@@ -325,26 +436,34 @@ def pass1(inputfile, sym, code):
         line = line.strip()
 
         # Ignore blank lines
-        if input == '':
+        if line == '':
             continue
 
-        # print(line)  # debug
-
-        m = re.match(REGEX, line)
+        m = match(line)
 
         if m is not None:
             label, opcode, op_a, op_b = normalize_line(m.groups())
 
-            # print(label, opcode, op_a, op_b)  # debug
-
             # Track label address
             if label is not None:
-                sym[label] = addr
-                # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
+                # an offset past the bank would read as an address in the next one
+                if len(code) >= BANK_SIZE:
+                    print(f"line {line_num}: label {label} is past the end of bank {bank} "
+                          f"({BANK_SIZE} bytes)", file=sys.stderr)
+                    sys.exit(2)
+                sym[label] = bank << 8 | len(code)
+                if main_labels is not None:
+                    if bank == 0:
+                        main_labels.add(label)
+                    else:
+                        main_labels.discard(label)
+                if listing is not None:
+                    listing.labels.setdefault(len(code), []).append(label)
 
             if opcode is not None:
-                if opcode == 'DS':
+                if opcode == 'BANK':
+                    bank, code = select_bank(op_a)
+                elif opcode == 'DS':
                     handle_ds(line)
                 elif opcode == 'DB':
                     handle_db(line)
@@ -353,50 +472,322 @@ def pass1(inputfile, sym, code):
                     check_ops(opcode, op_a, op_b)
 
                     # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
+                    handler = type_f[OPCODES[opcode]["type"]]
+                    handler(opcode, op_a, op_b, OPCODE_BYTES[opcode])
         else:
-            print(f"No match: {input}", file=sys.stderr)
+            print(f"No match: {line}", file=sys.stderr)
             sys.exit(3)
 
+    for number, data in {0: main_code, **(banks or {})}.items():
+        if len(data) > BANK_SIZE:
+            print(f"bank {number} overflows {BANK_SIZE} bytes", file=sys.stderr)
+            sys.exit(2)
+
 
-def pass2(outputfile, sym, code):
+def optimize(sym, code, fixups, items, main_labels, listing=None):
     """
-    Output the code, substituting in any symbols.
+    Peephole-optimize the code of bank 0 in place, between pass 1 and pass 2.
+
+    Within each straight-line run of instructions (a label or data starts a
+    new one):
+
+    * NOPs are dropped
+    * an LDI of a register with the value it is already known to hold is
+      dropped
+    * a PUSH popped straight back into the same register is dropped, along
+      with the POP
+    * a chain of INCs and DECs of one register is folded into its net effect,
+      or into a single LDI if the register's value is known
+    * instructions after an unconditional JMP, RET, IRET or HLT are dropped,
+      up to the next label
+
+    The labels of bank 0 (main_labels), fixups and the listing are moved to
+    match. This assumes labels are the only jump targets and that code never
+    modifies itself, so it only runs when asked for (-O).
     """
 
-    for c in code:
-        # Replace symbols
-        if c[:4] == 'sym:':
-            s = c[4:].strip()
+    ldi, nop, push, pop, inc, dec, call, interrupt = (
+        OPCODE_BYTES[opcode]
+        for opcode in ("LDI", "NOP", "PUSH", "POP", "INC", "DEC", "CALL", "INT"))
 
-            if s in sym:
-                c = p8(sym[s])
+    labels = {sym[label] for label in main_labels}
+    symbols = {offset: s for bank, offset, s in fixups if bank == 0}
 
-            else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+    def is_instruction(index, opcode, reg):
+        """Whether items[index] is an unlabeled opcode reg"""
 
-        outputfile.write(f"{c}\n")
+        if index >= len(items):
+            return False
+        item = items[index]
+        return (item.instruction and item.offset not in labels and
+                code[item.offset] == opcode and code[item.offset + 1] == reg)
 
+    # What to emit, in order: (item, bytes, comment), with a comment of None
+    # for an item that is kept as it is
+    pieces = []
 
-def main(argv):
-    # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+    # Register -> the value (a number, or a symbol) it is known to hold
+    known = {}
+    dead = False
+    i = 0
 
-    # Open files
-    inputfile, outputfile = open_files(inputfile, outputfile)
+    while i < len(items):
+        item = items[i]
+        offset = item.offset
+
+        if offset in labels or not item.instruction:
+            known.clear()
+            dead = False
+
+        if not item.instruction:
+            pieces.append((item, code[offset:offset + item.size], None))
+            i += 1
+            continue
+
+        opcode = code[offset]
+        reg = code[offset + 1] if item.size > 1 else None
+
+        if dead or opcode == nop:
+            i += 1
+            continue
+
+        if opcode == ldi and reg not in VOLATILE_REGISTERS:
+            value = symbols.get(offset + 2, code[offset + 2])
+            if known.get(reg) == value:
+                i += 1
+                continue
+            known[reg] = value
+            pieces.append((item, code[offset:offset + item.size], None))
+            i += 1
+            continue
+
+        if opcode == push and is_instruction(i + 1, pop, reg):
+            i += 2
+            continue
+
+        if opcode in (inc, dec):
+            # The chain runs from items[i] up to items[j]
+            net = 1 if opcode == inc else -1
+            j = i + 1
+            while is_instruction(j, inc, reg) or is_instruction(j, dec, reg):
+                net += 1 if code[items[j].offset] == inc else -1
+                j += 1
+
+            value = known.pop(reg, None)
+            if isinstance(value, int) and reg not in VOLATILE_REGISTERS:
+                value = (value + net) & 0xff
+                known[reg] = value
+                if j - i > 1:
+                    if net & 0xff:
+                        pieces.append((item, bytes([ldi, reg, value]), f"LDI R{reg},{value}"))
+                    i = j
+                    continue
+
+            if j - i > 1:
+                name = "INC" if net > 0 else "DEC"
+                pieces.extend(
+                    (item, bytes([inc if net > 0 else dec, reg]), f"{name} R{reg}")
+                    for _ in range(abs(net)))
+                i = j
+                continue
+
+        elif opcode in WRITES_REG_A:
+            known.pop(reg, None)
+
+        elif opcode in (call, interrupt):
+            # The subroutine or handler may change any register
+            known.clear()
+
+        if opcode in UNCONDITIONAL:
+            dead = True
+
+        pieces.append((item, code[offset:offset + item.size], None))
+        i += 1
+
+    # Lay the pieces out again
+    new_code = bytearray()
+    new_fixups = [fixup for fixup in fixups if fixup[0] != 0]
+    comments = {}
+    moved = {}
+
+    for item, data, comment in pieces:
+        moved.setdefault(item.offset, len(new_code))
+
+        if comment is not None:
+            comments[len(new_code)] = comment
+        else:
+            if listing is not None:
+                for k in range(item.size):
+                    if item.offset + k in listing.comments:
+                        comments[len(new_code) + k] = listing.comments[item.offset + k]
+            if item.instruction and item.offset + 2 in symbols:
+                new_fixups.append((0, len(new_code) + 2, symbols[item.offset + 2]))
+
+        new_code += data
+
+    # Where every old item offset ended up -- a dropped item's is that of
+    # whatever follows it
+    position = {len(code): len(new_code)}
+    following = len(new_code)
+    for item in reversed(items):
+        following = moved.get(item.offset, following)
+        position[item.offset] = following
+
+    for label in main_labels:
+        sym[label] = position[sym[label]]
+
+    if listing is not None:
+        new_labels = {}
+        for offset, names in listing.labels.items():
+            new_labels.setdefault(position[offset], []).extend(names)
+        listing.labels.clear()
+        listing.labels.update(new_labels)
+        listing.comments.clear()
+        listing.comments.update(comments)
+
+    code[:] = new_code
+    fixups[:] = new_fixups
+
+
+def apply_fixups(sym, code, fixups, banks=None):
+    """
+    Patch every symbolic operand recorded in pass 1 with its label address.
+
+    A label qualified with .BANK is patched with the number of its bank.
+    """
+
+    for bank, offset, s in fixups:
+        label, _, qualifier = s.partition('.')
+
+        if label not in sym:
+            print(f"unknown symbol: {label}", file=sys.stderr)
+            sys.exit(2)
+
+        if qualifier == '':
+            value = sym[label]
+        elif qualifier == 'BANK':
+            value = sym[label] >> 8
+        else:
+            print(f"unknown qualifier: {s}", file=sys.stderr)
+            sys.exit(2)
+
+        target = code if bank == 0 else banks[bank]
+        target[offset] = value & 0xff
+
+
+def pass2(outputfile, code, listing):
+    """
+    Output the code as a commented text listing.
+    """
+
+    lines = []
+    labels = listing.labels
+    comments = listing.comments
+
+    for offset, byte in enumerate(code):
+        for label in labels.get(offset, ()):
+            lines.append(f"# {label} (address {offset}):")
+
+        comment = comments.get(offset)
+        if comment is None:
+            lines.append(p8(byte))
+        else:
+            lines.append(f"{p8(byte)} # {comment}")
+
+    # Labels at the very end of the program
+    for label in labels.get(len(code), ()):
+        lines.append(f"# {label} (address {len(code)}):")
+
+    outputfile.write("".join(f"{line}\n" for line in lines))
+
+
+def pass2_image(outputfile, sym, code, banks=None):
+    """
+    Output the code as a binary image, with the symbol table attached, and the
+    contents of any other banks after that.
+    """
+
+    symbols = {label: addr & 0xffff for label, addr in sym.items()}
+    outputfile.write(image.dump(code, 0, symbols, banks))
+
+
+def assemble(source, sym=None, banks=None, optimized=False):
+    """
+    Assemble source code into machine code.
+
+    source is either a string or an iterable of lines. If sym is given, it is
+    filled in with the label symbol table. If banks is given, BANK directives
+    are allowed, and it is filled in with bank number -> bytearray. If
+    optimized is true, the code is run through optimize().
+
+    Returns the machine code (of bank 0) as bytes.
+    """
+
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    if sym is None:
+        sym = {}
+
+    code = bytearray()
+    fixups = []
+    items = [] if optimized else None
+    main_labels = set() if optimized else None
+
+    pass1(source, sym, code, fixups, banks=banks, items=items, main_labels=main_labels)
+    if optimized:
+        optimize(sym, code, fixups, items, main_labels)
+    apply_fixups(sym, code, fixups, banks)
+
+    return bytes(code)
+
+
+def assemble_file(inputfile, outputfile, binary=False, optimized=False):
+    """
+    Assemble an open source file into an open output file: a binary image if
+    binary is true (outputfile must be opened in binary mode), else a text
+    listing.
+    """
 
     # Set up the symbol table
     sym = {}
 
-    # Set up the machine code output
-    code = []
+    # Set up the machine code output, and the symbolic operands to patch
+    code = bytearray()
+    fixups = []
+
+    # Instructions, data and the labels of bank 0, for the optimizer
+    items = [] if optimized else None
+    main_labels = set() if optimized else None
 
     # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+    if binary:
+        banks = {}
+        pass1(inputfile, sym, code, fixups, banks=banks, items=items,
+              main_labels=main_labels)
+        if optimized:
+            optimize(sym, code, fixups, items, main_labels)
+        apply_fixups(sym, code, fixups, banks)
+        pass2_image(outputfile, sym, code, banks)
+    else:
+        listing = Listing(labels={}, comments={})
+        pass1(inputfile, sym, code, fixups, listing, items=items,
+              main_labels=main_labels)
+        if optimized:
+            optimize(sym, code, fixups, items, main_labels, listing)
+        apply_fixups(sym, code, fixups)
+        pass2(outputfile, code, listing)
+
+
+def main(argv):
+    # Parse command line
+    inputfile, outputfile, optimized = parse_commandline(argv)
+    binary = outputfile.endswith(IMAGE_EXTENSION)
+
+    # Open files
+    inputfile, outputfile = open_files(inputfile, outputfile, binary)
+
+    assemble_file(inputfile, outputfile, binary, optimized)
 
     return 0
 
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# Incremental, parallel build of LS-8 assembler sources
+#
+# Usage: build.py [-j JOBS] [-O] [--image] [--force] [--output-dir DIR]
+#                 [--cache-dir DIR] [sources ...]
+#
+# With no sources, every .asm file next to this script is built into
+# ../ls8/examples, except those whose example is written by hand.
+#
+# Every source is hashed together with the assembler itself and the build
+# options. A source whose hash matches the one its output was last built from
+# is skipped. Outputs are also kept in the cache directory by hash, so a
+# source changed back to an earlier version is copied rather than assembled
+# again. Everything else is assembled in parallel on a pool of worker
+# processes, each importing the assembler once.
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr
+from pathlib import Path
+
+import asm
+
+HERE = Path(__file__).resolve().parent
+DEFAULT_OUTPUT_DIR = HERE.parent / "ls8" / "examples"
+DEFAULT_CACHE_DIR = HERE / ".build-cache"
+
+# Examples in ../ls8/examples that are written by hand rather than assembled,
+# by name -- the default build leaves their sources out
+HAND_WRITTEN = {"print8"}
+
+# output path -> hash it was built from
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Outputs built by any other version of the assembler, or of the image format
+# it writes through, are stale
+ASSEMBLER_VERSION = hashlib.sha256(
+    Path(asm.__file__).read_bytes() + Path(asm.image.__file__).read_bytes()).hexdigest()
+
+# What a build did
+# * assembled -- number of sources assembled
+# * cached -- number of outputs copied from the cache
+# * up_to_date -- number of outputs that were already current
+# * failed -- (source, error message) of every source that didn't assemble
+BuildSummary = namedtuple(
+    "BuildSummary", ["assembled", "cached", "up_to_date", "failed"])
+
+
+def source_hash(source, binary, optimized):
+    """
+    The cache key of a source (bytes), for the given build options.
+    """
+
+    h = hashlib.sha256(ASSEMBLER_VERSION.encode())
+    h.update(f"\0binary={binary:d}\0optimized={optimized:d}\0".encode())
+    h.update(source)
+    return h.hexdigest()
+
+
+def build(source, binary, optimized):
+    """
+    Assemble a source (bytes) in memory.
+
+    Returns (output bytes, None), or (None, error message) if it doesn't
+    assemble. Runs in a worker process.
+    """
+
+    errors = io.StringIO()
+    output = io.BytesIO() if binary else io.StringIO()
+
+    try:
+        with redirect_stderr(errors):
+            asm.assemble_file(io.StringIO(source.decode()), output, binary, optimized)
+
+    except SystemExit:
+        # The assembler reports errors on stderr, then exits
+        return None, errors.getvalue().strip() or "assembly failed"
+
+    except ValueError as e:
+        return None, str(e)
+
+    data = output.getvalue()
+    return (data if binary else data.encode()), None
+
+
+def object_path(objects, key):
+    """
+    Where the output for a cache key is kept: fanned out by the first two hex
+    digits of the key, so no single directory gets too large.
+    """
+
+    return objects / key[:2] / key[2:]
+
+
+def write_atomically(path, data):
+    """
+    Write data to path through a temporary file, so an interrupted build
+    never leaves a partial output behind.
+    """
+
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+def load_manifest(cache_dir):
+    """
+    The manifest in cache_dir, or an empty one if there isn't a usable one.
+    """
+
+    try:
+        with open(cache_dir / MANIFEST_NAME) as f:
+            manifest = json.load(f)
+
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return {}
+
+    return manifest.get("outputs", {})
+
+
+def default_sources():
+    """
+    Every .asm file next to this script, but for those of hand-written
+    examples.
+    """
+
+    return [path for path in sorted(HERE.glob("*.asm")) if path.stem not in HAND_WRITTEN]
+
+
+def build_all(sources, output_dir=DEFAULT_OUTPUT_DIR, cache_dir=DEFAULT_CACHE_DIR,
+              jobs=None, binary=False, optimized=False, force=False):
+    """
+    Bring the output of every source in output_dir up to date.
+
+    jobs is the number of worker processes (default: one per CPU). If force
+    is true, every source is assembled again, cached or not.
+
+    Returns a BuildSummary.
+    """
+
+    output_dir = Path(output_dir).resolve()
+    cache_dir = Path(cache_dir)
+    objects = cache_dir / "objects"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    objects.mkdir(parents=True, exist_ok=True)
+
+    manifest = load_manifest(cache_dir)
+    extension = asm.IMAGE_EXTENSION if binary else ".ls8"
+    cached = up_to_date = 0
+
+    # (source path, source bytes, key, output path) of everything to assemble
+    stale = []
+
+    for path in map(Path, sources):
+        source = path.read_bytes()
+        key = source_hash(source, binary, optimized)
+        output = output_dir / (path.stem + extension)
+
+        if not force and manifest.get(str(output)) == key and output.exists():
+            up_to_date += 1
+
+        elif not force and object_path(objects, key).exists():
+            write_atomically(output, object_path(objects, key).read_bytes())
+            manifest[str(output)] = key
+            cached += 1
+
+        else:
+            stale.append((path, source, key, output))
+
+    if len(stale) > 1 and jobs != 1:
+        jobs = jobs or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(
+                build,
+                [source for _, source, _, _ in stale],
+                [binary] * len(stale),
+                [optimized] * len(stale),
+                chunksize=max(1, len(stale) // (jobs * 4))))
+    else:
+        results = [build(source, binary, optimized) for _, source, _, _ in stale]
+
+    failed = []
+
+    for (path, _, key, output), (data, error) in zip(stale, results):
+        if error is not None:
+            failed.append((str(path), error))
+            manifest.pop(str(output), None)
+            continue
+
+        cached_output = object_path(objects, key)
+        cached_output.parent.mkdir(exist_ok=True)
+        write_atomically(cached_output, data)
+        write_atomically(output, data)
+        manifest[str(output)] = key
+
+    write_atomically(cache_dir / MANIFEST_NAME, json.dumps(
+        {"version": MANIFEST_VERSION, "outputs": manifest}, indent=1).encode())
+
+    return BuildSummary(len(stale) - len(failed), cached, up_to_date, failed)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="assemble LS-8 sources, skipping those that haven't changed")
+    parser.add_argument(
+        "sources", nargs="*",
+        help="sources to build (default: every .asm file next to this script, "
+             "but for those of hand-written examples)")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="number of worker processes (default: one per CPU)")
+    parser.add_argument(
+        "-O", dest="optimized", action="store_true",
+        help="run the peephole optimizer")
+    parser.add_argument(
+        "--image", action="store_true",
+        help=f"build binary {asm.IMAGE_EXTENSION} images instead of .ls8 listings")
+    parser.add_argument(
+        "--force", action="store_true",
+        help="assemble everything, even if it is up to date")
+    parser.add_argument(
+        "--output-dir", default=DEFAULT_OUTPUT_DIR,
+        help="where to write the outputs (default: %(default)s)")
+    parser.add_argument(
+        "--cache-dir", default=DEFAULT_CACHE_DIR,
+        help="where to keep the build cache (default: %(default)s)")
+    args = parser.parse_args(argv[1:])
+
+    sources = args.sources or default_sources()
+
+    summary = build_all(
+        sources, args.output_dir, args.cache_dir, args.jobs,
+        args.image, args.optimized, args.force)
+
+    for source, error in summary.failed:
+        print(f"{source}: {error}", file=sys.stderr)
+
+    print(f"{summary.assembled} assembled, {summary.cached} from cache, "
+          f"{summary.up_to_date} up to date, {len(summary.failed)} failed",
+          file=sys.stderr)
+
+    return 1 if summary.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
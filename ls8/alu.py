@@ -1,9 +1,15 @@
 """Arithmetic & Logic Operations"""
 __author__ = "Chaz Kiker"
 
+from functools import partial
+
 from utils import BColors
 
 
+class DivisionByZero(ArithmeticError):
+    """raised by DIV and MOD when the divisor is 0"""
+
+
 class AluOperations:
     ADD = 0b10100000
     AND = 0b10101000
@@ -18,92 +24,78 @@ class AluOperations:
     SUB = 0b10100001
     SHR = 0b10101101
     SHL = 0b10101100
-    XOR = 10101011
+    XOR = 0b10101011
+
+
+_BYTES = range(256)
+
+# precomputed results of the two-register operations, wrapped to 8 bits
+# the result of `op a, b` is TABLES[op][a << 8 | b]
+TABLES = {
+    AluOperations.ADD: bytes([(a + b) & 0xFF for a in _BYTES for b in _BYTES]),
+    AluOperations.SUB: bytes([(a - b) & 0xFF for a in _BYTES for b in _BYTES]),
+    AluOperations.MUL: bytes([(a * b) & 0xFF for a in _BYTES for b in _BYTES]),
+    AluOperations.AND: bytes([a & b for a in _BYTES for b in _BYTES]),
+    AluOperations.OR: bytes([a | b for a in _BYTES for b in _BYTES]),
+    AluOperations.XOR: bytes([a ^ b for a in _BYTES for b in _BYTES]),
+    AluOperations.SHL: bytes([(a << b) & 0xFF if b < 8 else 0 for a in _BYTES for b in _BYTES]),
+    AluOperations.SHR: bytes([a >> b for a in _BYTES for b in _BYTES]),
+}
 
 
 class Alu:
-    def __init__(self):
+    """operates on the CPU's register file
+
+    Every operation takes register numbers, reads the values from the register file and
+    writes the 8-bit result back into registerA.
+    """
+
+    def __init__(self, reg):
+        """
+        :param reg: the register file (R0-R7) to operate on
+        """
+        self.reg = reg
         self.branch_table = {
-            AluOperations.ADD: self.add,
-            AluOperations.MUL: self.mul,
-            AluOperations.XOR: self.xor,
-            AluOperations.SUB: self.sub,
-            AluOperations.SHR: self.shr,
-            AluOperations.SHL: self.shl,
-            AluOperations.AND: self.alu_and,
             AluOperations.CMP: self.cmp,
             AluOperations.DEC: self.dec,
             AluOperations.DIV: self.div,
             AluOperations.INC: self.inc,
-            AluOperations.OR: self.alu_or,
             AluOperations.NOT: self.alu_not,
             AluOperations.MOD: self.mod,
         }
+        for op, table in TABLES.items():
+            self.branch_table[op] = partial(self.binary, table)
 
-    def __call__(self, op, reg_a, reg_b, *args, **kwargs):
+    def __call__(self, op, reg_a, reg_b=None, *args, **kwargs):
         if op not in self.branch_table:
             raise Exception(f"{BColors.FAIL}Unsupported ALU operation{BColors.END_}")
         else:
             return self.branch_table[op](reg_a, reg_b)
 
-    @staticmethod
-    def add(a, b):
-        a += b
-
-    @staticmethod
-    def mul(a, b):
-        a *= b
+    def binary(self, table, reg_a, reg_b):
+        """look the result of a two-register operation up in its table"""
+        reg = self.reg
+        reg[reg_a] = table[reg[reg_a] << 8 | reg[reg_b]]
 
-    @staticmethod
-    def xor(a, b):
-        a ^= b
-
-    @staticmethod
-    def sub(a, b):
-        a -= b
+    def cmp(self, reg_a, reg_b):
+        a, b = self.reg[reg_a], self.reg[reg_b]
+        return 0 if a == b else 1 if a > b else -1
 
-    @staticmethod
-    def shr(a, b):
-        a >>= b
+    def dec(self, reg_a, _=None):
+        self.reg[reg_a] = (self.reg[reg_a] - 1) & 0xFF
 
-    @staticmethod
-    def shl(a, b):
-        a <<= b
+    def div(self, reg_a, reg_b):
+        if self.reg[reg_b] == 0:
+            raise DivisionByZero("CANNOT DIVIDE BY ZERO")
+        self.reg[reg_a] //= self.reg[reg_b]
 
-    @staticmethod
-    def alu_and(a, b):
-        a &= b
+    def inc(self, reg_a, _=None):
+        self.reg[reg_a] = (self.reg[reg_a] + 1) & 0xFF
 
-    @staticmethod
-    def cmp(a, b):
-        return 0 if a == b else 1 if a > b else -1
+    def mod(self, reg_a, reg_b):
+        if self.reg[reg_b] == 0:
+            raise DivisionByZero("CANNOT DIVIDE BY ZERO")
+        self.reg[reg_a] %= self.reg[reg_b]
 
-    @staticmethod
-    def dec(a, _):
-        a -= 1
-
-    @staticmethod
-    def div(a, b):
-        if b == 0:
-            print(f"{BColors.WARNING}{BColors.BOLD}CANNOT DIVIDE BY ZERO{BColors.END_}")
-            exit()
-        a /= b
-
-    @staticmethod
-    def inc(a, _):
-        a += 1
-
-    @staticmethod
-    def mod(a, b):
-        if b == 0:
-            print(f"{BColors.WARNING}{BColors.BOLD}CANNOT DIVIDE BY ZERO{BColors.END_}")
-            exit()
-        a %= b
-
-    @staticmethod
-    def alu_not(a, _):
-        a = ~a
-
-    @staticmethod
-    def alu_or(a, b):
-        a |= b
+    def alu_not(self, reg_a, _=None):
+        self.reg[reg_a] = ~self.reg[reg_a] & 0xFF
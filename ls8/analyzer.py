@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""Static control-flow and stack-depth analysis of LS-8 programs
+
+Usage: analyzer.py program
+
+Follows every path through a program from address 0 without running it, tracking which
+registers hold known constants -- enough to resolve the `LDI Rn,Label` / `JMP Rn` and
+`CALL Rn` idiom every assembled program uses. From that it recovers:
+
+* the control-flow graph, split into the main program, its subroutines and any interrupt
+  handlers installed with `ST` into the vector table
+* the worst-case stack depth of each of them, and of the whole program (counting one
+  interrupt frame on top of the main program if handlers are installed)
+* hazards: stack growth around a loop, recursion, unbalanced PUSH/POP, jumps and stores
+  through registers that aren't known, stores into code, and the stack running down into
+  the program or its data
+
+A program with no hazards is "safe": its stack is bounded, stays clear of everything
+loaded below it, and nothing ever writes to its code. `CPU.enable_fast_path()` takes the
+analysis of such a program and drops the runtime guards that keep cached instructions
+coherent with RAM.
+"""
+__author__ = "Chaz Kiker"
+
+import sys
+from collections import namedtuple
+
+from alu import TABLES, Alu, AluOperations
+from cpu import (
+    CPU, INTERRUPT_VECTORS, IM, CALL, HLT, IRET, JEQ, JGE, JGT, JLE, JLT, JMP, JNE, LD, LDI,
+    POP, PUSH, RET, ST,
+)
+
+# the initial stack pointer -- the stack grows down from just below it
+STACK_TOP = 0xF4
+
+# bytes pushed when an interrupt is serviced: PC, FL and R0-R6
+INTERRUPT_FRAME = 9
+
+# the analysis is repeated as subroutines and their effects on registers are discovered;
+# it settles in a handful of passes, this is only a backstop
+MAX_PASSES = 64
+
+CONDITIONAL_JUMPS = {JEQ, JGE, JGT, JLE, JLT, JNE}
+
+# every opcode the CPU has a handler for
+VALID_OPCODES = frozenset(CPU().branch_table) | frozenset(Alu(bytearray(8)).branch_table)
+
+# kinds of Function
+MAIN = "main"
+SUBROUTINE = "subroutine"
+INTERRUPT = "interrupt"
+
+# a hazard found in the program
+# * address -- the instruction it was found at (None for the program as a whole)
+# * message -- what's wrong
+Issue = namedtuple("Issue", ["address", "message"])
+
+# the main program, a subroutine or an interrupt handler
+# * entry -- address of its first instruction
+# * kind -- MAIN, SUBROUTINE or INTERRUPT
+# * instructions -- sorted addresses of every instruction reachable from entry without a CALL
+# * calls -- (call site, target) of every CALL it makes
+# * max_depth -- worst-case bytes it puts on the stack, including its callees (None if unbounded)
+Function = namedtuple("Function", ["entry", "kind", "instructions", "calls", "max_depth"])
+
+# the result of analyze()
+# * functions -- entry address -> Function
+# * cfg -- instruction address -> addresses control can pass to next (CALLs continue after the call)
+# * code -- every address holding a byte of a reachable instruction
+# * program_end -- the address just past the program and its data
+# * max_depth -- worst-case bytes on the stack over the whole run (None if unbounded)
+# * issues -- sorted list of Issues
+# * safe -- True if there are no issues
+Analysis = namedtuple(
+    "Analysis", ["functions", "cfg", "code", "program_end", "max_depth", "issues", "safe"]
+)
+
+
+def entry_value(register):
+    """the unknown value a register held when the current subroutine was called"""
+    return "entry", register
+
+
+def merge(a, b):
+    """combine two abstract values (a constant, an entry value or None for unknown)"""
+    return a if a == b else None
+
+
+def merge_all(a, b):
+    return tuple(merge(x, y) for x, y in zip(a, b))
+
+
+class Analyzer:
+    """the state of one analysis -- use analyze()"""
+
+    def __init__(self, ram):
+        self.ram = bytes(ram)
+        # entry address -> kind, for every function found so far
+        self.entries = {0: MAIN}
+        # entry address -> merged register values at its RETs (missing until one is reached)
+        self.summaries = {}
+        # entry address -> merged register values at every CALL of it, resolved to constants
+        self.contexts = {}
+
+    def run(self, program_end):
+        for _ in range(MAX_PASSES):
+            known = dict(self.entries), dict(self.summaries), dict(self.contexts)
+            traces = {entry: self.trace(entry, kind) for entry, kind in known[0].items()}
+            # tracing finds new subroutines and handlers, what they're called with and what
+            # they leave in registers
+            if known == (self.entries, self.summaries, self.contexts):
+                break
+        return self.finish(traces, program_end)
+
+    def trace(self, entry, kind):
+        """follow every path through one function
+
+        :returns: a dict with the function's states, edges, calls, stores and issues
+        """
+        if kind == MAIN:
+            # the CPU starts out with every register cleared, except R7
+            regs = (0,) * 7 + (STACK_TOP,)
+        elif kind == SUBROUTINE:
+            regs = tuple(entry_value(register) for register in range(8))
+        else:
+            # an interrupt can arrive anywhere
+            regs = (None,) * 8
+
+        trace = {
+            "states": {entry: (regs, ())},
+            "edges": {},
+            "calls": {},
+            "stores": {},
+            "issues": set(),
+            "exits": None,
+            "growing": False,
+        }
+        worklist = [entry]
+        while worklist:
+            address = worklist.pop()
+            for successor, state in self.step(address, entry, kind, trace):
+                self.flow(trace, worklist, successor, state)
+        return trace
+
+    @staticmethod
+    def flow(trace, worklist, address, state):
+        """merge state into what's known at address, queueing it again if that changed"""
+        states = trace["states"]
+        old = states.get(address)
+        if old is None:
+            states[address] = state
+            worklist.append(address)
+        elif len(state[1]) > len(old[1]):
+            trace["issues"].add(Issue(address, "stack grows on every pass through here"))
+            trace["growing"] = True
+        elif len(state[1]) < len(old[1]):
+            trace["issues"].add(Issue(address, "reached with different stack depths"))
+        else:
+            merged = (merge_all(old[0], state[0]), merge_all(old[1], state[1]))
+            if merged != old:
+                states[address] = merged
+                worklist.append(address)
+
+    def step(self, address, entry, kind, trace):
+        """the effect of the instruction at address
+
+        :returns: a list of (successor address, (registers, stack)) pairs
+        """
+        regs, stack = trace["states"][address]
+        issues = trace["issues"]
+
+        ir = self.ram[address]
+        num_ops = ir >> 6
+        next_address = address + 1 + num_ops
+        if ir not in VALID_OPCODES:
+            issues.add(Issue(address, f"illegal instruction {ir:08b}"))
+            trace["edges"][address] = ()
+            return []
+        if address + 2 >= len(self.ram):
+            issues.add(Issue(address, "runs off the end of memory"))
+            trace["edges"][address] = ()
+            return []
+
+        op_a, op_b = self.ram[address + 1], self.ram[address + 2]
+        a = op_a & 0b111
+        b = op_b & 0b111
+        regs = list(regs)
+        successors = []
+
+        def resolve(value):
+            # what a register value is known to be, given what the function is called with
+            if isinstance(value, tuple):
+                return self.contexts.get(entry, (None,) * 8)[value[1]]
+            return value
+
+        if ir == HLT:
+            pass
+        elif ir == LDI:
+            regs[a] = op_b
+            successors.append(next_address)
+        elif ir == LD:
+            regs[a] = None
+            successors.append(next_address)
+        elif ir == ST:
+            target = trace["stores"][address] = resolve(regs[a])
+            if isinstance(target, int) and target >= INTERRUPT_VECTORS:
+                # installing an interrupt handler
+                if isinstance(resolve(regs[b]), int):
+                    self.entries.setdefault(resolve(regs[b]), INTERRUPT)
+                else:
+                    issues.add(Issue(address, "installs an interrupt handler whose address isn't known"))
+            successors.append(next_address)
+        elif ir == PUSH:
+            stack = stack + (regs[a],)
+            successors.append(next_address)
+        elif ir == POP:
+            if stack:
+                regs[a], stack = stack[-1], stack[:-1]
+            else:
+                issues.add(Issue(address, "pops more than it pushed"))
+                return self.stop(trace, address)
+            successors.append(next_address)
+        elif ir == CALL:
+            target = resolve(regs[a])
+            if not isinstance(target, int):
+                issues.add(Issue(address, f"CALL through R{a}, which holds no known address"))
+                return self.stop(trace, address)
+            trace["calls"][address] = (target, len(stack))
+            self.entries.setdefault(target, SUBROUTINE)
+            context = tuple(resolve(value) for value in regs)
+            old = self.contexts.get(target)
+            self.contexts[target] = context if old is None else merge_all(old, context)
+            summary = self.summaries.get(target)
+            if summary is None:
+                # the callee hasn't been seen to return (yet)
+                return self.stop(trace, address)
+            regs = [regs[value[1]] if isinstance(value, tuple) else value for value in summary]
+            successors.append(next_address)
+        elif ir == RET:
+            if kind != SUBROUTINE:
+                issues.add(Issue(address, "RET outside a subroutine"))
+            elif stack:
+                issues.add(Issue(address, f"returns with {len(stack)} byte(s) still on the stack"))
+            else:
+                exits = trace["exits"]
+                trace["exits"] = self.summaries[entry] = tuple(regs) if exits is None else merge_all(exits, regs)
+        elif ir == IRET:
+            if kind != INTERRUPT:
+                issues.add(Issue(address, "IRET outside an interrupt handler"))
+            elif stack:
+                issues.add(Issue(address, f"IRET with {len(stack)} byte(s) still on the stack"))
+        elif ir == JMP or ir in CONDITIONAL_JUMPS:
+            target = resolve(regs[a])
+            if isinstance(target, int):
+                successors.append(target)
+            else:
+                issues.add(Issue(address, f"jump through R{a}, which holds no known address"))
+            if ir != JMP:
+                successors.append(next_address)
+        elif ir in TABLES:
+            if isinstance(regs[a], int) and isinstance(regs[b], int):
+                regs[a] = TABLES[ir][regs[a] << 8 | regs[b]]
+            elif a == b and ir in (AluOperations.SUB, AluOperations.XOR):
+                regs[a] = 0
+            else:
+                regs[a] = None
+            successors.append(next_address)
+        elif ir in (AluOperations.INC, AluOperations.DEC, AluOperations.NOT):
+            value = regs[a]
+            if isinstance(value, int):
+                if ir == AluOperations.INC:
+                    regs[a] = (value + 1) & 0xFF
+                elif ir == AluOperations.DEC:
+                    regs[a] = (value - 1) & 0xFF
+                else:
+                    regs[a] = ~value & 0xFF
+            else:
+                regs[a] = None
+            successors.append(next_address)
+        elif ir in (AluOperations.DIV, AluOperations.MOD):
+            regs[a] = None
+            successors.append(next_address)
+        else:
+            # NOP, PRN, PRA, CMP, INT -- no effect on registers or the stack
+            successors.append(next_address)
+
+        trace["edges"][address] = tuple(successors)
+        state = (tuple(regs), stack)
+        return [(successor, state) for successor in successors]
+
+    @staticmethod
+    def stop(trace, address):
+        """end the path at address"""
+        trace["edges"][address] = ()
+        return []
+
+    def finish(self, traces, program_end):
+        issues = set()
+        cfg = {}
+        code = set()
+        stores = []
+        interrupts_enabled = False
+        for trace in traces.values():
+            issues |= trace["issues"]
+            cfg.update(trace["edges"])
+            stores.extend(trace["stores"].items())
+            for address in trace["edges"]:
+                code.update(range(address, address + 1 + (self.ram[address] >> 6)))
+            # IM holding anything but 0 (or whatever it held on entry to a subroutine)
+            interrupts_enabled |= any(
+                regs[IM] is None or isinstance(regs[IM], int) and regs[IM] for regs, _ in trace["states"].values()
+            )
+
+        handlers = [entry for entry in traces if self.entries[entry] == INTERRUPT]
+        if interrupts_enabled and not handlers:
+            issues.add(Issue(None, "may enable interrupts without installing a handler"))
+
+        depths = {}
+        functions = {}
+        for entry in traces:
+            depth = self.worst_depth(entry, traces, depths, (), issues)
+            trace = traces[entry]
+            functions[entry] = Function(
+                entry,
+                self.entries[entry],
+                tuple(sorted(trace["edges"])),
+                tuple((site, target) for site, (target, _) in sorted(trace["calls"].items())),
+                depth,
+            )
+
+        max_depth = depths[0]
+        if max_depth is not None and handlers:
+            handler_depths = [depths[entry] for entry in handlers]
+            if None in handler_depths:
+                max_depth = None
+            else:
+                max_depth += INTERRUPT_FRAME + max(handler_depths)
+
+        if max_depth is not None:
+            stack_bottom = STACK_TOP - max_depth
+            program_top = max([program_end, *(address + 1 for address in code)])
+            if program_top > stack_bottom:
+                issues.add(Issue(
+                    None,
+                    f"the stack reaches down to {stack_bottom:#04x}, into the program (which ends at {program_top:#04x})"
+                ))
+        else:
+            stack_bottom = None
+
+        for address, target in stores:
+            if not isinstance(target, int):
+                issues.add(Issue(address, "ST to an address that isn't known -- it may overwrite code"))
+            elif target in code:
+                issues.add(Issue(address, f"ST overwrites code at {target:#04x}"))
+            elif stack_bottom is not None and stack_bottom <= target < STACK_TOP:
+                issues.add(Issue(address, f"ST to {target:#04x}, inside the stack"))
+
+        issues = sorted(issues, key=lambda issue: (issue.address is not None, issue.address or 0, issue.message))
+        return Analysis(
+            functions, cfg, frozenset(code), program_end, max_depth, issues, not issues
+        )
+
+    def worst_depth(self, entry, traces, depths, active, issues):
+        """worst-case stack depth of a function, including its callees (None if unbounded)"""
+        if entry in depths:
+            return depths[entry]
+
+        trace = traces[entry]
+        depth = None
+        if not trace["growing"]:
+            depth = max(len(stack) for _, stack in trace["states"].values())
+            for site, (target, site_depth) in sorted(trace["calls"].items()):
+                if target in active or target == entry:
+                    issues.add(Issue(site, "recursive call -- stack depth isn't bounded"))
+                    depth = None
+                    break
+                callee = self.worst_depth(target, traces, depths, active + (entry,), issues)
+                if callee is None:
+                    depth = None
+                    break
+                # CALL pushes the return address
+                depth = max(depth, site_depth + 1 + callee)
+        depths[entry] = depth
+        return depth
+
+
+def analyze(ram, program_end=None):
+    """analyze the program loaded at address 0 of ram
+
+    :param ram: the machine's memory, e.g. `CPU.ram` after loading a program
+    :param program_end: the address just past the program and its data (default: just past
+        the last nonzero byte below the stack)
+    :returns: an Analysis
+    """
+    if program_end is None:
+        program_end = max((address + 1 for address in range(STACK_TOP) if ram[address]), default=0)
+    return Analyzer(ram).run(program_end)
+
+
+def report(analysis, symbols=None, file=None):
+    """print an analysis in human-readable form
+
+    :param symbols: label name -> address, to name functions and addresses by
+    """
+    file = file or sys.stdout
+    names = {}
+    for name, address in (symbols or {}).items():
+        names.setdefault(address, name)
+
+    def where(address):
+        name = names.get(address)
+        return f"{address:#04x}" if name is None else f"{address:#04x} ({name})"
+
+    def depth(value):
+        return "unbounded" if value is None else f"{value} byte(s)"
+
+    for entry, function in sorted(analysis.functions.items()):
+        print(f"{function.kind} {where(entry)}: max stack depth {depth(function.max_depth)}", file=file)
+        print(f"  {len(function.instructions)} instruction(s)", file=file)
+        for site, target in function.calls:
+            print(f"  {site:#04x}: CALL {where(target)}", file=file)
+
+    print(f"program ends at {analysis.program_end:#04x}", file=file)
+    print(f"max stack depth: {depth(analysis.max_depth)}", file=file)
+    for issue in analysis.issues:
+        location = "program" if issue.address is None else where(issue.address)
+        print(f"{location}: {issue.message}", file=file)
+    print("safe" if analysis.safe else f"{len(analysis.issues)} issue(s) found -- not proven safe", file=file)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: analyzer.py program", file=sys.stderr)
+        return 2
+
+    cpu = CPU()
+    cpu.load_file(argv[0])
+    analysis = analyze(cpu.ram)
+    report(analysis, cpu.symbols)
+    return 0 if analysis.safe else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Headless batch runner -- runs many LS-8 programs across a process pool."""
+__author__ = "Chaz Kiker"
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import image
+from cpu import CPU
+
+DEFAULT_MAX_CYCLES = 1_000_000
+DEFAULT_TIMEOUT = 10.0
+
+# exit reason for programs that failed to load or crashed the emulator
+# (every other exit reason is a `cpu.RunResult` stop reason)
+ERROR = "error"
+
+# the outcome of running a single program
+# * path -- the program that was run
+# * exit_reason -- a CPU stop reason (see cpu.RunResult) or ERROR
+# * cycles -- number of instructions executed
+# * output -- everything the program printed
+# * registers -- the final values of R0-R7
+# * pc -- the final value of PC
+# * error -- a description of the error, if exit_reason is ERROR
+BatchResult = namedtuple(
+    "BatchResult",
+    ["path", "exit_reason", "cycles", "output", "registers", "pc", "error"]
+)
+
+
+def collect_programs(source):
+    """find the programs to run
+
+    :param source: a directory (searched recursively for `.ls8`/`.ls8b` files) or a manifest
+        file listing one program path per line, relative to the manifest
+    :returns: a list of program paths
+    """
+    source = Path(source)
+    if source.is_dir():
+        return [
+            str(path) for path in sorted(source.rglob("*"))
+            if path.suffix in (".ls8", image.EXTENSION)
+        ]
+
+    with open(source) as manifest:
+        return [
+            str(source.parent / line.strip())
+            for line in manifest
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def run_program(path, max_cycles=DEFAULT_MAX_CYCLES, timeout=DEFAULT_TIMEOUT):
+    """run a single program to completion, or until it exhausts its budget
+
+    :param path: path to the `.ls8` program or `.ls8b` image
+    :param max_cycles: maximum number of instructions to execute
+    :param timeout: maximum number of wall-clock seconds to run for
+    :returns: a BatchResult
+    """
+    cpu = CPU()
+    output = io.StringIO()
+
+    try:
+        cpu.load_file(path)
+    except (OSError, ValueError, IndexError) as e:
+        return BatchResult(path, ERROR, 0, "", list(cpu.reg), cpu.pc, f"{type(e).__name__}: {e}")
+
+    try:
+        result = cpu.run(max_cycles=max_cycles, deadline=time.monotonic() + timeout, output=output)
+    except Exception as e:
+        # the CPU doesn't report how far it got when it crashes
+        return BatchResult(
+            path, ERROR, None, output.getvalue(), list(cpu.reg), cpu.pc, f"{type(e).__name__}: {e}"
+        )
+
+    return BatchResult(
+        path, result.stop_reason, result.cycles, output.getvalue(), list(cpu.reg), cpu.pc, None
+    )
+
+
+def _run_program(args):
+    return run_program(*args)
+
+
+def run_batch(paths, max_cycles=DEFAULT_MAX_CYCLES, timeout=DEFAULT_TIMEOUT, workers=None):
+    """run every program in a process pool
+
+    :param paths: the programs to run
+    :param max_cycles: per-program instruction budget
+    :param timeout: per-program wall-clock budget, in seconds
+    :param workers: number of worker processes (defaults to the number of cores)
+    :returns: a generator of BatchResults, in the same order as paths
+    """
+    workers = workers or os.cpu_count() or 1
+    # hand out programs in chunks so short programs don't drown in IPC overhead
+    chunksize = max(1, len(paths) // (workers * 4))
+    jobs = [(path, max_cycles, timeout) for path in paths]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_run_program, jobs, chunksize=chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run a corpus of LS-8 programs")
+    parser.add_argument("source", help="a directory of .ls8/.ls8b files, or a manifest listing them")
+    parser.add_argument("--max-cycles", type=int, default=DEFAULT_MAX_CYCLES)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per program")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    args = parser.parse_args(argv)
+
+    paths = collect_programs(args.source)
+    counts = {}
+    # one JSON record per line on stdout, summary on stderr
+    for result in run_batch(paths, args.max_cycles, args.timeout, args.workers):
+        counts[result.exit_reason] = counts.get(result.exit_reason, 0) + 1
+        print(json.dumps(result._asdict()))
+
+    summary = ", ".join(f"{reason}: {count}" for reason, count in sorted(counts.items()))
+    print(f"ran {len(paths)} programs ({summary})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
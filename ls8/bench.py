@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the LS-8 emulator and assembler
+
+Usage: bench.py [--output FILE] [--baseline FILE] [--threshold FRACTION]
+
+Measures:
+
+* instructions per second of `CPU.run()` (and the block engine) on synthetic workloads
+* assembly time of `asm/asm.py` on a large generated source
+* `CPU.load_file()` time for full-memory text programs and binary images
+
+Results are written as JSON. Given a baseline (the JSON of an earlier run), every
+benchmark is compared against it and the exit status is 1 if any of them regressed by
+more than the threshold.
+"""
+__author__ = "Chaz Kiker"
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from blocks import BlockEngine
+from cpu import CPU
+
+# the assembler lives in asm/, next to this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "asm"))
+import asm  # noqa: E402
+
+DEFAULT_CYCLES = 200_000
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.10
+# number of repeated chunks in the generated assembler source
+DEFAULT_SOURCE_SIZE = 2000
+# chunks of generated source that fit in one 256-byte bank (19 bytes each)
+CHUNKS_PER_BANK = 13
+# number of loads timed per repetition of a load benchmark
+LOADS_PER_REPEAT = 200
+
+RESULTS_VERSION = 1
+
+# a single measurement
+# * value -- the best result over every repetition
+# * unit -- what value measures
+# * higher_is_better -- True for rates, False for durations
+Measurement = namedtuple("Measurement", ["value", "unit", "higher_is_better"])
+
+# a benchmark that got worse than the baseline by more than the threshold
+# * change -- relative change, positive meaning slower
+Regression = namedtuple("Regression", ["name", "baseline", "current", "change"])
+
+# synthetic workloads -- each loops forever, so it is run for a fixed cycle budget
+WORKLOADS = {
+    # a counter and a compare-and-branch
+    "tight_loop": """
+        LDI R1,Loop
+        LDI R2,0
+    Loop:
+        INC R0
+        CMP R0,R2
+        JNE R1
+        JMP R1
+    """,
+    # recursion 16 calls deep, over and over
+    "call_recursion": """
+        LDI R2,Main
+        LDI R3,Recurse
+    Main:
+        LDI R0,16
+        CALL R3
+        JMP R2
+    Recurse:
+        LDI R1,Done
+        LDI R4,0
+        DEC R0
+        CMP R0,R4
+        JEQ R1
+        CALL R3
+    Done:
+        RET
+    """,
+    # bursts of pushes followed by as many pops
+    "stack_push_pop": """
+        LDI R1,Loop
+    Loop:
+        PUSH R0
+        PUSH R1
+        PUSH R0
+        PUSH R1
+        POP R2
+        POP R3
+        POP R2
+        POP R3
+        INC R0
+        JMP R1
+    """,
+    # every table-driven ALU operation, plus INC/DEC/NOT
+    "alu_arithmetic": """
+        LDI R1,Loop
+        LDI R2,3
+        LDI R3,7
+    Loop:
+        ADD R0,R2
+        MUL R0,R3
+        SUB R0,R2
+        XOR R0,R3
+        AND R0,R3
+        OR R0,R2
+        SHL R0,R2
+        SHR R0,R2
+        INC R2
+        DEC R3
+        NOT R0
+        JMP R1
+    """,
+}
+
+# ways to run a CPU, by name
+ENGINES = {
+    "interpreter": lambda cpu: cpu.run,
+    "blocks": lambda cpu: BlockEngine(cpu).run,
+}
+
+
+def best_time(function, repeat):
+    """the fastest of `repeat` timed calls to function, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_workload(program, engine, cycles, repeat):
+    """instructions per second for a program, run on a fresh CPU each repetition"""
+    best = 0.0
+    for _ in range(repeat):
+        cpu = CPU()
+        cpu.load_program(program)
+        run = ENGINES[engine](cpu)
+        start = time.perf_counter()
+        result = run(max_cycles=cycles)
+        elapsed = time.perf_counter() - start
+        best = max(best, result.cycles / elapsed)
+    return Measurement(best, "instructions/s", True)
+
+
+def generate_source(chunks):
+    """a large assembler source exercising labels, forward references, comments, data and banks
+
+    A bank holds 256 bytes, so the chunks are spread over as many banks as they need.
+    """
+    lines = ["; generated benchmark source", "    LDI R0,Start", "    JMP R0"]
+    for i in range(chunks):
+        if i % CHUNKS_PER_BANK == 0:
+            lines.append(f"BANK {1 + i // CHUNKS_PER_BANK}")
+        lines.extend([
+            f"Label{i}:        ; chunk {i}",
+            f"    LDI R{i % 7},{i % 256}",
+            f"    LDI R6,Label{i + 1}",
+            "    ADD R0,R1",
+            "    CMP R0,R1",
+            "    JNE R6",
+            "    PUSH R0",
+            "    POP R1",
+            f"    DB 0x{i % 256:02x}",
+        ])
+    lines.extend(["BANK 0", f"Label{chunks}:", "Start:", "    DS Hello, world!", "    HLT"])
+    return lines
+
+
+def bench_assembler(chunks, repeat):
+    """seconds to assemble the generated source"""
+    source = generate_source(chunks)
+    return Measurement(best_time(lambda: asm.assemble(source, banks={}), repeat), "s", False)
+
+
+def full_memory_program():
+    """a program filling all of RAM that can hold code, so every address gets decoded"""
+    body = "    LDI R0,1\n    ADD R0,R0\n" * 42
+    code = asm.assemble(body + "    HLT\n")
+    return code.ljust(254, b"\0")[:254]
+
+
+def bench_load(path, repeat):
+    """seconds per `CPU.load_file()` of the file at path"""
+    cpu = CPU()
+
+    def load():
+        for _ in range(LOADS_PER_REPEAT):
+            cpu.load_file(path)
+
+    return Measurement(best_time(load, repeat) / LOADS_PER_REPEAT, "s", False)
+
+
+def run_benchmarks(cycles=DEFAULT_CYCLES, repeat=DEFAULT_REPEAT, source_size=DEFAULT_SOURCE_SIZE):
+    """run every benchmark
+
+    :returns: a dict of benchmark name -> Measurement
+    """
+    results = {}
+    for name, source in WORKLOADS.items():
+        program = asm.assemble(source)
+        for engine in ENGINES:
+            results[f"cpu.{engine}.{name}"] = bench_workload(program, engine, cycles, repeat)
+
+    results["asm.assemble"] = bench_assembler(source_size, repeat)
+
+    code = full_memory_program()
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, "bench.ls8")
+        with open(text_path, "w") as file:
+            file.writelines(f"{byte:08b} # byte {address}\n" for address, byte in enumerate(code))
+
+        # an image with one symbol per byte, so the symbol table is as large as the payload
+        image_path = os.path.join(directory, "bench" + asm.IMAGE_EXTENSION)
+        with open(image_path, "wb") as file:
+            asm.pass2_image(file, {f"symbol_{address}": address for address in range(len(code))}, code)
+
+        results["load.text"] = bench_load(text_path, repeat)
+        results["load.image"] = bench_load(image_path, repeat)
+
+    return results
+
+
+def to_json(results):
+    """the results, with the environment they were measured in, as a JSON-serializable dict"""
+    return {
+        "version": RESULTS_VERSION,
+        "python": {
+            "version": platform.python_version(),
+            "implementation": platform.python_implementation(),
+        },
+        "platform": platform.platform(),
+        "benchmarks": {name: measurement._asdict() for name, measurement in results.items()},
+    }
+
+
+def compare(results, baseline, threshold):
+    """compare results against a baseline
+
+    :param results: a dict of benchmark name -> Measurement
+    :param baseline: an earlier run, as loaded from its JSON
+    :param threshold: the relative slowdown tolerated, e.g. 0.1 for 10%
+    :returns: a list of Regressions; benchmarks missing from the baseline are skipped
+    """
+    regressions = []
+    for name, measurement in results.items():
+        previous = baseline["benchmarks"].get(name)
+        if previous is None or not previous["value"]:
+            continue
+
+        change = (measurement.value - previous["value"]) / previous["value"]
+        if measurement.higher_is_better:
+            change = -change
+        if change > threshold:
+            regressions.append(Regression(name, previous["value"], measurement.value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the LS-8 emulator and assembler")
+    parser.add_argument("--output", metavar="FILE", help="where to write the JSON results (default: stdout)")
+    parser.add_argument("--baseline", metavar="FILE", help="JSON results of an earlier run to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="relative slowdown that counts as a regression (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cycles", type=int, default=DEFAULT_CYCLES,
+        help="instructions per CPU workload run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=DEFAULT_REPEAT,
+        help="repetitions per benchmark; the best is kept (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.cycles, args.repeat)
+
+    document = json.dumps(to_json(results), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(document + "\n")
+    else:
+        print(document)
+
+    # human-readable summary on stderr
+    for name, measurement in results.items():
+        print(f"{name:<32} {measurement.value:>16.6g} {measurement.unit}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression.name}: {regression.baseline:.6g} -> {regression.current:.6g} "
+                f"({100 * regression.change:.1f}% worse)",
+                file=sys.stderr
+            )
+        if regressions:
+            return 1
+        print(f"no regressions beyond {100 * args.threshold:.0f}%", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
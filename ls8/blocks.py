@@ -0,0 +1,202 @@
+"""Basic-block compiler for the LS-8 CPU"""
+__author__ = "Chaz Kiker"
+
+import time
+
+from alu import TABLES, DivisionByZero
+from cpu import (
+    inverse_table, Halt, Idle, IllegalInstruction, RunResult, HLT, LDI, NOP, POP, PUSH, ST,
+    CYCLE_LIMIT, DEADLINE, DIVIDE_BY_ZERO, HALTED, ILLEGAL_INSTRUCTION, MEMORY_ERRORS, MEMORY_FAULT,
+)
+
+# instructions that end a basic block
+# every instruction that sets the PC (JMP, JEQ, JNE, JGE, CALL, RET, ...) ends one as well
+BLOCK_TERMINATORS = {HLT}
+
+# handled instructions that write to memory, and so may invalidate the block they're in
+MEMORY_WRITES = {ST}
+
+
+class BlockEngine:
+    """runs a CPU one basic block at a time
+
+    The loaded program is split into basic blocks: straight-line runs of instructions
+    ending at the first instruction that sets the PC (or halts). Each block is compiled
+    into a single Python function that carries out the register, flag and memory effects
+    of the whole block in one call, so there is no per-instruction fetch or dispatch.
+
+    Compiled blocks live in `CPU.blocks`, indexed by their start address, and are dropped
+    by `CPU.invalidate()` whenever a write lands inside their address range.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+    def run(self, max_cycles=None, deadline=None, output=None):
+        """Run the CPU, block by block.
+
+        Takes the same arguments and returns the same RunResult as `CPU.run()`. Budgets
+        and interrupts are only checked between blocks, so a run may overshoot `max_cycles`
+        by at most one block.
+        """
+        cpu = self.cpu
+        if output is not None:
+            cpu.console.redirect(output)
+
+        blocks = cpu.blocks
+        console = cpu.console
+        limit = float("inf") if max_cycles is None else max_cycles
+        cycles = 0
+        block = None
+
+        try:
+            while cycles < limit:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return RunResult(DEADLINE, cycles)
+                console.poll()
+                if cpu.interrupt_pending:
+                    cpu.service_interrupts()
+                block = blocks[cpu.pc] or self.compile(cpu.pc)
+                try:
+                    cycles += block()
+                except Idle:
+                    cycles = cpu.idle(cycles + self.executed(block), limit, deadline)
+            return RunResult(CYCLE_LIMIT, cycles)
+
+        except Halt:
+            return RunResult(HALTED, cycles + self.executed(block))
+        except DivisionByZero:
+            return RunResult(DIVIDE_BY_ZERO, cycles + self.executed(block))
+        except IllegalInstruction:
+            return RunResult(ILLEGAL_INSTRUCTION, cycles + self.executed(block))
+        except MEMORY_ERRORS as e:
+            return RunResult(MEMORY_FAULT, cycles + self.faulted(block, e))
+        finally:
+            console.flush()
+
+    def executed(self, block):
+        """how many instructions of a block ran before it raised
+
+        Every instruction that can raise sets the PC to its own address first.
+        """
+        return block.addresses.index(self.cpu.pc) + 1
+
+    def faulted(self, block, error):
+        """how many instructions of a block ran before a memory fault, and leave the PC at the
+        one that faulted
+
+        Inlined instructions don't set the PC, so the faulting one is found from the line of
+        the block's source the error was raised on. A fault outside the block, servicing an
+        interrupt or compiling the next one, counts as one instruction, as in `CPU.run()`.
+        """
+        traceback = error.__traceback__
+        while traceback is not None:
+            if block is not None and traceback.tb_frame.f_code is block.__code__:
+                count = block.counts[traceback.tb_lineno - 1]
+                self.cpu.pc = block.addresses[count - 1]
+                return count
+            traceback = traceback.tb_next
+        return 1
+
+    def compile(self, start):
+        """compile the basic block starting at the given address
+
+        :param start: address of the first instruction in the block
+        :returns: a function that executes the block and leaves the PC at the next block
+        """
+        cpu = self.cpu
+        lines = [f"def block_{start:02X}():", "    reg = cpu.reg", "    ram = cpu.ram"]
+        namespace = {"cpu": cpu}
+        # for each line, how many instructions have been started by the time it runs
+        counts = [0] * len(lines)
+
+        addresses = []
+        address = start
+        while address + 2 < len(cpu.ram):
+            instruction = cpu.decoded[address] or cpu.decode(address)
+            ir, op_a, op_b = instruction.raw
+            next_address = address + 1 + instruction.num_ops
+            addresses.append(address)
+
+            lines.append(f"    # {address:02X}: {inverse_table.get(ir, f'{ir:08b}')}")
+            lines.extend(
+                f"    {line}"
+                for line in self.emit(instruction, address, next_address, start, len(addresses), namespace)
+            )
+            counts.extend([len(addresses)] * (len(lines) - len(counts)))
+
+            address = next_address
+            if instruction.is_pc_set or ir in BLOCK_TERMINATORS:
+                break
+        else:
+            if address == start:
+                # not even one whole instruction left -- fail the same way CPU::run() does
+                cpu.decode(start)
+            # ran out of memory before hitting a terminator
+            lines.append(f"    cpu.pc = {address}")
+        lines.append(f"    return {len(addresses)}")
+
+        # record the addresses this block was compiled from so a write to any of them drops it
+        for covered in range(start, address):
+            cpu.block_owners[covered].add(start)
+
+        exec(compile("\n".join(lines), f"<block {start:02X}>", "exec"), namespace)
+        block = namespace[f"block_{start:02X}"]
+        block.addresses = addresses
+        block.counts = counts
+        cpu.blocks[start] = block
+        return block
+
+    @staticmethod
+    def emit(instruction, address, next_address, start, count, namespace):
+        """generate the source lines for a single instruction within a block
+
+        Register-only instructions are inlined -- table-driven ALU operations become a
+        single lookup; everything else calls its handler with the operands baked in as
+        constants.
+
+        :param count: how many instructions of the block have run once this one has
+        """
+        ir, op_a, op_b = instruction.raw
+        lines = []
+
+        if ir == NOP:
+            pass
+        elif ir == LDI:
+            lines.append(f"reg[{op_a}] = {op_b}")
+        elif ir == POP:
+            lines.append(f"reg[{op_a}] = ram[cpu.sp]")
+            lines.append("cpu.sp += 1")
+        elif ir == PUSH and namespace["cpu"].fast_path:
+            # the stack is proven to stay clear of code, so nothing can be invalidated
+            lines.append("cpu.sp -= 1")
+            lines.append(f"ram[cpu.sp] = reg[{op_a}]")
+        elif ir == PUSH:
+            lines.append("cpu.sp -= 1")
+            lines.append(f"cpu.ram_write(cpu.sp, reg[{op_a}])")
+            lines.extend(BlockEngine.bail_out(start, next_address, count))
+        elif ir in TABLES:
+            namespace[f"table_{ir:02X}"] = TABLES[ir]
+            lines.append(f"reg[{op_a}] = table_{ir:02X}[reg[{op_a}] << 8 | reg[{op_b}]]")
+        else:
+            name = f"handle_{address:02X}"
+            namespace[name] = instruction.handler
+            # handlers may read the PC (e.g. CALL pushes the return address)
+            lines.append(f"cpu.pc = {address}")
+            lines.append(f"{name}({', '.join(str(op) for op in instruction.operands)})")
+            if ir in MEMORY_WRITES and not namespace["cpu"].fast_path:
+                lines.extend(BlockEngine.bail_out(start, next_address, count))
+
+        # a terminator that doesn't set the PC itself still has to leave it at the next block
+        if ir in BLOCK_TERMINATORS and not instruction.is_pc_set:
+            lines.append(f"cpu.pc = {next_address}")
+        return lines
+
+    @staticmethod
+    def bail_out(start, next_address, count):
+        """source lines to leave the block early if a memory write has just invalidated it"""
+        return [
+            f"if cpu.blocks[{start}] is None:",
+            f"    cpu.pc = {next_address}",
+            f"    return {count}",
+        ]
@@ -0,0 +1,76 @@
+"""Buffered console output for the LS-8 CPU
+
+PRN and PRA write into a Console rather than straight to a stream, so a program that
+prints a character at a time doesn't pay for a write per character.
+"""
+__author__ = "Chaz Kiker"
+
+import time
+
+# flush once this many characters are buffered
+DEFAULT_MAX_SIZE = 4096
+# flush once the oldest buffered output is this many seconds old
+DEFAULT_INTERVAL = 0.1
+
+
+class Console:
+    """buffers program output in front of a sink
+
+    The sink is anything with a `write(str)` method -- `sys.stdout`, an open file, an
+    `io.StringIO` -- and is flushed too, if it has a `flush()` method.
+
+    The buffer is flushed:
+
+    * when it holds `max_size` characters
+    * when `interval` seconds have passed since the last flush (checked by the run loops
+      through `poll()`, so writing never reads the clock)
+    * on every newline, in line-buffered mode
+    * when the CPU stops running (halts, faults, runs out of budget) or goes idle
+    """
+
+    def __init__(self, sink, max_size=DEFAULT_MAX_SIZE, interval=DEFAULT_INTERVAL, line_buffered=False):
+        """
+        :param sink: where the output ends up
+        :param max_size: number of buffered characters that forces a flush
+        :param interval: seconds between time-based flushes (None to disable them)
+        :param line_buffered: flush after every newline
+        """
+        self.sink = sink
+        self.max_size = max_size
+        self.interval = interval
+        self.line_buffered = line_buffered
+        self.buffer = []
+        self.size = 0
+        self.flushed_at = time.monotonic()
+
+    def fork(self):
+        """a console with the same sink and flush policy, but a buffer of its own"""
+        return Console(self.sink, self.max_size, self.interval, self.line_buffered)
+
+    def redirect(self, sink):
+        """flush what is buffered for the current sink, then write to sink from now on"""
+        self.flush()
+        self.sink = sink
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.max_size or (self.line_buffered and "\n" in text):
+            self.flush()
+
+    def poll(self):
+        """flush if the interval has passed -- for run loops, so quiet stretches don't hold output back"""
+        if self.size and self.interval is not None and time.monotonic() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """write everything buffered to the sink"""
+        self.flushed_at = time.monotonic()
+        if not self.size:
+            return
+        self.sink.write("".join(self.buffer))
+        self.buffer.clear()
+        self.size = 0
+        flush = getattr(self.sink, "flush", None)
+        if flush is not None:
+            flush()
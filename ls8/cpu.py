@@ -1,7 +1,17 @@
 """CPU functionality."""
 __author__ = "Chaz Kiker"
 
-from alu import Alu, AluOperations
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from functools import partial
+
+import image
+from console import Console
+from devices import BankedMemory, Bus, ConsoleDevice
+from alu import Alu, AluOperations, DivisionByZero
 from utils import BColors
 
 DEFAULT_PROGRAM = [
@@ -17,6 +27,9 @@ DEFAULT_PROGRAM = [
 OP_A = "op_a"
 OP_B = "op_b"
 
+# an instruction byte and its two (potential) operand bytes, unpacked in place from RAM
+FETCH = struct.Struct("BBB")
+
 NOP = 0b00000000
 HLT = 0b00000001
 LDI = 0b10000010
@@ -25,19 +38,28 @@ PUSH = 0b01000101
 POP = 0b01000110
 CALL = 0b01010000
 RET = 0b00010001
-# IN PROGRESS
 JMP = 0b01010100
 JEQ = 0b01010101
 JNE = 0b01010110
-# TODO: IMPLEMENT THE FOLLOWING INSTRUCTIONS
 INT = 0b01010010
 IRET = 0b00010011
+LD = 0b10000011
+ST = 0b10000100
+PRA = 0b01001000
 JGE = 0b01011010
 JGT = 0b01010111
 JLE = 0b01011001
 JLT = 0b01011000
-LD = 0b10000011
-ST = 0b10000100
+
+# reserved registers
+IM = 5  # interrupt mask
+IS = 6  # interrupt status
+
+# interrupt vector table -- the handler address for interrupt n is stored at INTERRUPT_VECTORS + n
+INTERRUPT_VECTORS = 0xF8
+
+# the bank selector (low byte, high byte) once banked memory is enabled
+BANK_SELECT_ADDRESS = 0xF5
 
 inverse_table = {
  0b00000000: "NOP",
@@ -59,6 +81,7 @@ inverse_table = {
  0b01011000: "JLT",
  0b01010110: "JNE",
  0b10000011: "LD",
+ 0b01001000: "PRA",
  0b10100000: "ALU_ADD",
  0b10101000: "ALU_AND",
  0b10100111: "ALU_CMP",
@@ -72,10 +95,92 @@ inverse_table = {
  0b10100001: "ALU_SUB",
  0b10101101: "ALU_SHR",
  0b10101100: "ALU_SHL",
- 10101011: "ALU_XOR",
+ 0b10101011: "ALU_XOR",
 }
 
 
+# how many cycles CPU::run() executes between checks of its wall-clock deadline
+DEADLINE_CHECK_INTERVAL = 1024
+
+# reasons for CPU::run() to stop
+HALTED = "halted"
+DIVIDE_BY_ZERO = "divide_by_zero"
+CYCLE_LIMIT = "cycle_limit"
+DEADLINE = "deadline"
+ILLEGAL_INSTRUCTION = "illegal_instruction"
+# an instruction reached outside the machine: a register number above R7, the stack
+# pointer running off memory, or the PC too close to the end of memory to fetch
+MEMORY_FAULT = "memory_fault"
+
+# errors Python raises for a MEMORY_FAULT -- the run loops don't pay for bounds checks
+MEMORY_ERRORS = (IndexError, struct.error)
+
+# the outcome of a call to CPU::run()
+# * stop_reason -- one of HALTED, DIVIDE_BY_ZERO, ILLEGAL_INSTRUCTION, MEMORY_FAULT, CYCLE_LIMIT
+#   or DEADLINE
+# * cycles -- number of instructions executed
+RunResult = namedtuple("RunResult", ["stop_reason", "cycles"])
+
+
+# a copy of the full machine state, taken by CPU::snapshot()
+# * devices -- start address -> device, for every mapped device (see CPU::map_device())
+# * banks -- bank number -> contents, for every bank other than 0 (None if banks aren't enabled)
+# * bank -- the selected bank
+Snapshot = namedtuple(
+    "Snapshot",
+    ["ram", "reg", "pc", "sp", "fl", "interrupts_enabled", "symbols", "devices", "banks", "bank"]
+)
+
+
+class Halt(Exception):
+    """raised by HLT to stop the CPU"""
+
+
+class Idle(Exception):
+    """raised by a jump to itself -- the CPU is spinning and nothing will change until an interrupt"""
+
+
+class IllegalInstruction(Exception):
+    """raised when the CPU fetches an opcode it has no handler for
+
+    The PC is left at the offending instruction.
+    """
+
+    def __init__(self, ir, address):
+        super().__init__(f"illegal instruction {ir:#010b} at {address:#04x}")
+        self.ir = ir
+        self.address = address
+
+
+# a single decoded instruction, built once per address and reused by CPU::run()
+# * handler -- the handler for this opcode, from CPU::handlers
+# * num_ops -- number of operands consumed by this opcode, 0-2
+# * is_alu -- True if this instruction is dispatched to the ALU
+# * is_pc_set -- True if this instruction sets the PC itself
+# * operands -- the operand bytes to pass to the handler
+# * raw -- the instruction byte and both adjacent bytes
+# * advance -- how far to move the PC after the handler runs (0 if it sets the PC itself)
+DecodedInstruction = namedtuple(
+    "DecodedInstruction",
+    ["handler", "num_ops", "is_alu", "is_pc_set", "operands", "raw", "advance"]
+)
+
+
+def parse_program(lines):
+    """parse the lines of a text `.ls8` image into a list of bytes
+
+    :param lines: an iterable of lines, e.g. an open `.ls8` file
+    :returns: a list with one int per instruction/data byte
+    """
+    # split the line and cast the first entry into a base 2 int
+    # for each line in file if the line doesn't start with a comment
+    return [
+        int(line.split()[0], 2)
+        for line in lines
+        if line != "" and line[0] != "#" and line.split()
+    ]
+
+
 class BitUtils:
     @staticmethod
     def bits(n):
@@ -121,22 +226,55 @@ class CPU:
 
     def __init__(self):
         """Construct a new CPU."""
-        # arithmetic & logic unit
-        self.alu = Alu()
         # Random Access Memory (256 bytes)
-        self.ram = [0 for _ in range(256)]
+        self.ram = bytearray(256)
         # 8 general-purpose 8-bit numeric registers R0-R7.
-        self.reg = [0 for _ in range(8)]
+        self.reg = bytearray(8)
+        # arithmetic & logic unit, operating directly on the register file
+        self.alu = Alu(self.reg)
         # R7 is reserved as the stack pointer (SP)
         self.sp = self.reg[7] = 0xF4
         # FL: flags -- 00000LGE
         self.fl = 0b00000000
-        # TODO: # R5 is reserved as the interrupt mask (IM)
-        # self.irr_m = self.reg[5] = 0
-        # TODO: # R6 is reserved as the interrupt status (IS)
-        # self.irr_s = self.reg[6] = 0
+        # R5 is reserved as the interrupt mask (IM)
+        # R6 is reserved as the interrupt status (IS)
+        # interrupts are disabled while one is being serviced
+        self.interrupts_enabled = True
+        # True whenever IS may have bits set; the run loop only looks at IM/IS when it is
+        self.interrupt_pending = False
+        # interrupts raised by external sources (other threads), not yet merged into IS
+        self.posted_interrupts = 0
+        self.interrupt_lock = threading.Lock()
+        # set whenever an interrupt is posted, so an idle CPU can sleep until then
+        self.interrupt_event = threading.Event()
+        # live external sources (see interrupts.py) that may post interrupts
+        self.interrupt_sources = set()
+        # called with the bits of posted interrupts as they are merged into IS (see replay.py)
+        self.delivery_hook = None
+        # sources that hand data over with their interrupt, by interrupt number -- each one's
+        # acknowledge() is called as its handler is entered (see interrupts.KeyboardSource)
+        self.acknowledging_sources = {}
         # program count
         self.pc = 0
+        # where PRN and PRA write program output
+        self.console = Console(sys.stdout)
+        # label name -> address, for programs loaded from a binary image
+        self.symbols = {}
+        # memory-mapped devices (see devices.py) -- None until one is mapped, so until then
+        # LD and ST go straight to RAM
+        self.bus = None
+        # the 256 bytes LD and ST address once devices are mapped: RAM, or the selected bank
+        self.window = self.ram
+        # the devices.BankedMemory behind the window, once enabled
+        self.banked_memory = None
+        # True while running a program analyzer.py has proven safe -- see CPU::enable_fast_path()
+        self.fast_path = False
+        # decoded instructions, indexed by address (None until decoded)
+        self.decoded = [None] * len(self.ram)
+        # compiled basic blocks, indexed by start address (used by blocks.BlockEngine)
+        self.blocks = [None] * len(self.ram)
+        # the start addresses of every compiled block covering each address
+        self.block_owners = [set() for _ in self.ram]
 
         # branch table for handling various instructions
         self.branch_table = {
@@ -148,12 +286,35 @@ class CPU:
             CALL: self.handle_call,
             RET: self.handle_ret,
             AluOperations.CMP: self.handle_cmp,
-            NOP: lambda: "pass",
+            NOP: self.handle_nop,
             JEQ: self.handle_jeq,
             JGE: self.handle_jge,
+            JGT: self.handle_jgt,
+            JLE: self.handle_jle,
+            JLT: self.handle_jlt,
             JNE: self.handle_jne,
             JMP: self.handle_jmp,
+            INT: self.handle_int,
+            IRET: self.handle_iret,
+            LD: self.handle_ld,
+            ST: self.handle_st,
+            PRA: self.handle_pra,
         }
+        # every opcode, resolved to its handler up front -- see CPU::build_handlers()
+        self.handlers = None
+        self.build_handlers()
+
+    def build_handlers(self):
+        """resolve all 256 opcodes into the dense CPU::handlers list
+
+        Each opcode gets its branch table handler, or else its ALU handler, or else the
+        illegal instruction fault -- so no opcode can ever silently do nothing.
+        """
+        handlers = [partial(self.handle_illegal, ir) for ir in range(256)]
+        for table in (self.alu.branch_table, self.branch_table):
+            for ir, handler in table.items():
+                handlers[ir] = handler
+        self.handlers = handlers
 
     @property
     def fl_l(self):
@@ -169,20 +330,13 @@ class CPU:
 
     def load(self, seed_file):
         """Load a program into memory."""
+        file_path = f"ls8/{seed_file}"
         try:
-            file_path = f"ls8/{seed_file}"
-            with open(file_path) as file:
-                print(
-                    f"{BColors.BOLD}{BColors.OK_GREEN}"
-                    f"Loading program from {BColors.UNDERLINE}{BColors.OK_CYAN}{file_path}{BColors.END_}"
-                )
-                # split the line and cast the first entry into a base 2 int
-                # for each line in file if the line doesn't start with a comment
-                program = [
-                    int(line.split()[0], 2)
-                    for line in file.readlines()
-                    if line != "" and line[0] != "#" and line.split()
-                ]
+            self.load_file(file_path)
+            print(
+                f"{BColors.BOLD}{BColors.OK_GREEN}"
+                f"Loading program from {BColors.UNDERLINE}{BColors.OK_CYAN}{file_path}{BColors.END_}"
+            )
 
         except IOError:
             print(
@@ -190,10 +344,224 @@ class CPU:
                 f"An error occurred! Defaulting to 'print8.ls8'"
                 f"{BColors.END_}"
             )
-            program = DEFAULT_PROGRAM
+            self.load_program(DEFAULT_PROGRAM)
+
+        except image.ImageError as e:
+            # the image is checked in full before any of it is copied into RAM
+            print(
+                f"{BColors.FAIL}"
+                f"Can't load {file_path}: {e}! Defaulting to 'print8.ls8'"
+                f"{BColors.END_}"
+            )
+            self.load_program(DEFAULT_PROGRAM)
+
+    def load_file(self, file_path):
+        """Load a program from a binary `.ls8b` image or a text `.ls8` file."""
+        if image.is_image(file_path):
+            # binary images are copied straight into RAM
+            self.load_image(image.load(file_path, self.ram))
+        else:
+            with open(file_path) as file:
+                self.load_program(parse_program(file))
 
+    def load_image(self, loaded):
+        """finish loading a binary image whose payload is already in RAM
+
+        :param loaded: the LoadedImage returned by `image.load()`/`image.load_buffer()`
+        """
+        self.disable_fast_path()
+        self.symbols = loaded.symbols
+        if loaded.banks:
+            memory = self.enable_banks()
+            for number, data in loaded.banks.items():
+                memory.bank(number)[:len(data)] = data
+        self.reset_caches()
+
+    def load_program(self, program):
+        """Load a list of instruction/data bytes into memory, starting at address 0."""
+        self.disable_fast_path()
         for address, instruction in enumerate(program):
-            self.ram[address] = instruction
+            self.ram[address] = instruction & 0xFF
+
+        self.reset_caches()
+
+    def reset_caches(self):
+        """forget every decoded instruction and compiled block after RAM has been replaced
+
+        Nothing is decoded up front: instructions are decoded the first time they run, so
+        loading costs the same whether the program is large or small, and bytes that are
+        only ever data are never decoded at all.
+        """
+        self.decoded = [None] * len(self.ram)
+        self.blocks = [None] * len(self.ram)
+        self.block_owners = [set() for _ in self.ram]
+
+    def map_device(self, device, start):
+        """map a memory-mapped device at addresses start .. start + device.size - 1
+
+        LD and ST are switched over to their bus-aware handlers on the first mapping, so a
+        CPU without devices never pays for the lookup.
+
+        :raises ValueError: if the range doesn't fit or overlaps another device
+        """
+        if self.bus is None:
+            self.disable_fast_path()
+            self.bus = Bus(len(self.ram))
+            self.branch_table[LD] = self.handle_ld_mapped
+            self.branch_table[ST] = self.handle_st_mapped
+            self.build_handlers()
+            # decoded instructions and compiled blocks hold on to the old handlers
+            self.reset_caches()
+        self.bus.map(device, start)
+
+    def unmap_devices(self):
+        """remove every mapped device, so LD and ST go straight to RAM again"""
+        if self.bus is None:
+            return
+        self.disable_fast_path()
+        self.bus = None
+        self.banked_memory = None
+        self.window = self.ram
+        self.branch_table[LD] = self.handle_ld
+        self.branch_table[ST] = self.handle_st
+        self.build_handlers()
+        self.reset_caches()
+
+    def enable_banks(self, selector=BANK_SELECT_ADDRESS):
+        """switch LD and ST over to bank-switched memory, selected through a two-byte selector
+
+        :param selector: where to map the bank selector
+        :returns: the devices.BankedMemory (the same one every call)
+        """
+        if self.banked_memory is None:
+            self.banked_memory = BankedMemory(self)
+            self.map_device(self.banked_memory, selector)
+        return self.banked_memory
+
+    def enable_fast_path(self, analysis):
+        """run the loaded program without the guards a proven-safe program doesn't need
+
+        Every write to RAM normally drops the cached instructions and compiled blocks it
+        lands on. Once analyzer.py has shown that the stack stays clear of the program and
+        that no ST ever hits code, PUSH, CALL and ST write straight to RAM instead. Loading
+        another program, restoring a snapshot or mapping a device turns the fast path off.
+
+        :param analysis: the analyzer.Analysis of the program in RAM
+        :raises ValueError: if the analysis didn't prove the program safe
+        """
+        if not analysis.safe:
+            raise ValueError(f"program not proven safe: {len(analysis.issues)} issue(s) found")
+
+        self.fast_path = True
+        self.branch_table[PUSH] = self.handle_push_verified
+        self.branch_table[CALL] = self.handle_call_verified
+        if self.bus is None:
+            self.branch_table[ST] = self.handle_st_verified
+        self.build_handlers()
+        # decoded instructions and compiled blocks hold on to the old handlers
+        self.reset_caches()
+
+    def disable_fast_path(self):
+        """put back the guarded PUSH, CALL and ST handlers (see CPU::enable_fast_path())"""
+        if not self.fast_path:
+            return
+        self.fast_path = False
+        self.branch_table[PUSH] = self.handle_push
+        self.branch_table[CALL] = self.handle_call
+        self.branch_table[ST] = self.handle_st if self.bus is None else self.handle_st_mapped
+        self.build_handlers()
+        self.reset_caches()
+
+    def snapshot(self):
+        """capture the full machine state
+
+        RAM, registers and memory banks are copied into immutable bytes, so a snapshot stays
+        valid no matter what the CPU does afterwards, and can be restored any number of
+        times. Other mapped devices are recorded by reference: their state lives outside the
+        machine, so a restored or forked CPU shares them.
+        """
+        banks, bank = None, 0
+        memory = self.banked_memory
+        if memory is not None:
+            banks = {number: bytes(data) for number, data in memory.banks.items() if number != 0}
+            bank = memory.selected
+        devices = dict(self.bus.devices) if self.bus is not None else {}
+        return Snapshot(
+            bytes(self.ram), bytes(self.reg), self.pc, self.sp, self.fl, self.interrupts_enabled,
+            dict(self.symbols), devices, banks, bank
+        )
+
+    def restore(self, snapshot):
+        """return the machine to the state captured in snapshot"""
+        self.disable_fast_path()
+        # copy in place, so anything holding on to self.ram/self.reg sees the restored state
+        self.ram[:] = snapshot.ram
+        self.reg[:] = snapshot.reg
+        self.pc, self.sp, self.fl = snapshot.pc, snapshot.sp, snapshot.fl
+        self.interrupts_enabled = snapshot.interrupts_enabled
+        # IS came back with the registers, so it needs checking again
+        self.interrupt_pending = True
+        self.symbols = dict(snapshot.symbols)
+
+        # map the snapshot's devices again, with banked memory rebuilt for this CPU
+        self.unmap_devices()
+        for start, device in snapshot.devices.items():
+            if isinstance(device, BankedMemory):
+                memory = self.enable_banks(start)
+                memory.banks.update((number, bytearray(data)) for number, data in snapshot.banks.items())
+                memory.select(snapshot.bank)
+            else:
+                self.map_device(device, start)
+
+        # instructions are decoded again lazily, as they're reached
+        self.reset_caches()
+
+    def fork(self):
+        """clone this machine -- the clone starts from the current state and runs independently"""
+        clone = type(self)()
+        clone.console = self.console.fork()
+        snapshot = self.snapshot()
+        # a console device printing through this CPU's console prints through the clone's
+        devices = {
+            start: ConsoleDevice(clone.console)
+            if isinstance(device, ConsoleDevice) and device.console is self.console else device
+            for start, device in snapshot.devices.items()
+        }
+        clone.restore(snapshot._replace(devices=devices))
+        return clone
+
+    def decode(self, address):
+        """decode the instruction at the given address and cache the result
+
+        :param address: the address of the instruction byte to decode
+        :returns: the DecodedInstruction for that address
+        """
+        ir, op_a, op_b = self.ram_read(address)
+        num_ops, is_alu, is_pc_set, _ = self.destructure_byte(ir)
+        decoded = DecodedInstruction(
+            handler=self.handlers[ir],
+            num_ops=num_ops,
+            is_alu=is_alu,
+            is_pc_set=is_pc_set,
+            operands=(op_a, op_b)[:num_ops],
+            raw=(ir, op_a, op_b),
+            # PC will increase by 1 at minimum, and 1 additional for each operand consumed,
+            # unless the instruction sets it directly
+            advance=0 if is_pc_set else 1 + num_ops,
+        )
+        self.decoded[address] = decoded
+        return decoded
+
+    def invalidate(self, address):
+        """drop every cached instruction and compiled block whose bytes include the given address"""
+        address %= len(self.ram)
+        for start in range(max(address - 2, 0), address + 1):
+            self.decoded[start] = None
+
+        owners = self.block_owners[address]
+        for start in owners:
+            self.blocks[start] = None
+        owners.clear()
 
     def trace(self):
         """print the CPU state
@@ -223,40 +591,199 @@ class CPU:
 
         print(f"{BColors.END_}")
 
-    def run(self):
-        """Run the CPU."""
-
-        # this loop will be killed with .exit() in CPU::handle_hlt() method
-        while True:
-            # uncomment the call to self.trace() below for debugging
-            # self.trace()
-
-            # read the address in PC register and store that result in our "instruction_byte register"
-            # additionally, read adjacent bytes in case the instruction_byte requires them
-            ir, op_a, op_b = self.ram_read(self.pc)
-            # break the instruction (AABCDDDD) down into relevant bits
-            # AA       B         C       DDDD
-            num_ops, is_alu, is_pc_set, instruct_id = self.destructure_byte(ir)
-
-            kwargs = {}
-            if num_ops >= 1:
-                kwargs[OP_A] = op_a
-            if num_ops == 2:
-                kwargs[OP_B] = op_b
-
-            # check to see if the instruction is an ALU operation
-            if is_alu:
-                # if so, handle it with the ALU handler class
-                self.alu(ir, op_a, op_b)
-            if ir in self.branch_table:
-                # otherwise, handle it according to its unique handler
-                self.branch_table[ir](**kwargs)
-
-            # check if operation manipulates self.pc directly
-            if not is_pc_set:
-                # if not, then increase the program count accordingly
-                # PC will increase by 1 at minimum, and 1 additional for each operand consumed
-                self.pc += 1 + num_ops
+    def step(self):
+        """execute the single instruction at PC"""
+        if self.interrupt_pending:
+            self.service_interrupts()
+
+        instruction = self.decoded[self.pc] or self.decode(self.pc)
+        instruction.handler(*instruction.operands)
+        self.pc += instruction.advance
+
+    def run(self, max_cycles=None, deadline=None, output=None):
+        """Run the CPU until it halts, faults or runs out of budget.
+
+        :param max_cycles: maximum number of instructions to execute (unlimited if None)
+        :param deadline: a `time.monotonic()` value at which to stop (none if None)
+        :param output: sink for program output, replacing the console's if given
+        :returns: a RunResult describing why the CPU stopped
+        """
+        if output is not None:
+            self.console.redirect(output)
+
+        decoded = self.decoded
+        limit = float("inf") if max_cycles is None else max_cycles
+        cycles = 0
+
+        try:
+            while cycles < limit:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return RunResult(DEADLINE, cycles)
+                self.console.poll()
+
+                # run a slice of instructions between budget checks
+                slice_end = min(limit, cycles + DEADLINE_CHECK_INTERVAL)
+                try:
+                    while cycles < slice_end:
+                        cycles += 1
+                        # uncomment the call to self.trace() below for debugging (or use debugger.py,
+                        # which needs no changes here)
+                        # self.trace()
+
+                        # IM and IS are only checked once something has raised an interrupt
+                        if self.interrupt_pending:
+                            self.service_interrupts()
+
+                        # fetch the decoded instruction at PC, decoding it on a cache miss
+                        # each entry already holds the relevant bits of the instruction (AABCDDDD)
+                        # and the operand bytes that follow it
+                        instruction = decoded[self.pc] or self.decode(self.pc)
+
+                        # handle the instruction according to its unique handler -- every
+                        # opcode has one, even if it is only the illegal instruction fault
+                        instruction.handler(*instruction.operands)
+
+                        # move on to the next instruction (by 0 if the handler set the PC itself)
+                        self.pc += instruction.advance
+                except Idle:
+                    cycles = self.idle(cycles, limit, deadline)
+
+            return RunResult(CYCLE_LIMIT, cycles)
+
+        except Halt:
+            return RunResult(HALTED, cycles)
+        except DivisionByZero:
+            return RunResult(DIVIDE_BY_ZERO, cycles)
+        except IllegalInstruction:
+            return RunResult(ILLEGAL_INSTRUCTION, cycles)
+        except MEMORY_ERRORS:
+            return RunResult(MEMORY_FAULT, cycles)
+        finally:
+            # whatever the reason for stopping, everything printed so far is written out
+            self.console.flush()
+
+    def idle(self, cycles, limit, deadline):
+        """wait out a side-effect-free spin loop instead of executing it
+
+        Called when the CPU jumps to the instruction it is already at. Nothing can change
+        until an interrupt arrives, so rather than spinning, block until an external source
+        posts one or the deadline passes. If no interrupt can ever be serviced, the rest of
+        the cycle budget is used up at once, as spinning through it would have.
+
+        :returns: the cycle count to carry on with
+        """
+        # an interrupt may already be waiting -- the block engine only services them between blocks
+        if self.interrupts_enabled and self.reg[IM] & (self.reg[IS] | self.posted_interrupts):
+            return cycles
+
+        # the program may be waiting on input, so whatever it printed has to be visible
+        self.console.flush()
+        can_be_interrupted = self.interrupts_enabled and self.reg[IM] and self.interrupt_sources
+        if not can_be_interrupted and limit != float("inf"):
+            return limit
+
+        self.interrupt_event.clear()
+        if self.posted_interrupts:
+            return cycles
+
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        self.interrupt_event.wait(timeout)
+        return cycles
+
+    def post_interrupt(self, number):
+        """raise interrupt `number` from an external source
+
+        Safe to call from any thread. The interrupt is merged into IS before the next
+        instruction fetch.
+        """
+        with self.interrupt_lock:
+            self.posted_interrupts |= 1 << number
+            self.interrupt_pending = True
+        self.interrupt_event.set()
+
+    def service_interrupts(self):
+        """check for an unmasked interrupt and, if there is one, jump to its handler
+
+        Called before instruction fetch, but only while `interrupt_pending` is set.
+        """
+        with self.interrupt_lock:
+            self.interrupt_pending = False
+            posted = self.posted_interrupts
+            self.reg[IS] |= posted
+            self.posted_interrupts = 0
+        if posted and self.delivery_hook is not None:
+            self.delivery_hook(posted)
+
+        # keep checking for as long as anything is left in IS: it may be masked right now,
+        # or have arrived while interrupts are disabled, and become serviceable later
+        if self.reg[IS]:
+            self.interrupt_pending = True
+
+        masked_interrupts = self.reg[IM] & self.reg[IS]
+        if not masked_interrupts or not self.interrupts_enabled:
+            return
+
+        # the lowest set bit wins
+        bit = masked_interrupts & -masked_interrupts
+        number = bit.bit_length() - 1
+
+        self.interrupts_enabled = False
+        self.reg[IS] &= ~bit
+
+        self.sp -= 1
+        self.ram_write(self.sp, self.pc)
+        self.sp -= 1
+        self.ram_write(self.sp, self.fl)
+        for register in range(7):
+            self.sp -= 1
+            self.ram_write(self.sp, self.reg[register])
+
+        source = self.acknowledging_sources.get(number)
+        if source is not None:
+            source.acknowledge()
+        self.pc = self.ram[INTERRUPT_VECTORS + number]
+
+    def run_stepper(self, step, max_cycles=None, deadline=None, output=None):
+        """Run the CPU by calling step() once per instruction.
+
+        For instrumented run modes (profiling, tracing) that wrap `CPU.step()`. Takes the
+        same budgets and returns the same RunResult as `CPU.run()`.
+
+        :param step: a callable that executes the instruction at PC
+        """
+        if output is not None:
+            self.console.redirect(output)
+
+        limit = float("inf") if max_cycles is None else max_cycles
+        cycles = 0
+
+        try:
+            while cycles < limit:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return RunResult(DEADLINE, cycles)
+                self.console.poll()
+
+                slice_end = min(limit, cycles + DEADLINE_CHECK_INTERVAL)
+                try:
+                    while cycles < slice_end:
+                        cycles += 1
+                        step()
+                except Idle:
+                    cycles = self.idle(cycles, limit, deadline)
+
+            return RunResult(CYCLE_LIMIT, cycles)
+
+        except Halt:
+            return RunResult(HALTED, cycles)
+        except DivisionByZero:
+            return RunResult(DIVIDE_BY_ZERO, cycles)
+        except IllegalInstruction:
+            return RunResult(ILLEGAL_INSTRUCTION, cycles)
+        except MEMORY_ERRORS:
+            return RunResult(MEMORY_FAULT, cycles)
+        finally:
+            # whatever the reason for stopping, everything printed so far is written out
+            self.console.flush()
 
     def ram_read(self, mar):
         """read data from memory
@@ -264,7 +791,7 @@ class CPU:
         :param mar: Memory Address Register, the address from which to read data
         :returns: a tuple with the data in the given MAR, as well as the two adjacent bytes
         """
-        return tuple(self.ram[mar:mar + 3])
+        return FETCH.unpack_from(self.ram, mar)
 
     def ram_write(self, mar, mdr):
         """write data to memory
@@ -272,7 +799,9 @@ class CPU:
         :param mar: Memory Address Register, the address that is being written to
         :param mdr: Memory Data Register, the data to write to memory
         """
-        self.ram[mar] = mdr
+        # RAM only holds bytes, so wrap the value around to 8 bits
+        self.ram[mar] = mdr & 0xFF
+        self.invalidate(mar)
 
     @staticmethod
     def destructure_byte(instruction_byte):
@@ -316,37 +845,23 @@ class CPU:
 
         """
 
-        compared = self.alu(AluOperations.CMP, op_a, op_b)
+        compared = self.alu.cmp(op_a, op_b)
 
-        # FL: flags -- 00000LGE
+        # FL: flags -- 00000LGE -- exactly one of them is set after a compare
         li, gi, ei = 2, 1, 0
 
-        # if registers are equal
         if compared == 0:
-            # set the E flag to 1
-            self.fl = BitUtils.set(self.fl, ei)
-
-        # else, registers are not equal
+            self.fl = BitUtils.set(0, ei)
+        elif compared > 0:
+            self.fl = BitUtils.set(0, gi)
         else:
-            # clear the E flag to 0
-            self.fl = BitUtils.clear(self.fl, ei)
-
-            # if regA is greater than regB
-            if compared > 0:
-                # set the G flag to 1
-                self.fl = BitUtils.set(self.fl, gi)
-                # clear the L flag to 0
-                self.fl = BitUtils.clear(self.fl, li)
-
-            # else, regA is less than regB
-            else:
-                # clear the G flag to 0
-                self.fl = BitUtils.clear(self.fl, gi)
-                # set the L flag to 1
-                self.fl = BitUtils.set(self.fl, li)
+            self.fl = BitUtils.set(0, li)
 
     def handle_jmp(self, op_a):
         register = op_a
+        if self.reg[register] == self.pc:
+            # jumping to itself -- a spin loop (e.g. `Loop: JMP R0`) waiting for an interrupt
+            raise Idle()
         self.pc = self.reg[register]
 
     def handle_jne(self, op_a):
@@ -367,6 +882,24 @@ class CPU:
         else:
             self.pc += 2
 
+    def handle_jgt(self, op_a):
+        if self.fl_g:
+            self.handle_jmp(op_a)
+        else:
+            self.pc += 2
+
+    def handle_jle(self, op_a):
+        if self.fl_l or self.fl_e:
+            self.handle_jmp(op_a)
+        else:
+            self.pc += 2
+
+    def handle_jlt(self, op_a):
+        if self.fl_l:
+            self.handle_jmp(op_a)
+        else:
+            self.pc += 2
+
     def handle_ret(self):
         """return from the subroutine and pick up where we left off execution"""
         # pop the top of stack and store it in our PC
@@ -384,7 +917,7 @@ class CPU:
 
         # decrease sp b/c we're pushing
         self.sp -= 1
-        self.ram[self.sp] = self.pc + 2
+        self.ram_write(self.sp, self.pc + 2)
 
         # The PC is set to the address stored in the given register.
         # We jump to that location in RAM and execute the first instruction_byte in the subroutine.
@@ -401,7 +934,20 @@ class CPU:
         """PUSH -- push the value in the given register onto the stack"""
         register = op_a
         self.sp -= 1
-        self.ram[self.sp] = self.reg[register]
+        self.ram_write(self.sp, self.reg[register])
+
+    def handle_push_verified(self, op_a):
+        """PUSH, for a program proven never to push onto its own code"""
+        self.sp -= 1
+        # wrapped to 8 bits, as CPU::ram_write() does
+        self.ram[self.sp] = self.reg[op_a] & 0xFF
+
+    def handle_call_verified(self, op_a):
+        """CALL, for a program proven never to push onto its own code"""
+        self.sp -= 1
+        # a CALL at the very end of memory returns to address 0, as with CPU::ram_write()
+        self.ram[self.sp] = (self.pc + 2) & 0xFF
+        self.pc = self.reg[op_a]
 
     def handle_ldi(self, op_a, op_b):
         """LDI -- set the value of a register to an integer
@@ -419,10 +965,82 @@ class CPU:
         PRN register: prints decimal representation of the value stored in register
         """
         register = op_a
-        print(f"{self.reg[register]}")
+        self.console.write(f"{self.reg[register]}\n")
+
+    def handle_pra(self, op_a):
+        """PRA -- print alpha character value stored in the given register"""
+        register = op_a
+        self.console.write(chr(self.reg[register]))
+
+    def handle_ld(self, op_a, op_b):
+        """LD -- loads registerA with the value at the memory address stored in registerB"""
+        self.reg[op_a] = self.ram[self.reg[op_b]]
+
+    def handle_st(self, op_a, op_b):
+        """ST -- store value in registerB in the address stored in registerA"""
+        self.ram_write(self.reg[op_a], self.reg[op_b])
+
+    def handle_st_verified(self, op_a, op_b):
+        """ST, for a program proven never to store into its own code"""
+        self.ram[self.reg[op_a]] = self.reg[op_b]
+
+    def handle_ld_mapped(self, op_a, op_b):
+        """LD, for a CPU with devices mapped"""
+        address = self.reg[op_b]
+        if self.bus.slots[address] is None:
+            self.reg[op_a] = self.window[address]
+        else:
+            self.reg[op_a] = self.bus.read(address)
+
+    def handle_st_mapped(self, op_a, op_b):
+        """ST, for a CPU with devices mapped"""
+        address = self.reg[op_a]
+        if self.bus.slots[address] is not None:
+            self.bus.write(address, self.reg[op_b])
+        elif self.window is self.ram:
+            self.ram_write(address, self.reg[op_b])
+        else:
+            # banks other than 0 never hold code, so there is nothing to invalidate
+            self.window[address] = self.reg[op_b]
+
+    def handle_int(self, op_a):
+        """INT -- issue the interrupt number stored in the given register"""
+        register = op_a
+        self.reg[IS] |= 1 << (self.reg[register] & 0b111)
+        self.interrupt_pending = True
+        # INT sets the PC bit, so it has to move past itself -- the interrupt then returns
+        # to the next instruction instead of raising it again
+        self.pc += 2
+
+    def handle_iret(self):
+        """IRET -- return from an interrupt handler
+
+        Pops R6-R0, then FL, then the return address into PC, and re-enables interrupts.
+        Interrupts raised while the handler ran stay set in IS rather than being popped over.
+        """
+        raised = self.reg[IS]
+        for register in range(6, -1, -1):
+            self.reg[register] = self.ram[self.sp]
+            self.sp += 1
+        self.reg[IS] |= raised
+        self.fl = self.ram[self.sp]
+        self.sp += 1
+        self.pc = self.ram[self.sp]
+        self.sp += 1
+
+        self.interrupts_enabled = True
+        # anything that arrived during the handler can be serviced now
+        self.interrupt_pending = True
+
+    @staticmethod
+    def handle_nop():
+        """NOP -- do nothing"""
+
+    def handle_illegal(self, ir, *operands):
+        """the handler for every opcode without one of its own"""
+        raise IllegalInstruction(ir, self.pc)
 
     @staticmethod
     def handle_hlt():
-        """HLT -- Halt the CPU and exit the emulator"""
-        print(f"{BColors.BOLD}{BColors.WARNING}HALTING{BColors.END_}")
-        exit()
+        """HLT -- Halt the CPU"""
+        raise Halt()
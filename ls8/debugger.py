@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""Debugger for the LS-8 CPU
+
+Usage: debugger.py program [--symbols source.asm]
+
+Breakpoints, memory watchpoints and register conditions, with single-step and continue.
+Scriptable through the Debugger class, or interactive from the command line (type
+`help` at the prompt).
+
+The debugger only costs anything while it has something armed:
+
+* with nothing armed, `cont()` is a plain `CPU.run()`
+* with only PC breakpoints, `cont()` is still `CPU.run()`: the decoded instruction at
+  each breakpoint is swapped for a trap, so every other instruction runs exactly as fast
+  as without the debugger
+* watchpoints and register conditions need checking after every instruction, so only
+  then does `cont()` fall back to a stepping loop
+"""
+__author__ = "Chaz Kiker"
+
+import argparse
+import cmd
+import operator
+import re
+import sys
+from collections import namedtuple
+from functools import partial
+from pathlib import Path
+
+from cpu import CPU, DecodedInstruction, inverse_table, CYCLE_LIMIT
+
+# the assembler lives in asm/, next to this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "asm"))
+import asm  # noqa: E402
+
+# reasons for the debugger to stop, besides the CPU's own stop reasons
+BREAKPOINT = "breakpoint"
+WATCHPOINT = "watchpoint"
+CONDITION = "condition"
+STEPPED = "stepped"
+
+# why the debugger handed control back
+# * reason -- BREAKPOINT, WATCHPOINT, CONDITION, STEPPED, or a CPU stop reason (see cpu.RunResult)
+# * pc -- the PC when it stopped
+# * detail -- what triggered the stop, e.g. "0xF3: 0 -> 12" for a watchpoint
+DebugStop = namedtuple("DebugStop", ["reason", "pc", "detail"])
+
+# a register condition, e.g. "R0 == 5"
+REGEX_CONDITION = re.compile(r"\s*R([0-7])\s*(==|!=|<=|>=|<|>)\s*(\w+)\s*$", re.IGNORECASE)
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class Break(Exception):
+    """raised from inside a run to hand control back to the debugger"""
+
+    def __init__(self, stop):
+        super().__init__(stop.reason)
+        self.stop = stop
+
+
+class Debugger:
+    """debugs a CPU
+
+    Locations (for breakpoints and watchpoints) are addresses or label names; labels come
+    from `CPU.symbols` (filled in when a `.ls8b` image is loaded) and from any assembler
+    source passed to `load_symbols()`.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.symbols = dict(cpu.symbols)
+        self.breakpoints = set()
+        # address -> the value last seen there
+        self.watchpoints = {}
+        # description -> predicate taking the CPU
+        self.conditions = {}
+        # description -> whether the condition held after the last instruction
+        self.holding = {}
+        # True while the stepping loop is resuming from the breakpoint it stopped at
+        self.resumed = False
+
+    def load_symbols(self, source_path):
+        """read label addresses from an assembler source, by assembling it"""
+        sym = {}
+        with open(source_path) as source:
+            asm.assemble(source, sym)
+        self.symbols.update(sym)
+
+    def resolve(self, location):
+        """the address of a location -- an address (int, or a string like "0x1A") or a label"""
+        if isinstance(location, int):
+            address = location
+        else:
+            try:
+                address = int(location, 0)
+            except ValueError:
+                address = self.symbols.get(location.upper(), self.symbols.get(location))
+                if address is None:
+                    raise ValueError(f"unknown label {location}")
+        if not 0 <= address < len(self.cpu.ram):
+            raise ValueError(f"address {address:#x} is outside memory")
+        return address
+
+    def label(self, address):
+        """the label at an address, if it has one"""
+        for name, value in self.symbols.items():
+            if value == address:
+                return name
+        return None
+
+    def break_at(self, location):
+        address = self.resolve(location)
+        self.breakpoints.add(address)
+        return address
+
+    def watch(self, location):
+        """stop whenever the byte at location changes"""
+        address = self.resolve(location)
+        self.watchpoints[address] = self.cpu.ram[address]
+        return address
+
+    def break_when(self, condition):
+        """stop whenever a condition becomes true
+
+        :param condition: a register condition such as "R0 == 5", or any callable that
+            takes the CPU and returns True to stop
+        """
+        if callable(condition):
+            description, predicate = getattr(condition, "__name__", repr(condition)), condition
+        else:
+            match = REGEX_CONDITION.match(condition)
+            if match is None:
+                raise ValueError(f"can't parse condition {condition!r} (expected e.g. R0 == 5)")
+            register, op, value = int(match.group(1)), OPERATORS[match.group(2)], int(match.group(3), 0)
+            description, predicate = condition.strip(), lambda cpu: op(cpu.reg[register], value)
+
+        self.conditions[description] = predicate
+        self.holding[description] = bool(predicate(self.cpu))
+
+    def delete(self, location):
+        """remove the breakpoint or watchpoint at location, or a condition by its description"""
+        if location in self.conditions:
+            del self.conditions[location]
+            del self.holding[location]
+            return
+        address = self.resolve(location)
+        self.breakpoints.discard(address)
+        self.watchpoints.pop(address, None)
+
+    def step(self, count=1):
+        """execute count instructions, ignoring breakpoints"""
+        for _ in range(count):
+            result = self.cpu.run(max_cycles=1)
+            if result.stop_reason != CYCLE_LIMIT:
+                return DebugStop(result.stop_reason, self.cpu.pc, None)
+        return DebugStop(STEPPED, self.cpu.pc, None)
+
+    def cont(self, max_cycles=None):
+        """run until something armed triggers, or the CPU stops
+
+        :returns: a DebugStop
+        """
+        if self.watchpoints or self.conditions:
+            return self.run_checked(max_cycles)
+
+        if not self.breakpoints:
+            # nothing armed -- this is just the CPU's own run loop
+            result = self.cpu.run(max_cycles=max_cycles)
+            return DebugStop(result.stop_reason, self.cpu.pc, None)
+
+        # resuming from a breakpoint: its instruction runs before the traps go in
+        if self.cpu.pc in self.breakpoints:
+            stop = self.step()
+            if stop.reason != STEPPED:
+                return stop
+            if max_cycles is not None:
+                max_cycles -= 1
+
+        self.arm()
+        try:
+            result = self.cpu.run(max_cycles=max_cycles)
+        except Break as hit:
+            return hit.stop
+        finally:
+            self.disarm()
+        return DebugStop(result.stop_reason, self.cpu.pc, None)
+
+    def arm(self):
+        """swap the decoded instruction at every breakpoint for a trap
+
+        The trap is reinstalled if the CPU decodes a breakpoint address again (e.g. after
+        a write to it), by standing in for `CPU.decode()` until `disarm()`.
+        """
+        cpu = self.cpu
+        cpu.decode = self.decode
+        for address in self.breakpoints:
+            cpu.decoded[address] = self.trap(address)
+
+    def disarm(self):
+        cpu = self.cpu
+        # back to the class's own decode
+        del cpu.decode
+        for address in self.breakpoints:
+            cpu.decoded[address] = None
+
+    def decode(self, address):
+        if address in self.breakpoints:
+            trap = self.cpu.decoded[address] = self.trap(address)
+            return trap
+        return CPU.decode(self.cpu, address)
+
+    def trap(self, address):
+        return DecodedInstruction(
+            handler=partial(self.hit, address), num_ops=0, is_alu=False, is_pc_set=True,
+            operands=(), raw=tuple(self.cpu.ram[address:address + 3]), advance=0,
+        )
+
+    def hit(self, address):
+        raise Break(DebugStop(BREAKPOINT, address, self.label(address)))
+
+    def run_checked(self, max_cycles=None):
+        """run instruction by instruction, checking everything armed after each one"""
+        self.resumed = True
+        try:
+            result = self.cpu.run_stepper(self.checked_step, max_cycles)
+        except Break as hit:
+            return hit.stop
+        return DebugStop(result.stop_reason, self.cpu.pc, None)
+
+    def checked_step(self):
+        cpu = self.cpu
+        if cpu.pc in self.breakpoints and not self.resumed:
+            raise Break(DebugStop(BREAKPOINT, cpu.pc, self.label(cpu.pc)))
+        self.resumed = False
+
+        cpu.step()
+
+        for address, old in self.watchpoints.items():
+            new = cpu.ram[address]
+            if new != old:
+                self.watchpoints[address] = new
+                raise Break(DebugStop(WATCHPOINT, cpu.pc, f"{address:#04x}: {old} -> {new}"))
+        for description, condition in self.conditions.items():
+            holds = bool(condition(cpu))
+            held, self.holding[description] = self.holding[description], holds
+            if holds and not held:
+                raise Break(DebugStop(CONDITION, cpu.pc, description))
+
+    def where(self):
+        """the current instruction and register state, on one line"""
+        cpu = self.cpu
+        ir, op_a, op_b = cpu.ram[cpu.pc], cpu.ram[(cpu.pc + 1) % 256], cpu.ram[(cpu.pc + 2) % 256]
+        label = self.label(cpu.pc)
+        name = inverse_table.get(ir, f"{ir:08b}")
+        registers = " ".join(f"R{i}={value:02X}" for i, value in enumerate(cpu.reg))
+        return (
+            f"{cpu.pc:02X}{f' <{label}>' if label else ''}: {name:<8} | {ir:02X} {op_a:02X} {op_b:02X} | "
+            f"FL={cpu.fl:02X} SP={cpu.sp & 0xFF:02X} | {registers}"
+        )
+
+
+class DebuggerShell(cmd.Cmd):
+    """interactive front end for a Debugger"""
+
+    intro = "LS-8 debugger -- type help for commands"
+    prompt = "(ls8) "
+
+    def __init__(self, debugger):
+        super().__init__()
+        self.debugger = debugger
+        self.finished = False
+
+    def report(self, stop):
+        detail = f" ({stop.detail})" if stop.detail else ""
+        print(f"stopped: {stop.reason}{detail}")
+        print(self.debugger.where())
+        if stop.reason not in (BREAKPOINT, WATCHPOINT, CONDITION, STEPPED, CYCLE_LIMIT):
+            self.finished = True
+
+    def guarded(self, action, *args):
+        try:
+            return action(*args)
+        except ValueError as e:
+            print(e)
+
+    def do_break(self, arg):
+        """break LOCATION -- stop when the PC reaches an address or label"""
+        address = self.guarded(self.debugger.break_at, arg)
+        if address is not None:
+            print(f"breakpoint at {address:#04x}")
+
+    def do_watch(self, arg):
+        """watch LOCATION -- stop when the byte at an address or label changes"""
+        address = self.guarded(self.debugger.watch, arg)
+        if address is not None:
+            print(f"watchpoint at {address:#04x}")
+
+    def do_cond(self, arg):
+        """cond CONDITION -- stop when a register condition becomes true, e.g. cond R0 == 5"""
+        self.guarded(self.debugger.break_when, arg)
+
+    def do_delete(self, arg):
+        """delete LOCATION|CONDITION -- remove a breakpoint, watchpoint or condition"""
+        self.guarded(self.debugger.delete, arg.strip())
+
+    def do_info(self, arg):
+        """info -- list everything armed"""
+        debugger = self.debugger
+        for address in sorted(debugger.breakpoints):
+            print(f"breakpoint {address:#04x} {debugger.label(address) or ''}")
+        for address in sorted(debugger.watchpoints):
+            print(f"watchpoint {address:#04x} {debugger.label(address) or ''}")
+        for description in debugger.conditions:
+            print(f"condition  {description}")
+
+    def do_step(self, arg):
+        """step [N] -- execute N instructions (default 1)"""
+        if not self.finished:
+            self.report(self.debugger.step(int(arg or 1)))
+
+    def do_continue(self, arg):
+        """continue -- run until a breakpoint, watchpoint or condition triggers, or the CPU stops"""
+        if not self.finished:
+            self.report(self.debugger.cont())
+
+    def do_regs(self, arg):
+        """regs -- show the current instruction and registers"""
+        print(self.debugger.where())
+
+    def do_mem(self, arg):
+        """mem LOCATION [COUNT] -- dump COUNT bytes (default 16) of memory"""
+        parts = arg.split()
+        if not parts:
+            print("usage: mem LOCATION [COUNT]")
+            return
+        address = self.guarded(self.debugger.resolve, parts[0])
+        if address is None:
+            return
+        count = int(parts[1], 0) if len(parts) > 1 else 16
+        data = self.debugger.cpu.ram[address:address + count]
+        for offset in range(0, len(data), 8):
+            print(f"{address + offset:02X}: " + " ".join(f"{value:02X}" for value in data[offset:offset + 8]))
+
+    def do_quit(self, arg):
+        """quit -- leave the debugger"""
+        return True
+
+    do_b, do_w, do_s, do_c, do_r, do_x, do_q = do_break, do_watch, do_step, do_continue, do_regs, do_mem, do_quit
+    do_EOF = do_quit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LS-8 debugger")
+    parser.add_argument("program", help="a .ls8 or .ls8b file")
+    parser.add_argument("--symbols", metavar="SOURCE", help="assembler source to read labels from")
+    args = parser.parse_args(argv)
+
+    cpu = CPU()
+    cpu.load_file(args.program)
+    debugger = Debugger(cpu)
+    if args.symbols:
+        debugger.load_symbols(args.symbols)
+
+    shell = DebuggerShell(debugger)
+    print(debugger.where())
+    shell.cmdloop()
+    cpu.console.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Memory-mapped I/O devices for the LS-8 CPU
+
+A Bus maps address ranges to devices. Mapping is part of configuring a CPU (see
+`CPU.map_device()`): until the first device is mapped, LD and ST go straight to RAM,
+and once one is, they look the address up in the bus's per-address slot table, which
+is filled in when devices are mapped rather than searched on every access.
+
+Devices are reached through LD and ST. Instruction fetch, the stack and the interrupt
+vectors always use plain RAM.
+"""
+__author__ = "Chaz Kiker"
+
+import time
+
+
+class Device:
+    """base class for a memory-mapped device
+
+    A device covers `size` consecutive addresses; `read()` and `write()` receive the
+    offset of the accessed address from the start of the range it is mapped at.
+    """
+
+    size = 1
+
+    def read(self, offset):
+        """the byte LD sees at offset"""
+        return 0
+
+    def write(self, offset, value):
+        """handle ST of an 8-bit value to offset"""
+
+
+class Bus:
+    """maps address ranges to devices"""
+
+    def __init__(self, size):
+        """
+        :param size: number of addresses on the bus (the size of RAM)
+        """
+        # (device, offset) for every mapped address, None for plain RAM
+        self.slots = [None] * size
+        self.devices = {}
+
+    def map(self, device, start):
+        """map device at addresses start .. start + device.size - 1
+
+        :raises ValueError: if the range runs off the bus or overlaps another device
+        """
+        end = start + device.size
+        if start < 0 or end > len(self.slots):
+            raise ValueError(f"device doesn't fit on the bus ({start:#04x}-{end - 1:#04x})")
+        if any(slot is not None for slot in self.slots[start:end]):
+            raise ValueError(f"device overlaps another device at {start:#04x}-{end - 1:#04x}")
+
+        for offset in range(device.size):
+            self.slots[start + offset] = (device, offset)
+        self.devices[start] = device
+
+    def read(self, address):
+        device, offset = self.slots[address]
+        return device.read(offset) & 0xFF
+
+    def write(self, address, value):
+        device, offset = self.slots[address]
+        device.write(offset, value & 0xFF)
+
+
+class KeyboardDevice(Device):
+    """the key-pressed register: reads as the most recently pressed key"""
+
+    def __init__(self):
+        self.key = 0
+
+    def read(self, offset):
+        return self.key
+
+    def write(self, offset, value):
+        # programs clear the key after handling it
+        self.key = value
+
+
+class TimerDevice(Device):
+    """a free-running counter, reading as the number of elapsed ticks (wrapping at 256)"""
+
+    def __init__(self, tick=1.0):
+        """
+        :param tick: length of a tick, in seconds
+        """
+        self.tick = tick
+        self.started = time.monotonic()
+
+    def read(self, offset):
+        return int((time.monotonic() - self.started) / self.tick) & 0xFF
+
+    def write(self, offset, value):
+        # any write restarts the count
+        self.started = time.monotonic()
+
+
+class ConsoleDevice(Device):
+    """a character output port: every byte stored to it is printed through the CPU's console"""
+
+    def __init__(self, console):
+        """
+        :param console: a console.Console, usually the CPU's own
+        """
+        self.console = console
+
+    def write(self, offset, value):
+        self.console.write(chr(value))
+
+
+class FramebufferDevice(Device):
+    """a width x height grid of bytes, one per cell, stored row by row"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.cells = bytearray(self.size)
+
+    def read(self, offset):
+        return self.cells[offset]
+
+    def write(self, offset, value):
+        self.cells[offset] = value
+
+    def lines(self, palette=" .:-=+*#%@"):
+        """render the framebuffer as text, shading each cell by its value"""
+        scale = len(palette) - 1
+        return [
+            "".join(palette[cell * scale // 255] for cell in self.cells[row:row + self.width])
+            for row in range(0, self.size, self.width)
+        ]
+
+
+class BankedMemory(Device):
+    """bank-switched memory behind the 256-byte window LD and ST address
+
+    The device itself is the bank selector: two bytes holding the selected bank number,
+    low byte first. Storing to either byte selects a bank, by pointing the CPU's window
+    at it -- no bytes are copied. Bank 0 is the CPU's own RAM; every other bank is a
+    256-byte bytearray allocated the first time it is selected, out of a backing store of
+    up to MAX_BANKS banks.
+    """
+
+    size = 2
+    MAX_BANKS = 1 << 16
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.banks = {0: cpu.ram}
+        self.selected = 0
+
+    def bank(self, number):
+        """the memory of a bank, allocating it if it hasn't been used yet"""
+        memory = self.banks.get(number)
+        if memory is None:
+            memory = self.banks[number] = bytearray(len(self.cpu.ram))
+        return memory
+
+    def select(self, number):
+        self.selected = number
+        self.cpu.window = self.bank(number)
+
+    def read(self, offset):
+        return self.selected >> (8 * offset)
+
+    def write(self, offset, value):
+        shift = 8 * offset
+        self.select((self.selected & ~(0xFF << shift) | value << shift) % self.MAX_BANKS)
+
+
+def parse_mapping(spec, cpu):
+    """build the device described by a command-line mapping
+
+    A mapping is `name@address`, with the device's options after a colon:
+
+    * `keyboard@0xF4`
+    * `timer@0xF0`, or `timer:0.5@0xF0` for a tick of half a second
+    * `console@0xF1` -- prints through the CPU's console
+    * `framebuffer:16x8@0x40` -- 16 cells wide, 8 high
+
+    :param cpu: the CPU the device is for
+    :returns: the device, and the address to map it at
+    :raises ValueError: if spec isn't a mapping of a known device
+    """
+    device, at, address = spec.partition("@")
+    name, _, options = device.partition(":")
+    if not at:
+        raise ValueError(f"{spec!r}: missing @address")
+    try:
+        start = int(address, 0)
+    except ValueError:
+        raise ValueError(f"{spec!r}: bad address {address!r}")
+
+    try:
+        if name == "keyboard" and not options:
+            return KeyboardDevice(), start
+        if name == "timer":
+            tick = float(options) if options else 1.0
+            if not tick > 0:
+                raise ValueError()
+            return TimerDevice(tick), start
+        if name == "console" and not options:
+            return ConsoleDevice(cpu.console), start
+        if name == "framebuffer":
+            width, height = map(int, options.split("x"))
+            if width < 1 or height < 1:
+                raise ValueError()
+            return FramebufferDevice(width, height), start
+    except ValueError:
+        raise ValueError(f"{spec!r}: bad options for {name}")
+    raise ValueError(f"{spec!r}: unknown device {name!r}")
@@ -0,0 +1,158 @@
+"""Binary LS-8 program images.
+
+An image is a compact alternative to the text `.ls8` format, written by `asm/asm.py`
+when the output file ends in `.ls8b`. All integers are little-endian.
+
+    offset  size  field
+    0       4     magic, b"LS8B"
+    4       1     format version (1 or 2)
+    5       1     reserved, 0
+    6       2     load address
+    8       2     payload size, in bytes
+    10      2     number of symbols
+    12      n     payload -- raw bytes, copied into RAM at the load address
+    12 + n  ...   symbol table -- per symbol: name length (1 byte), name (ascii), address (2 bytes)
+
+Version 2 images follow the symbol table with the contents of memory banks other than
+bank 0 (see `CPU.enable_banks()`): the number of banks (2 bytes), then per bank its
+number (2 bytes), its size (2 bytes, at most 256) and its bytes. Symbols in a bank have
+the address `bank << 8 | offset`. Images without banks are written as version 1.
+"""
+__author__ = "Chaz Kiker"
+
+import mmap
+import struct
+from collections import namedtuple
+
+MAGIC = b"LS8B"
+VERSION = 1
+# the version with a bank section
+BANKED_VERSION = 2
+EXTENSION = ".ls8b"
+
+HEADER = struct.Struct("<4sBxHHH")
+SYMBOL_ADDRESS = struct.Struct("<H")
+BANK_COUNT = struct.Struct("<H")
+BANK_HEADER = struct.Struct("<HH")
+BANK_SIZE = 256
+
+# a parsed image
+# * load_address -- where the payload goes in RAM
+# * payload -- the raw program bytes
+# * symbols -- dict of label name -> address
+# * banks -- dict of bank number -> the bank's bytes, for banks other than 0
+Image = namedtuple("Image", ["load_address", "payload", "symbols", "banks"])
+
+# an image that has been copied into RAM -- like Image, but with the payload's size, and
+# its banks copied out of the image
+LoadedImage = namedtuple("LoadedImage", ["load_address", "size", "symbols", "banks"])
+
+
+class ImageError(ValueError):
+    """raised for malformed images"""
+
+
+def is_image(path):
+    """True if the file at path starts with the image magic"""
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def parse(buffer):
+    """parse an image from a bytes-like object
+
+    The payload is returned as a memoryview into buffer, so it is not copied.
+    """
+    if len(buffer) < HEADER.size:
+        raise ImageError("image is too short to hold a header")
+
+    magic, version, load_address, size, symbol_count = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ImageError("not an LS-8 image")
+    if version not in (VERSION, BANKED_VERSION):
+        raise ImageError(f"unsupported image version {version}")
+
+    start = HEADER.size
+    offset = start + size
+    if offset > len(buffer):
+        raise ImageError("truncated payload")
+
+    symbols = {}
+    try:
+        for _ in range(symbol_count):
+            name_length = buffer[offset]
+            name = bytes(buffer[offset + 1:offset + 1 + name_length]).decode("ascii")
+            offset += 1 + name_length
+            (symbols[name],) = SYMBOL_ADDRESS.unpack_from(buffer, offset)
+            offset += SYMBOL_ADDRESS.size
+    except (IndexError, struct.error):
+        raise ImageError("truncated symbol table")
+
+    banks = {}
+    if version == BANKED_VERSION:
+        try:
+            (bank_count,) = BANK_COUNT.unpack_from(buffer, offset)
+            offset += BANK_COUNT.size
+            for _ in range(bank_count):
+                number, bank_size = BANK_HEADER.unpack_from(buffer, offset)
+                offset += BANK_HEADER.size
+                if bank_size > BANK_SIZE or offset + bank_size > len(buffer):
+                    raise ImageError(f"bad size for bank {number}")
+                banks[number] = bytes(buffer[offset:offset + bank_size])
+                offset += bank_size
+        except struct.error:
+            raise ImageError("truncated bank section")
+
+    return Image(load_address, memoryview(buffer)[start:start + size], symbols, banks)
+
+
+def load(path, ram):
+    """copy the image at path straight into ram through an mmap
+
+    :param path: path to the `.ls8b` image
+    :param ram: the bytearray to load the payload into
+    :returns: a LoadedImage
+    """
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        # the payload view has to be released before the mmap can be closed
+        with memoryview(mapped) as view:
+            return load_buffer(view, ram)
+
+
+def load_buffer(buffer, ram):
+    """copy the image held in a bytes-like object into ram
+
+    :param buffer: the whole `.ls8b` image
+    :param ram: the bytearray to load the payload into
+    :returns: a LoadedImage
+    """
+    image = parse(buffer)
+    with image.payload as payload:
+        end = image.load_address + len(payload)
+        if end > len(ram):
+            raise ImageError(f"image doesn't fit in memory ({end} > {len(ram)} bytes)")
+        ram[image.load_address:end] = payload
+
+    return LoadedImage(image.load_address, end - image.load_address, image.symbols, image.banks)
+
+
+def dump(payload, load_address=0, symbols=None, banks=None):
+    """build an image
+
+    :param payload: the program bytes
+    :param load_address: where to load the payload in RAM
+    :param symbols: optional dict of label name -> address
+    :param banks: optional dict of bank number -> bytes, for banks other than 0
+    :returns: the image as bytes
+    """
+    symbols = symbols or {}
+    version = BANKED_VERSION if banks else VERSION
+    parts = [HEADER.pack(MAGIC, version, load_address, len(payload), len(symbols)), bytes(payload)]
+    for name, address in symbols.items():
+        encoded = name.encode("ascii")
+        parts.append(bytes([len(encoded)]) + encoded + SYMBOL_ADDRESS.pack(address))
+    if banks:
+        parts.append(BANK_COUNT.pack(len(banks)))
+        for number, data in sorted(banks.items()):
+            parts.append(BANK_HEADER.pack(number, len(data)) + bytes(data))
+    return b"".join(parts)
@@ -0,0 +1,172 @@
+"""External interrupt sources for the LS-8 CPU
+
+Each source runs on a background thread and raises its interrupt through
+`CPU.post_interrupt()`, so the CPU's run loop never polls for them.
+"""
+__author__ = "Chaz Kiker"
+
+import contextlib
+import os
+import selectors
+import sys
+import threading
+from collections import deque
+
+# interrupt numbers
+TIMER_INTERRUPT = 0
+KEYBOARD_INTERRUPT = 1
+
+# the most recently pressed key is stored here before the keyboard interrupt is raised
+KEY_PRESSED_ADDRESS = 0xF4
+
+try:
+    import termios
+    import tty
+except ImportError:
+    # not a POSIX terminal -- keys arrive a line at a time
+    termios = tty = None
+
+
+class InterruptSource(threading.Thread):
+    """base class for a background thread that raises interrupts
+
+    A started source registers itself in `CPU.interrupt_sources` until it stops, so an
+    idle CPU knows whether anything could still wake it up.
+    """
+
+    def __init__(self, cpu, name):
+        super().__init__(name=name, daemon=True)
+        self.cpu = cpu
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.cpu.interrupt_sources.add(self)
+        super().start()
+
+    def stop(self):
+        self.stopped.set()
+        self.detach()
+
+    def detach(self):
+        """unregister from the CPU, and wake it in case it is idle waiting on this source"""
+        self.cpu.interrupt_sources.discard(self)
+        self.cpu.interrupt_event.set()
+
+
+class TimerSource(InterruptSource):
+    """raises the timer interrupt once per interval (one second, per the spec)"""
+
+    def __init__(self, cpu, interval=1.0):
+        super().__init__(cpu, "ls8-timer")
+        self.interval = interval
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.cpu.post_interrupt(TIMER_INTERRUPT)
+
+
+class KeyboardSource(InterruptSource):
+    """raises the keyboard interrupt for every byte read from stdin
+
+    Keys are queued, and only one is in flight at a time: a key is written to
+    KEY_PRESSED_ADDRESS -- or handed to a keyboard device, if one is mapped there -- as
+    the CPU enters the keyboard handler for it, and the interrupt for the next key is only
+    raised then. Keys typed faster than the handler runs are all seen, in order.
+
+    When stdin is a terminal it is put into cbreak mode so keys arrive one at a time, and
+    restored by `stop()`.
+    """
+
+    # how often the thread wakes up to check whether it has been stopped
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, cpu, stream=None):
+        super().__init__(cpu, "ls8-keyboard")
+        self.stream = stream or sys.stdin
+        self.saved_terminal = None
+        # a devices.KeyboardDevice mapped at KEY_PRESSED_ADDRESS, if there is one
+        self.device = cpu.bus.devices.get(KEY_PRESSED_ADDRESS) if cpu.bus is not None else None
+        # keys pressed but not yet handed to the CPU -- the first one's interrupt is raised
+        self.keys = deque()
+        self.keys_lock = threading.Lock()
+
+    def start(self):
+        fd = self.stream.fileno()
+        if tty is not None and os.isatty(fd):
+            self.saved_terminal = termios.tcgetattr(fd)
+            tty.setcbreak(fd)
+        self.cpu.acknowledging_sources[KEYBOARD_INTERRUPT] = self
+        super().start()
+
+    def run(self):
+        fd = self.stream.fileno()
+        with selectors.DefaultSelector() as selector:
+            try:
+                selector.register(fd, selectors.EVENT_READ)
+            except PermissionError:
+                # regular files (and /dev/null) can't be waited on, but never block either
+                selector = None
+
+            while not self.stopped.is_set():
+                if selector is not None and not selector.select(self.POLL_INTERVAL):
+                    continue
+                key = os.read(fd, 1)
+                if not key:
+                    # end of input -- no more key presses can come
+                    self.detach()
+                    return
+                self.press(key[0])
+
+    def press(self, key):
+        """queue the key, raising the keyboard interrupt if no other key is in flight"""
+        with self.keys_lock:
+            self.keys.append(key)
+            first = len(self.keys) == 1
+        if first:
+            self.cpu.post_interrupt(KEYBOARD_INTERRUPT)
+
+    def acknowledge(self):
+        """store the next key as the CPU enters the keyboard handler, then raise the interrupt for the one after
+
+        Called on the CPU's thread, by `CPU.service_interrupts()`.
+        """
+        with self.keys_lock:
+            if not self.keys:
+                # raised with INT, not by a key press
+                return
+            key = self.keys.popleft()
+            more = bool(self.keys)
+        if self.device is not None:
+            self.device.key = key
+        else:
+            # write RAM directly: 0xF4 is reserved for the key and never holds code, so there
+            # is nothing to invalidate
+            self.cpu.ram[KEY_PRESSED_ADDRESS] = key
+        if more:
+            self.cpu.post_interrupt(KEYBOARD_INTERRUPT)
+
+    def stop(self):
+        super().stop()
+        if self.cpu.acknowledging_sources.get(KEYBOARD_INTERRUPT) is self:
+            del self.cpu.acknowledging_sources[KEYBOARD_INTERRUPT]
+        if self.saved_terminal is not None:
+            termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self.saved_terminal)
+            self.saved_terminal = None
+
+
+@contextlib.contextmanager
+def interrupt_sources(cpu, timer=True, keyboard=True):
+    """run the timer and/or keyboard sources for the duration of the block"""
+    sources = []
+    if timer:
+        sources.append(TimerSource(cpu))
+    if keyboard:
+        sources.append(KeyboardSource(cpu))
+
+    for source in sources:
+        source.start()
+    try:
+        yield sources
+    finally:
+        for source in sources:
+            source.stop()
@@ -2,25 +2,191 @@
 """Main."""
 __author__ = "Chaz Kiker"
 
+import argparse
+import contextlib
 import sys
+
+import analyzer
+from blocks import BlockEngine
 from cpu import *
+from devices import FramebufferDevice, parse_mapping
+from interrupts import interrupt_sources
+from profiler import Profiler
+from replay import InterruptRecorder, InterruptReplayer
+from tracer import TraceRecorder, DEFAULT_CAPACITY
+
+DEFAULT_SEED_FILE = "examples/print8.ls8"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="LS-8 emulator")
+    parser.add_argument("seed_file", nargs="?", help="program to run, relative to ls8/")
+    parser.add_argument(
+        "--engine",
+        choices=("interpreter", "blocks"),
+        default="interpreter",
+        help="run instruction by instruction, or compile and run whole basic blocks",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="collect per-opcode, per-address and per-subroutine statistics (always uses the interpreter)",
+    )
+    parser.add_argument(
+        "--profile-report",
+        metavar="FILE",
+        help="where to write the profile report (default: stderr)",
+    )
+    parser.add_argument(
+        "--profile-stacks",
+        metavar="FILE",
+        help="also write collapsed stacks for flamegraph tools to FILE",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="record recent instructions and dump them to FILE when the run ends "
+             "(uses the interpreter; read it back with tracer.py)",
+    )
+    parser.add_argument(
+        "--trace-capacity",
+        type=int,
+        default=DEFAULT_CAPACITY,
+        help="number of instructions the trace keeps (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help="write program output to FILE instead of stdout",
+    )
+    parser.add_argument(
+        "--line-buffered",
+        action="store_true",
+        help="flush program output after every line instead of in batches",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="log every timer and keyboard interrupt, and the cycle it arrived at, to FILE (uses the interpreter)",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="replay the interrupts logged to FILE by --record instead of using the real timer and keyboard",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="analyze the program first, and skip the runtime self-modification guards if it is proven safe",
+    )
+    parser.add_argument(
+        "--interrupts",
+        choices=("auto", "on", "off"),
+        default="auto",
+        help="run the timer and keyboard interrupt sources: always, never, or only if the program "
+             "installs an interrupt handler (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--device",
+        metavar="NAME[:OPTIONS]@ADDRESS",
+        action="append",
+        default=[],
+        help="map a device for LD and ST to reach: keyboard, timer[:TICK], console or framebuffer:WxH, "
+             "e.g. console@0xF0 (may be repeated)",
+    )
+    return parser
+
+
+def takes_interrupts(analysis):
+    """whether an analyzed program installs an interrupt handler, and so can take interrupts"""
+    return any(function.kind == analyzer.INTERRUPT for function in analysis.functions.values())
 
 
 def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.record and args.engine != "interpreter":
+        # the recorder counts cycles instruction by instruction, which only the interpreter can do
+        parser.error("--record always uses the interpreter, so it can't be combined with --engine blocks")
+    if args.record and args.replay:
+        parser.error("--record and --replay can't be combined")
     cpu = CPU()
 
-    try:
-        seed_file = sys.argv[1]
-    except IndexError:
-        seed_file = "examples/print8.ls8"
+    seed_file = args.seed_file
+    if seed_file is None:
+        seed_file = DEFAULT_SEED_FILE
         print(f"No argument given, defaulting to {seed_file}")
-    except FileNotFoundError:
-        seed_file = "examples/print8.ls8"
-        print(f"{sys.argv[1]} not found -- defaulting to 'examples/print8.ls8'")
 
     cpu.load(seed_file)
-    cpu.run()
+    for spec in args.device:
+        try:
+            cpu.map_device(*parse_mapping(spec, cpu))
+        except ValueError as e:
+            parser.error(f"--device {e}")
+    analysis = None
+    if args.verify:
+        analysis = analyzer.analyze(cpu.ram)
+        if analysis.safe:
+            cpu.enable_fast_path(analysis)
+        else:
+            analyzer.report(analysis, cpu.symbols, sys.stderr)
+
+    # a replay gets its interrupts from the log alone; otherwise the sources (and the
+    # keyboard's cbreak mode) are only started for a program that can take interrupts
+    if args.replay or args.interrupts == "off":
+        live = False
+    elif args.interrupts == "on":
+        live = True
+    else:
+        live = takes_interrupts(analysis or analyzer.analyze(cpu.ram))
+    cpu.console.line_buffered = args.line_buffered
+    profiler = None
+    sink = open(args.output, "w") if args.output else contextlib.nullcontext(sys.stdout)
+    with sink as output, interrupt_sources(cpu, timer=live, keyboard=live and not sys.stdin.closed):
+        cpu.console.redirect(output)
+        if args.replay:
+            run = BlockEngine(cpu).run if args.engine == "blocks" else cpu.run
+            result = InterruptReplayer(cpu, args.replay).run(run)
+        elif args.record:
+            result = InterruptRecorder(cpu, args.record).run()
+        elif args.trace:
+            result = TraceRecorder(cpu, args.trace, args.trace_capacity).run()
+        elif args.profile or args.profile_report or args.profile_stacks:
+            profiler = Profiler(cpu)
+            result = profiler.run()
+        elif args.engine == "blocks":
+            result = BlockEngine(cpu).run()
+        else:
+            result = cpu.run()
+
+    if result.stop_reason == DIVIDE_BY_ZERO:
+        print(f"{BColors.WARNING}{BColors.BOLD}CANNOT DIVIDE BY ZERO{BColors.END_}")
+    elif result.stop_reason == ILLEGAL_INSTRUCTION:
+        print(f"{BColors.FAIL}{BColors.BOLD}ILLEGAL INSTRUCTION {cpu.ram[cpu.pc]:08b} AT {cpu.pc:#04x}{BColors.END_}")
+    elif result.stop_reason == MEMORY_FAULT:
+        print(f"{BColors.FAIL}{BColors.BOLD}MEMORY FAULT AT {cpu.pc:#04x}{BColors.END_}")
+    if result.stop_reason == HALTED:
+        print(f"{BColors.BOLD}{BColors.WARNING}HALTING{BColors.END_}")
+    else:
+        print(f"{BColors.BOLD}{BColors.WARNING}STOPPED: {result.stop_reason} after {result.cycles} cycles{BColors.END_}")
+
+    for device in (cpu.bus.devices.values() if cpu.bus is not None else ()):
+        if isinstance(device, FramebufferDevice):
+            print("\n".join(device.lines()))
+
+    if profiler is not None:
+        if args.profile_report:
+            with open(args.profile_report, "w") as report:
+                profiler.report(report)
+        else:
+            profiler.report(sys.stderr)
+        if args.profile_stacks:
+            with open(args.profile_stacks, "w") as stacks:
+                profiler.write_collapsed(stacks)
+
+    # only a program that ran to HLT succeeded
+    return 0 if result.stop_reason == HALTED else 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
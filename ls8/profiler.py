@@ -0,0 +1,147 @@
+"""Cycle-accurate profiler for the LS-8 CPU"""
+__author__ = "Chaz Kiker"
+
+import time
+from collections import namedtuple
+
+from cpu import inverse_table, CALL, RET
+
+# name of the outermost frame in collapsed stacks
+ROOT_FRAME = "main"
+
+# an active subroutine call
+# * address -- the subroutine's entry point
+# * entry_cycle -- the cycle count when it was called
+# * stack -- the collapsed-stack key for this frame, e.g. "main;PRINTSTR"
+Frame = namedtuple("Frame", ["address", "entry_cycle", "stack"])
+
+
+class Profiler:
+    """runs a CPU while collecting execution statistics
+
+    Profiling uses its own run loop, so `CPU.run()` pays nothing for it when it is off.
+    For every instruction executed it records:
+
+    * executions and host time (ns) per opcode and per PC address
+    * the current call stack, for flamegraph-style collapsed stacks
+
+    and for every subroutine (tracked through CALL/RET) its call count and inclusive cycles.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.op_counts = [0] * 256
+        self.op_time = [0] * 256
+        self.pc_counts = [0] * len(cpu.ram)
+        self.pc_time = [0] * len(cpu.ram)
+        self.calls = {}
+        self.inclusive_cycles = {}
+        self.stacks = {}
+        self.frames = [Frame(None, 0, ROOT_FRAME)]
+        self.cycles = 0
+        # address -> label, for naming subroutines
+        self.labels = {address: label for label, address in cpu.symbols.items()}
+
+    def run(self, max_cycles=None, deadline=None, output=None):
+        """Run the CPU with profiling; takes the same arguments and returns the same RunResult as `CPU.run()`."""
+        return self.cpu.run_stepper(self.step, max_cycles, deadline, output)
+
+    def step(self):
+        """execute and profile the instruction at PC"""
+        cpu = self.cpu
+        # service interrupts first, so the instruction accounted for is the one that runs
+        if cpu.interrupt_pending:
+            cpu.service_interrupts()
+        pc = cpu.pc
+        ir = (cpu.decoded[pc] or cpu.decode(pc)).raw[0]
+        stack = self.frames[-1].stack
+
+        # count the instruction up front, so one that halts or faults is still counted
+        self.cycles += 1
+        self.op_counts[ir] += 1
+        self.pc_counts[pc] += 1
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+        start = time.perf_counter_ns()
+        try:
+            cpu.step()
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self.op_time[ir] += elapsed
+            self.pc_time[pc] += elapsed
+
+        if ir == CALL:
+            self.enter(cpu.pc)
+        elif ir == RET:
+            self.leave()
+
+    def enter(self, address):
+        """record a call into the subroutine at address"""
+        self.calls[address] = self.calls.get(address, 0) + 1
+        stack = f"{self.frames[-1].stack};{self.name(address)}"
+        self.frames.append(Frame(address, self.cycles, stack))
+
+    def leave(self):
+        """record a return from the innermost subroutine"""
+        if len(self.frames) == 1:
+            # RET without a matching CALL -- nothing to attribute it to
+            return
+        frame = self.frames.pop()
+        self.inclusive_cycles[frame.address] = (
+            self.inclusive_cycles.get(frame.address, 0) + self.cycles - frame.entry_cycle
+        )
+
+    def name(self, address):
+        """a readable name for a subroutine: its label if the image has one"""
+        return self.labels.get(address, f"sub_{address:02X}")
+
+    @staticmethod
+    def op_name(ir):
+        return inverse_table.get(ir, f"0x{ir:02X}")
+
+    def report(self, file, top=20):
+        """write a human-readable report of the hottest opcodes, addresses and subroutines"""
+        total_time = sum(self.op_time) or 1
+
+        print(f"profiled {self.cycles} cycles, {sum(self.op_time) / 1e6:.3f} ms host time", file=file)
+
+        print("\nopcodes (by host time)", file=file)
+        print(f"{'opcode':<10} {'count':>10} {'time ms':>10} {'%time':>7} {'ns/op':>8}", file=file)
+        ops = sorted((ir for ir in range(256) if self.op_counts[ir]), key=lambda ir: -self.op_time[ir])
+        for ir in ops[:top]:
+            count, elapsed = self.op_counts[ir], self.op_time[ir]
+            print(
+                f"{self.op_name(ir):<10} {count:>10} {elapsed / 1e6:>10.3f} "
+                f"{100 * elapsed / total_time:>6.1f}% {elapsed / count:>8.0f}",
+                file=file
+            )
+
+        print("\naddresses (by executions)", file=file)
+        print(f"{'pc':<6} {'opcode':<10} {'count':>10} {'time ms':>10}", file=file)
+        pcs = sorted((pc for pc, count in enumerate(self.pc_counts) if count), key=lambda pc: -self.pc_counts[pc])
+        for pc in pcs[:top]:
+            ir = self.cpu.ram[pc]
+            print(
+                f"0x{pc:02X}   {self.op_name(ir):<10} {self.pc_counts[pc]:>10} {self.pc_time[pc] / 1e6:>10.3f}",
+                file=file
+            )
+
+        if self.calls:
+            print("\nsubroutines (by inclusive cycles)", file=file)
+            print(f"{'name':<16} {'calls':>8} {'cycles':>10} {'cycles/call':>12}", file=file)
+            subroutines = sorted(self.calls, key=lambda address: -self.inclusive_cycles.get(address, 0))
+            for address in subroutines[:top]:
+                calls, cycles = self.calls[address], self.inclusive_cycles.get(address, 0)
+                print(
+                    f"{self.name(address):<16} {calls:>8} {cycles:>10} {cycles / calls:>12.1f}",
+                    file=file
+                )
+
+    def write_collapsed(self, file):
+        """write cycle counts per call stack in the collapsed-stack format flamegraph tools read
+
+        One line per stack: frames separated by `;`, a space, then the number of cycles
+        spent with exactly that stack.
+        """
+        for stack, cycles in sorted(self.stacks.items()):
+            file.write(f"{stack} {cycles}\n")
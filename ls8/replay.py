@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Deterministic record and replay of external interrupts for the LS-8 CPU
+
+Usage: replay.py log_file
+
+Prints the events in a log written by InterruptRecorder.
+
+Timer ticks and key presses arrive whenever the wall clock and the keyboard say, so
+two runs of an interactive program never execute the same instructions. An
+InterruptRecorder logs every externally posted interrupt together with the guest cycle
+count at which it was delivered (merged into IS), and the key, for keyboard interrupts.
+A key only reaches the guest as the CPU enters the keyboard handler for it (see
+interrupts.KeyboardSource), and the keyboard raises just one interrupt per key, so the
+key that goes with each logged keyboard interrupt is written at the same cycle on replay.
+An InterruptReplayer runs the program again with no timer or keyboard, posting each
+logged interrupt at the same cycle -- so replay is reproducible and runs at full speed.
+"""
+__author__ = "Chaz Kiker"
+
+import struct
+import sys
+from collections import namedtuple
+
+from cpu import RunResult, CYCLE_LIMIT
+from interrupts import KEYBOARD_INTERRUPT, KeyboardSource
+
+# log file layout: header, then `count` events in the order they were delivered
+# header: magic, version, event count, total cycles of the recorded run
+LOG_MAGIC = b"LS8R"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<4sBxIQ")
+# event: cycle, interrupt bits, key
+LOG_EVENT = struct.Struct("<QBB")
+
+# interrupts delivered together
+# * cycle -- number of instructions executed before they were delivered
+# * interrupts -- their bits, as merged into IS
+# * key -- the key pressed, if the keyboard interrupt is among them (else 0)
+Event = namedtuple("Event", ["cycle", "interrupts", "key"])
+
+
+class InterruptRecorder:
+    """runs a CPU with its usual interrupt sources, logging every interrupt they deliver
+
+    The CPU is stepped one instruction at a time so the cycle count is known whenever an
+    interrupt is delivered. The log is written with `dump()` when the run ends, however
+    it ends.
+    """
+
+    def __init__(self, cpu, path):
+        """
+        :param cpu: the CPU to record
+        :param path: where to write the log when the run ends
+        """
+        self.cpu = cpu
+        self.path = path
+        self.events = []
+        self.cycles = 0
+
+    def run(self, max_cycles=None, deadline=None, output=None):
+        """Run the CPU while recording; takes the same arguments and returns the same RunResult as `CPU.run()`."""
+        self.cpu.delivery_hook = self.deliver
+        try:
+            result = self.cpu.run_stepper(self.step, max_cycles, deadline, output)
+            # an idle CPU uses up cycles without stepping
+            self.cycles = result.cycles
+            return result
+        finally:
+            self.cpu.delivery_hook = None
+            self.dump()
+
+    def step(self):
+        # counted before it runs, the same way run_stepper() counts it
+        self.cycles += 1
+        self.cpu.step()
+
+    def deliver(self, interrupts):
+        """the CPU's delivery hook -- log interrupts delivered before the current instruction"""
+        key = 0
+        keyboard = self.cpu.acknowledging_sources.get(KEYBOARD_INTERRUPT)
+        if interrupts & 1 << KEYBOARD_INTERRUPT and keyboard is not None and keyboard.keys:
+            # the key this interrupt is for, to be written when its handler is entered
+            key = keyboard.keys[0]
+        # the instruction about to run has already been counted
+        self.events.append(Event(self.cycles - 1, interrupts, key))
+
+    def dump(self):
+        """write the log to self.path"""
+        with open(self.path, "wb") as file:
+            file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, len(self.events), self.cycles))
+            for event in self.events:
+                file.write(LOG_EVENT.pack(*event))
+
+
+class InterruptReplayer:
+    """runs a CPU, posting the interrupts of a recorded log at the cycles they were delivered
+
+    No interrupt sources should be running. The CPU is run in slices ending at each
+    event, through `CPU.run()` or any run function taking the same arguments, and stops
+    at the cycle count the recorded run ended at.
+
+    The block engine only stops between blocks, so it may deliver an event up to a block
+    late. Replays on it are still reproducible, but they only match a recording made with
+    the interpreter while no event lands in the middle of a block.
+    """
+
+    def __init__(self, cpu, path):
+        """
+        :param cpu: the CPU to replay on, with the recorded program loaded
+        :param path: a log written by InterruptRecorder.dump()
+        """
+        self.cpu = cpu
+        self.events, self.end = read_log(path)
+        # never started -- only used to hand keys over the same way a live keyboard does
+        self.keyboard = KeyboardSource(cpu)
+
+    def run(self, run=None, max_cycles=None, deadline=None, output=None):
+        """Replay the log.
+
+        :param run: the run function to use, e.g. `BlockEngine(cpu).run` (default: `CPU.run`)
+        :returns: a RunResult, as for `CPU.run()`
+        """
+        cpu = self.cpu
+        run = run or cpu.run
+        if output is not None:
+            cpu.console.redirect(output)
+
+        cpu.acknowledging_sources[KEYBOARD_INTERRUPT] = self.keyboard
+        try:
+            return self.replay(run, max_cycles, deadline)
+        finally:
+            del cpu.acknowledging_sources[KEYBOARD_INTERRUPT]
+
+    def replay(self, run, max_cycles, deadline):
+        limit = self.end if max_cycles is None else min(self.end, max_cycles)
+        cycles = 0
+        for event in self.events:
+            if event.cycle > limit:
+                break
+            if event.cycle > cycles:
+                result = run(max_cycles=event.cycle - cycles, deadline=deadline)
+                cycles += result.cycles
+                if result.stop_reason != CYCLE_LIMIT:
+                    return RunResult(result.stop_reason, cycles)
+            self.post(event)
+
+        result = run(max_cycles=max(limit - cycles, 0), deadline=deadline)
+        return RunResult(result.stop_reason, cycles + result.cycles)
+
+    def post(self, event):
+        for number in range(8):
+            if event.interrupts & 1 << number:
+                if number == KEYBOARD_INTERRUPT:
+                    self.keyboard.press(event.key)
+                else:
+                    self.cpu.post_interrupt(number)
+
+
+def read_log(path):
+    """read a recorded log
+
+    :param path: a file written by InterruptRecorder.dump()
+    :returns: a list of Events, in order, and the total cycles of the recorded run
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+
+    if len(data) < LOG_HEADER.size:
+        raise ValueError(f"{path} is not an LS-8 interrupt log")
+    magic, version, count, end = LOG_HEADER.unpack_from(data, 0)
+    if magic != LOG_MAGIC or version != LOG_VERSION or len(data) != LOG_HEADER.size + count * LOG_EVENT.size:
+        raise ValueError(f"{path} is not an LS-8 interrupt log")
+
+    return [Event(*fields) for fields in LOG_EVENT.iter_unpack(data[LOG_HEADER.size:])], end
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: replay.py log_file", file=sys.stderr)
+        return 1
+
+    events, end = read_log(argv[1])
+    for event in events:
+        line = f"{event.cycle:>12}: interrupts {event.interrupts:08b}"
+        if event.interrupts & 1 << KEYBOARD_INTERRUPT:
+            line += f" key {event.key:#04x} {chr(event.key)!r}"
+        print(line)
+    print(f"{end:>12}: end of run")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Resident LS-8 server -- runs programs submitted over a socket on a pool of warm CPUs
+
+Usage:
+    server.py serve (--unix PATH | --port PORT [--host HOST]) [--workers N] [--max-cycles N] [--timeout SECONDS]
+    server.py submit program (--unix PATH | --port PORT [--host HOST]) [--max-cycles N]
+
+Protocol -- a connection carries any number of requests, one after the other.
+
+A request is a JSON header line followed by exactly `size` bytes of program:
+
+    {"size": 6, "format": "auto", "max_cycles": 1000}
+
+* format -- "text" (an `.ls8` file), "image" (an `.ls8b` file), "raw" (machine code,
+  loaded at address 0) or "auto" (the default) to tell them apart
+* max_cycles -- optional instruction budget, capped at the server's own
+
+The response is a JSON line per chunk of output, streamed while the program runs, then
+a result line with the same fields as a batch.py record:
+
+    {"output": "Hello, world!\\n"}
+    {"exit_reason": "halted", "cycles": 66, "registers": [...], "pc": 12, "error": null}
+"""
+__author__ = "Chaz Kiker"
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import image
+from batch import ERROR
+from cpu import CPU, parse_program
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_CYCLES = 1_000_000
+DEFAULT_TIMEOUT = 10.0
+
+# largest program accepted, in bytes -- text programs carry comments, so allow well over 256
+MAX_PROGRAM_SIZE = 64 * 1024
+
+FORMATS = ("auto", "text", "image", "raw")
+
+
+class ConnectionSink:
+    """console sink that streams output to a client from the worker thread running its program
+
+    Writes are handed to the event loop, which owns the connection, so they go out in order
+    and ahead of the result line.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def write(self, text):
+        line = json.dumps({"output": text}).encode() + b"\n"
+        self.loop.call_soon_threadsafe(self.writer.write, line)
+
+
+class Server:
+    """accepts programs over a socket and runs them on a pool of warm CPUs
+
+    The pool holds one CPU per worker thread. CPUs are constructed once and reset to a
+    clean machine between programs, so a request costs a load and a run -- no process
+    spawn, no imports, no table building.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_cycles=DEFAULT_MAX_CYCLES, timeout=DEFAULT_TIMEOUT):
+        """
+        :param workers: number of CPUs (and threads) programs run on
+        :param max_cycles: the largest instruction budget a request may ask for
+        :param timeout: wall-clock budget per program, in seconds
+        """
+        self.max_cycles = max_cycles
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ls8-worker")
+        self.cpus = [CPU() for _ in range(workers)]
+        self.clean_state = CPU().snapshot()
+        self.idle_cpus = None
+
+    async def serve(self, unix=None, host=None, port=None):
+        """serve forever on a Unix socket at path unix, or on TCP host:port"""
+        self.idle_cpus = asyncio.Queue()
+        for cpu in self.cpus:
+            self.idle_cpus.put_nowait(cpu)
+
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                try:
+                    request = json.loads(header)
+                    size = int(request["size"])
+                    fmt = request.get("format", "auto")
+                    max_cycles = min(int(request.get("max_cycles", self.max_cycles)), self.max_cycles)
+                    if fmt not in FORMATS:
+                        raise ValueError(f"unknown format {fmt!r}")
+                    if not 0 <= size <= MAX_PROGRAM_SIZE:
+                        raise ValueError(f"program size must be between 0 and {MAX_PROGRAM_SIZE}")
+                except (ValueError, KeyError, TypeError) as e:
+                    # the stream can't be trusted to be in step any more
+                    writer.write(self.result_line(ERROR, 0, None, None, f"bad request: {e}"))
+                    break
+
+                program = await reader.readexactly(size)
+                writer.write(await self.run(program, fmt, max_cycles, writer))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, program, fmt, max_cycles, writer):
+        """run a program on the next free CPU
+
+        :returns: the encoded result line
+        """
+        loop = asyncio.get_running_loop()
+        cpu = await self.idle_cpus.get()
+        try:
+            return await loop.run_in_executor(
+                self.executor, self.execute, cpu, program, fmt, max_cycles, ConnectionSink(loop, writer)
+            )
+        finally:
+            self.idle_cpus.put_nowait(cpu)
+
+    def execute(self, cpu, program, fmt, max_cycles, sink):
+        """reset cpu, load program and run it -- called on a worker thread"""
+        cpu.restore(self.clean_state)
+        try:
+            self.load(cpu, program, fmt)
+        except (ValueError, IndexError) as e:
+            return self.result_line(ERROR, 0, cpu.reg, cpu.pc, f"{type(e).__name__}: {e}")
+
+        try:
+            result = cpu.run(max_cycles=max_cycles, deadline=time.monotonic() + self.timeout, output=sink)
+        except Exception as e:
+            return self.result_line(ERROR, None, cpu.reg, cpu.pc, f"{type(e).__name__}: {e}")
+        return self.result_line(result.stop_reason, result.cycles, cpu.reg, cpu.pc, None)
+
+    @staticmethod
+    def load(cpu, program, fmt):
+        """load program into cpu according to its format (see FORMATS)"""
+        if fmt == "auto":
+            fmt = "image" if program.startswith(image.MAGIC) else "text"
+            try:
+                Server.load(cpu, program, fmt)
+            except ValueError:
+                if fmt == "image":
+                    raise
+                # not an `.ls8` listing -- take it as machine code
+                cpu.load_program(program)
+        elif fmt == "image":
+            cpu.load_image(image.load_buffer(program, cpu.ram))
+        elif fmt == "text":
+            # a UnicodeDecodeError is a ValueError too
+            cpu.load_program(parse_program(program.decode("ascii").splitlines()))
+        else:
+            cpu.load_program(program)
+
+    @staticmethod
+    def result_line(exit_reason, cycles, registers, pc, error):
+        record = {
+            "exit_reason": exit_reason,
+            "cycles": cycles,
+            "registers": None if registers is None else list(registers),
+            "pc": pc,
+            "error": error,
+        }
+        return json.dumps(record).encode() + b"\n"
+
+
+async def submit(program, fmt="auto", max_cycles=None, unix=None, host=None, port=None, output=None):
+    """send a program to a running server, streaming its output as it arrives
+
+    :param program: the program, as bytes
+    :param output: where to write the program's output (default: stdout)
+    :returns: the result record, as a dict
+    """
+    output = output or sys.stdout
+    if unix is not None:
+        reader, writer = await asyncio.open_unix_connection(unix)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        header = {"size": len(program), "format": fmt}
+        if max_cycles is not None:
+            header["max_cycles"] = max_cycles
+        writer.write(json.dumps(header).encode() + b"\n" + program)
+        await writer.drain()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("server closed the connection")
+            record = json.loads(line)
+            if "output" not in record:
+                return record
+            output.write(record["output"])
+            output.flush()
+    finally:
+        writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="resident LS-8 emulator server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the server")
+    submit_parser = commands.add_parser("submit", help="run a program on a running server")
+    for command in (serve_parser, submit_parser):
+        address = command.add_mutually_exclusive_group(required=True)
+        address.add_argument("--unix", metavar="PATH", help="Unix socket path")
+        address.add_argument("--port", type=int, help="TCP port")
+        command.add_argument("--host", default="127.0.0.1", help="TCP host (default: %(default)s)")
+
+    serve_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="default: %(default)s")
+    serve_parser.add_argument(
+        "--max-cycles", type=int, default=DEFAULT_MAX_CYCLES, help="largest budget per program (default: %(default)s)"
+    )
+    serve_parser.add_argument(
+        "--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per program (default: %(default)s)"
+    )
+
+    submit_parser.add_argument("program", help="a .ls8 or .ls8b file, or raw machine code")
+    submit_parser.add_argument("--format", choices=FORMATS, default="auto")
+    submit_parser.add_argument("--max-cycles", type=int, default=None)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = Server(args.workers, args.max_cycles, args.timeout)
+        if args.unix is not None and os.path.exists(args.unix):
+            os.unlink(args.unix)
+        try:
+            asyncio.run(server.serve(args.unix, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    with open(args.program, "rb") as file:
+        program = file.read()
+    result = asyncio.run(submit(program, args.format, args.max_cycles, args.unix, args.host, args.port))
+    # the program's output went to stdout as it arrived; the result record goes to stderr
+    print(json.dumps(result), file=sys.stderr)
+    return 0 if result["exit_reason"] != ERROR else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Ring-buffer execution trace recorder for the LS-8 CPU
+
+Usage: tracer.py trace_file
+
+Decodes and prints a trace dumped by TraceRecorder, oldest instruction first.
+"""
+__author__ = "Chaz Kiker"
+
+import struct
+import sys
+from collections import namedtuple
+
+from cpu import inverse_table
+
+DEFAULT_CAPACITY = 4096
+
+# dump file layout: header, then `count` records, oldest first
+# header: magic, version, record size, record count
+TRACE_MAGIC = b"LS8T"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<4sBxHI")
+# record: pc, ir, op_a, op_b, fl, sp, R0-R7
+TRACE_RECORD = struct.Struct("<HBBBBh8s")
+
+# a single decoded trace record -- the CPU state just before the instruction executed
+TraceRecord = namedtuple("TraceRecord", ["pc", "ir", "op_a", "op_b", "fl", "sp", "reg"])
+
+
+class TraceRecorder:
+    """runs a CPU while recording the last `capacity` instructions into a circular buffer
+
+    Every instruction appends one fixed-size record to a preallocated bytearray, overwriting
+    the oldest record once the buffer is full. The buffer is written out with `dump()` when
+    the run ends -- whether the CPU halted, faulted or ran out of budget -- so a crash comes
+    with its recent history.
+    """
+
+    def __init__(self, cpu, path, capacity=DEFAULT_CAPACITY):
+        """
+        :param cpu: the CPU to trace
+        :param path: where to dump the trace when the run ends
+        :param capacity: number of instructions to keep
+        """
+        self.cpu = cpu
+        self.path = path
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * TRACE_RECORD.size)
+        # total number of records ever written; the next one goes at index % capacity
+        self.index = 0
+
+    def run(self, max_cycles=None, deadline=None, output=None):
+        """Run the CPU with tracing; takes the same arguments and returns the same RunResult as `CPU.run()`."""
+        try:
+            return self.cpu.run_stepper(self.step, max_cycles, deadline, output)
+        finally:
+            self.dump()
+
+    def step(self):
+        """record the CPU state, then execute the instruction at PC"""
+        cpu = self.cpu
+        # service interrupts first, so the instruction accounted for is the one that runs
+        if cpu.interrupt_pending:
+            cpu.service_interrupts()
+        pc = cpu.pc
+        ir, op_a, op_b = (cpu.decoded[pc] or cpu.decode(pc)).raw
+
+        TRACE_RECORD.pack_into(
+            self.buffer, (self.index % self.capacity) * TRACE_RECORD.size,
+            pc, ir, op_a, op_b, cpu.fl, cpu.sp, cpu.reg
+        )
+        self.index += 1
+
+        cpu.step()
+
+    def records(self):
+        """the recorded bytes, oldest record first"""
+        if self.index <= self.capacity:
+            return self.buffer[:self.index * TRACE_RECORD.size]
+        split = (self.index % self.capacity) * TRACE_RECORD.size
+        return self.buffer[split:] + self.buffer[:split]
+
+    def dump(self):
+        """write the buffer to self.path"""
+        count = min(self.index, self.capacity)
+        with open(self.path, "wb") as file:
+            file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size, count))
+            file.write(self.records())
+
+
+def read_trace(path):
+    """read a dumped trace
+
+    :param path: a file written by TraceRecorder.dump()
+    :returns: a list of TraceRecords, oldest first
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+
+    magic, version, record_size, count = TRACE_HEADER.unpack_from(data, 0)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != TRACE_RECORD.size:
+        raise ValueError(f"{path} is not an LS-8 trace")
+
+    return [
+        TraceRecord(*fields)
+        for fields in TRACE_RECORD.iter_unpack(data[TRACE_HEADER.size:TRACE_HEADER.size + count * record_size])
+    ]
+
+
+def format_record(record):
+    """format a record the same way CPU::trace() prints the live state"""
+    name = inverse_table.get(record.ir, f"ir=({bin(record.ir)}, {record.ir})")
+    registers = " ".join("%02X" % value for value in record.reg)
+    return (
+        f"%02X: {name:<8} | %02X %02X %02X | FL=%02X SP=%02X | {registers}"
+        % (record.pc, record.ir, record.op_a, record.op_b, record.fl, record.sp & 0xFF)
+    )
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: tracer.py trace_file", file=sys.stderr)
+        return 1
+
+    for record in read_trace(argv[1]):
+        print(format_record(record))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,294 @@
+"""Lockstep execution of many LS-8 machines at once, vectorized with NumPy
+
+Every machine runs the same kind of program, but from its own RAM and register
+state. Each step executes one instruction on every running machine: machines are
+grouped by the opcode at their PC, and each group is executed as a handful of masked
+array operations. Machines that branch differently simply land in different groups
+on the next step.
+
+NumPy is optional -- only this module needs it.
+"""
+__author__ = "Chaz Kiker"
+
+from alu import AluOperations
+from cpu import (
+    RunResult, Snapshot, CALL, HLT, INT, IRET, JEQ, JGE, JGT, JLE, JLT, JMP, JNE, LD, LDI, NOP, POP, PRA,
+    PRN, PUSH, RET, ST, CYCLE_LIMIT, DIVIDE_BY_ZERO, HALTED, ILLEGAL_INSTRUCTION, MEMORY_FAULT,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# stop reasons besides the CPU's own
+# the machine hit an instruction the vector engine can't run in lockstep (INT, IRET)
+UNSUPPORTED = "unsupported"
+# the machine jumped to itself with no cycle budget to use up: with no interrupts in
+# lockstep, nothing could ever wake it (CPU.run() would wait on an interrupt forever)
+IDLE = "idle"
+
+RAM_SIZE = 256
+
+# FL: flags -- 00000LGE
+FL_L, FL_G, FL_E = 0b100, 0b010, 0b001
+
+# conditional jumps -- the flags each one jumps on (JNE jumps when E is clear)
+CONDITIONAL_JUMPS = {
+    JEQ: FL_E,
+    JNE: FL_E,
+    JGE: FL_E | FL_G,
+    JGT: FL_G,
+    JLE: FL_E | FL_L,
+    JLT: FL_L,
+}
+
+# two-register ALU operations, computed on int64 and wrapped back to 8 bits
+BINARY_OPERATIONS = {
+    AluOperations.ADD: lambda a, b: a + b,
+    AluOperations.SUB: lambda a, b: a - b,
+    AluOperations.MUL: lambda a, b: a * b,
+    AluOperations.AND: lambda a, b: a & b,
+    AluOperations.OR: lambda a, b: a | b,
+    AluOperations.XOR: lambda a, b: a ^ b,
+    # shifting by 8 or more clears every bit
+    AluOperations.SHL: lambda a, b: a << np.minimum(b, 8),
+    AluOperations.SHR: lambda a, b: a >> np.minimum(b, 8),
+}
+
+# single-register ALU operations
+UNARY_OPERATIONS = {
+    AluOperations.INC: lambda a: a + 1,
+    AluOperations.DEC: lambda a: a - 1,
+    AluOperations.NOT: lambda a: ~a,
+}
+
+# how many of their operands these instructions read as registers before doing anything
+# else -- an operand past R7 is a memory fault on the CPU, so it is here too
+# (DIV, MOD, PUSH, CALL and the conditional jumps check theirs part way through, as CPU does)
+REGISTER_OPERANDS = {
+    **{ir: 2 for ir in BINARY_OPERATIONS},
+    **{ir: 1 for ir in UNARY_OPERATIONS},
+    AluOperations.CMP: 2, LD: 2, ST: 2,
+    LDI: 1, POP: 1, PRN: 1, PRA: 1, JMP: 1,
+}
+
+# the stack addresses CPU.ram accepts: Python indexing lets SP run 256 bytes below 0
+STACK_RANGE = (-RAM_SIZE, RAM_SIZE - 1)
+
+
+class VectorCPU:
+    """N LS-8 machines, run in lockstep
+
+    State lives in NumPy arrays with one row per machine:
+
+    * ram -- (N, 256) uint8
+    * reg -- (N, 8) uint8
+    * pc, sp, fl -- (N,) int64
+
+    Set up the machines by writing into those arrays (e.g. a different R0 per machine)
+    between construction and `run()`. Machines stop independently; `run()` reports a
+    RunResult per machine, and `output[i]` holds everything machine i printed.
+    """
+
+    def __init__(self, n, program=None):
+        """
+        :param n: number of machines
+        :param program: optional list of bytes to load into every machine at address 0
+        """
+        if np is None:
+            raise ImportError("VectorCPU needs NumPy -- pip install numpy")
+
+        self.n = n
+        self.ram = np.zeros((n, RAM_SIZE), dtype=np.uint8)
+        self.reg = np.zeros((n, 8), dtype=np.uint8)
+        # R7 is reserved as the stack pointer (SP), tracked separately like CPU.sp
+        self.reg[:, 7] = 0xF4
+        self.sp = np.full(n, 0xF4, dtype=np.int64)
+        self.pc = np.zeros(n, dtype=np.int64)
+        self.fl = np.zeros(n, dtype=np.int64)
+
+        self.running = np.ones(n, dtype=bool)
+        self.cycles = np.zeros(n, dtype=np.int64)
+        self.stop_reasons = [None] * n
+        self.output = [[] for _ in range(n)]
+
+        if program is not None:
+            self.ram[:, :len(program)] = np.asarray(program, dtype=np.uint8) & 0xFF
+
+    @classmethod
+    def from_snapshot(cls, snapshot, n):
+        """N copies of the machine captured by `CPU.snapshot()`"""
+        vector = cls(n)
+        vector.ram[:] = np.frombuffer(snapshot.ram, dtype=np.uint8)
+        vector.reg[:] = np.frombuffer(snapshot.reg, dtype=np.uint8)
+        vector.pc[:], vector.sp[:], vector.fl[:] = snapshot.pc, snapshot.sp, snapshot.fl
+        return vector
+
+    def snapshot(self, i):
+        """the state of machine i, as a Snapshot that `CPU.restore()` accepts"""
+        return Snapshot(
+            self.ram[i].tobytes(), self.reg[i].tobytes(),
+            int(self.pc[i]), int(self.sp[i]), int(self.fl[i]), True, {}, {}, None, 0
+        )
+
+    def run(self, max_cycles=None):
+        """Run every machine until it stops, or until max_cycles steps have passed.
+
+        A machine that jumps to itself can't do anything more: as with `CPU.run()`, it uses
+        up the rest of max_cycles at once, or stops as IDLE if there is no limit.
+
+        :returns: a list with a RunResult per machine
+        """
+        steps = 0
+        while self.running.any() and (max_cycles is None or steps < max_cycles):
+            self.step()
+            steps += 1
+
+        results = []
+        for reason, cycles in zip(self.stop_reasons, self.cycles):
+            if reason is None or (reason == IDLE and max_cycles is not None):
+                reason, cycles = CYCLE_LIMIT, max_cycles if reason == IDLE else cycles
+            results.append(RunResult(reason, int(cycles)))
+        return results
+
+    def outputs(self):
+        """everything each machine printed, as one string per machine"""
+        return ["".join(chunks) for chunks in self.output]
+
+    def step(self):
+        """execute one instruction on every running machine"""
+        active = np.flatnonzero(self.running)
+        # as with CPU.run(), the instruction counts even if it faults
+        self.cycles[active] += 1
+
+        # machines whose PC leaves no room for the operand bytes can't fetch
+        active, = self.drop(active, self.pc[active] > RAM_SIZE - 3, MEMORY_FAULT)
+
+        pc = self.pc[active]
+        irs = self.ram[active, pc]
+        op_a = self.ram[active, pc + 1].astype(np.int64)
+        op_b = self.ram[active, pc + 2].astype(np.int64)
+
+        for ir in np.unique(irs):
+            group = irs == ir
+            self.execute(int(ir), active[group], op_a[group], op_b[group])
+
+    def stop(self, rows, reason):
+        self.running[rows] = False
+        for row in rows:
+            self.stop_reasons[row] = reason
+
+    def drop(self, rows, stopped, reason, *columns):
+        """stop the machines in rows where stopped is set
+
+        :param columns: arrays lined up with rows, to filter along with it
+        :returns: rows and each of columns, without the stopped machines
+        """
+        if not stopped.any():
+            return (rows, *columns)
+        self.stop(rows[stopped], reason)
+        kept = ~stopped
+        return (rows[kept], *(column[kept] for column in columns))
+
+    def stack_fault(self, rows, *columns):
+        """drop the machines in rows whose SP is out of RAM's reach, as a memory fault"""
+        sp = self.sp[rows]
+        return self.drop(rows, (sp < STACK_RANGE[0]) | (sp > STACK_RANGE[1]), MEMORY_FAULT, *columns)
+
+    def execute(self, ir, rows, op_a, op_b):
+        """execute instruction ir on the machines in rows
+
+        :param op_a: each machine's first operand byte
+        :param op_b: each machine's second operand byte
+        """
+        # AABCDDDD -- number of operands, ALU flag, sets-PC flag, instruction id
+        num_ops = ir >> 6
+        sets_pc = (ir >> 4) & 1
+        reg = self.reg
+        if REGISTER_OPERANDS.get(ir) == 1:
+            rows, op_a, op_b = self.drop(rows, op_a > 7, MEMORY_FAULT, op_a, op_b)
+        elif REGISTER_OPERANDS.get(ir) == 2:
+            rows, op_a, op_b = self.drop(rows, (op_a > 7) | (op_b > 7), MEMORY_FAULT, op_a, op_b)
+        a, b = op_a, op_b
+
+        if ir in BINARY_OPERATIONS:
+            result = BINARY_OPERATIONS[ir](reg[rows, a].astype(np.int64), reg[rows, b].astype(np.int64))
+            reg[rows, a] = result & 0xFF
+        elif ir in UNARY_OPERATIONS:
+            reg[rows, a] = UNARY_OPERATIONS[ir](reg[rows, a].astype(np.int64)) & 0xFF
+        elif ir in (AluOperations.DIV, AluOperations.MOD):
+            # the divisor is checked for 0 before registerA is touched
+            rows, a, b = self.drop(rows, b > 7, MEMORY_FAULT, a, b)
+            rows, a, b = self.drop(rows, reg[rows, b] == 0, DIVIDE_BY_ZERO, a, b)
+            rows, a, b = self.drop(rows, a > 7, MEMORY_FAULT, a, b)
+            divisor = reg[rows, b]
+            if ir == AluOperations.DIV:
+                reg[rows, a] = reg[rows, a] // divisor
+            else:
+                reg[rows, a] = reg[rows, a] % divisor
+        elif ir == AluOperations.CMP:
+            x, y = reg[rows, a], reg[rows, b]
+            self.fl[rows] = np.where(x == y, FL_E, np.where(x < y, FL_L, FL_G))
+
+        elif ir == LDI:
+            reg[rows, a] = op_b
+        elif ir == LD:
+            reg[rows, a] = self.ram[rows, reg[rows, b]]
+        elif ir == ST:
+            self.ram[rows, reg[rows, a]] = reg[rows, b]
+        elif ir == PUSH:
+            self.sp[rows] -= 1
+            rows, a = self.drop(rows, a > 7, MEMORY_FAULT, a)
+            rows, a = self.stack_fault(rows, a)
+            self.ram[rows, self.sp[rows] % RAM_SIZE] = reg[rows, a]
+        elif ir == POP:
+            rows, a = self.stack_fault(rows, a)
+            reg[rows, a] = self.ram[rows, self.sp[rows] % RAM_SIZE]
+            self.sp[rows] += 1
+        elif ir in (PRN, PRA):
+            for row, value in zip(rows, reg[rows, a]):
+                self.output[row].append(f"{value}\n" if ir == PRN else chr(value))
+        elif ir == HLT:
+            self.stop(rows, HALTED)
+            return
+        elif ir == NOP:
+            pass
+
+        elif ir == JMP:
+            self.jump(rows, a)
+        elif ir in CONDITIONAL_JUMPS:
+            taken = (self.fl[rows] & CONDITIONAL_JUMPS[ir]) != 0
+            if ir == JNE:
+                taken = ~taken
+            # only a jump that is taken reads its register
+            self.pc[rows[~taken]] += 2
+            self.jump(rows[taken], a[taken])
+        elif ir == CALL:
+            self.sp[rows] -= 1
+            rows, a = self.stack_fault(rows, a)
+            self.ram[rows, self.sp[rows] % RAM_SIZE] = (self.pc[rows] + 2) & 0xFF
+            rows, a = self.drop(rows, a > 7, MEMORY_FAULT, a)
+            self.pc[rows] = reg[rows, a]
+        elif ir == RET:
+            rows, = self.stack_fault(rows)
+            self.pc[rows] = self.ram[rows, self.sp[rows] % RAM_SIZE]
+            self.sp[rows] += 1
+
+        elif ir in (INT, IRET):
+            # interrupts have no lockstep form
+            self.stop(rows, UNSUPPORTED)
+            return
+        else:
+            self.stop(rows, ILLEGAL_INSTRUCTION)
+            return
+
+        if not sets_pc:
+            self.pc[rows] += 1 + num_ops
+
+    def jump(self, rows, a):
+        """set each machine's PC to its register a, stopping those that jump to themselves"""
+        rows, a = self.drop(rows, a > 7, MEMORY_FAULT, a)
+        target = self.reg[rows, a]
+        rows, target = self.drop(rows, target == self.pc[rows], IDLE, target)
+        self.pc[rows] = target
@@ -0,0 +1,39 @@
+"""Shared setup for the LS-8 tests
+
+The emulator (ls8/) and the assembler (asm/) are directories of flat scripts rather
+than packages, so both are put on sys.path, the same way bench.py reaches the assembler.
+"""
+
+import io
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+EXAMPLES = ROOT / "ls8" / "examples"
+SOURCES = ROOT / "asm"
+
+sys.path.insert(0, str(SOURCES))
+sys.path.insert(0, str(ROOT / "ls8"))
+
+import asm  # noqa: E402
+
+# what every example that runs to HLT on its own prints
+EXPECTED_OUTPUT = {
+    "call": "20\n30\n36\n60\n",
+    "mult": "72\n",
+    "print8": "8\n",
+    "printstr": "Hello, world!\n",
+    "sctest": "1\n4\n5\n",
+    "stack": "2\n4\n1\n",
+}
+
+
+def assemble_source(name, binary=False, optimized=False):
+    """assemble asm/<name>.asm in memory
+
+    :returns: the image bytes if binary, else the text listing
+    """
+    output = io.BytesIO() if binary else io.StringIO()
+    with open(SOURCES / f"{name}.asm") as source:
+        asm.assemble_file(source, output, binary, optimized)
+    return output.getvalue()
@@ -0,0 +1,101 @@
+"""Tests for the ALU and the flags CMP leaves for the conditional jumps"""
+
+import io
+
+import pytest
+
+from blocks import BlockEngine
+from cpu import CPU, DIVIDE_BY_ZERO, HALTED
+
+from conftest import asm
+
+ENGINES = {
+    "interpreter": lambda cpu: cpu.run,
+    "blocks": lambda cpu: BlockEngine(cpu).run,
+}
+
+
+def run_source(source, engine):
+    cpu = CPU()
+    cpu.load_program(asm.assemble(source))
+    output = io.StringIO()
+    result = ENGINES[engine](cpu)(max_cycles=1000, output=output)
+    return cpu, result, output.getvalue()
+
+
+# compares 5 with 3 first, so a stale G or L flag would leak into the second compare
+JUMP_PROGRAM = """
+    LDI R0,5
+    LDI R1,3
+    CMP R0,R1
+    LDI R0,{a}
+    LDI R1,{b}
+    CMP R0,R1
+    LDI R2,Taken
+    {jump} R2
+    LDI R3,0
+    PRN R3
+    HLT
+Taken:
+    LDI R3,1
+    PRN R3
+    HLT
+"""
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("jump, taken", [
+    # taken for (equal, greater, less)
+    ("JEQ", (1, 0, 0)),
+    ("JNE", (0, 1, 1)),
+    ("JGT", (0, 1, 0)),
+    ("JGE", (1, 1, 0)),
+    ("JLT", (0, 0, 1)),
+    ("JLE", (1, 0, 1)),
+])
+def test_cmp_then_jump(engine, jump, taken):
+    for (a, b), expected in zip(((3, 3), (4, 3), (2, 3)), taken):
+        cpu, result, output = run_source(JUMP_PROGRAM.format(a=a, b=b, jump=jump), engine)
+
+        assert result.stop_reason == HALTED
+        assert output == f"{expected}\n", (a, b)
+        assert cpu.fl in (0b001, 0b010, 0b100)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("operation, a, b, expected", [
+    ("ADD", 200, 100, 44),
+    ("SUB", 3, 5, 254),
+    ("MUL", 16, 17, 16),
+    ("SHL", 1, 7, 128),
+    ("SHL", 1, 8, 0),
+    ("SHL", 0xFF, 200, 0),
+    ("SHR", 0x80, 9, 0),
+])
+def test_results_wrap_to_8_bits(engine, operation, a, b, expected):
+    cpu, result, output = run_source(f"""
+        LDI R0,{a}
+        LDI R1,{b}
+        {operation} R0,R1
+        PRN R0
+        HLT
+    """, engine)
+
+    assert result.stop_reason == HALTED
+    assert output == f"{expected}\n"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("operation", ["DIV", "MOD"])
+def test_divide_by_zero_faults(engine, operation):
+    cpu, result, output = run_source(f"""
+        LDI R0,7
+        LDI R1,0
+        {operation} R0,R1
+        PRN R0
+        HLT
+    """, engine)
+
+    assert result == (DIVIDE_BY_ZERO, 3)
+    assert output == ""
+    assert cpu.reg[0] == 7
@@ -0,0 +1,109 @@
+"""Tests for the static analyzer"""
+
+import pytest
+
+import analyzer
+from cpu import CPU
+
+from conftest import EXAMPLES, EXPECTED_OUTPUT, asm
+
+
+def analyze_source(source):
+    cpu = CPU()
+    cpu.load_program(asm.assemble(source))
+    return analyzer.analyze(cpu.ram)
+
+
+def messages(analysis):
+    return [issue.message for issue in analysis.issues]
+
+
+@pytest.mark.parametrize("name", EXPECTED_OUTPUT)
+def test_examples_are_safe(name):
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / f"{name}.ls8"))
+    analysis = analyzer.analyze(cpu.ram)
+
+    assert analysis.issues == [] and analysis.safe
+    assert analysis.max_depth is not None
+
+
+def test_call_depth():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "call.ls8"))
+    analysis = analyzer.analyze(cpu.ram)
+
+    assert analysis.functions[0x18] == analyzer.Function(
+        0x18, analyzer.SUBROUTINE, (0x18, 0x1B, 0x1D), (), 0
+    )
+    # each CALL pushes a return address
+    assert analysis.max_depth == 1
+
+
+def test_stackoverflow_is_unsafe():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "stackoverflow.ls8"))
+    analysis = analyzer.analyze(cpu.ram)
+
+    assert not analysis.safe
+    assert analysis.max_depth is None
+    assert "stack grows on every pass through here" in messages(analysis)
+
+
+@pytest.mark.parametrize("source, message", [
+    ("""
+        LDI R1,Recurse
+        CALL R1
+        HLT
+    Recurse:
+        CALL R1
+        RET
+    """, "recursive call -- stack depth isn't bounded"),
+    (f"""
+        PUSH R0
+        PUSH R0
+        PUSH R0
+        POP R0
+        POP R0
+        POP R0
+        HLT
+        DS {"A" * 230}
+    """, "the stack reaches down to 0xf1, into the program (which ends at 0xf3)"),
+    ("""
+        LDI R0,0x80
+        LD R1,R0
+        ST R1,R0
+        HLT
+    """, "ST to an address that isn't known -- it may overwrite code"),
+    ("""
+        LDI R0,0
+        LDI R1,0
+        ST R0,R1
+        HLT
+    """, "ST overwrites code at 0x00"),
+    ("""
+        LDI R0,0x80
+        LD R1,R0
+        JMP R1
+    """, "jump through R1, which holds no known address"),
+    ("""
+        LDI R0,0x80
+        LD R1,R0
+        CALL R1
+        HLT
+    """, "CALL through R1, which holds no known address"),
+])
+def test_hazards_are_flagged(source, message):
+    analysis = analyze_source(source)
+
+    assert message in messages(analysis)
+    assert not analysis.safe
+
+
+def test_unsafe_program_is_refused_the_fast_path():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "stackoverflow.ls8"))
+
+    with pytest.raises(ValueError):
+        cpu.enable_fast_path(analyzer.analyze(cpu.ram))
+    assert not cpu.fast_path
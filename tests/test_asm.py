@@ -0,0 +1,106 @@
+"""Tests for the assembler"""
+
+import io
+
+import pytest
+
+import image
+
+from conftest import asm
+
+
+def assemble(source, optimized, banks=None):
+    sym = {}
+    code = asm.assemble(source, sym, banks, optimized)
+    return code, sym
+
+
+def test_optimizer_moves_labels_at_the_end_of_bank_0():
+    # End lands at the last byte of bank 0
+    source = f"""
+        NOP
+        LDI R0,End
+        JMP R0
+        DS {"A" * 249}
+    End:
+        HLT
+    """
+    code, sym = assemble(source, optimized=False)
+    optimized, optimized_sym = assemble(source, optimized=True)
+
+    assert sym["END"] == 255
+    assert optimized_sym["END"] == sym["END"] - 1
+    assert optimized[optimized_sym["END"]] == asm.OPCODE_BYTES["HLT"]
+    # LDI R0,End now comes first, with the moved address patched in
+    assert optimized[:3] == bytes([asm.OPCODE_BYTES["LDI"], 0, optimized_sym["END"]])
+
+
+@pytest.mark.parametrize("source, error", [
+    # a label at bank 0 offset 256 would have the address of bank 1 offset 0
+    (f"""
+        DS {"A" * 256}
+    End:
+        HLT
+    """, "label END is past the end of bank 0"),
+    (f"""
+        DS {"A" * 256}
+        HLT
+    """, "bank 0 overflows"),
+    (f"""
+        HLT
+    BANK 3
+        DS {"A" * 256}
+    Table:
+    """, "label TABLE is past the end of bank 3"),
+    (f"""
+        HLT
+    BANK 3
+        DS {"A" * 257}
+    """, "bank 3 overflows"),
+])
+def test_bank_overflow_is_an_error(capsys, source, error):
+    with pytest.raises(SystemExit):
+        assemble(source, optimized=False, banks={})
+    assert error in capsys.readouterr().err
+
+
+def test_optimizer_leaves_other_banks_alone():
+    source = """
+        NOP
+        LDI R0,Table.BANK
+        LDI R1,Table
+        HLT
+    BANK 3
+        DB 1
+    Table:
+        DB 2
+    """
+    banks = {}
+    optimized, sym = assemble(source, optimized=True, banks=banks)
+
+    assert sym["TABLE"] == 3 << 8 | 1
+    assert optimized == bytes([
+        asm.OPCODE_BYTES["LDI"], 0, 3,
+        asm.OPCODE_BYTES["LDI"], 1, 1,
+        asm.OPCODE_BYTES["HLT"],
+    ])
+    assert banks == {3: bytearray([1, 2])}
+
+
+def test_image_round_trip():
+    source = """
+        LDI R0,Table.BANK
+        LDI R1,Table
+        HLT
+    BANK 3
+        DB 1
+    Table:
+        DB 2
+    """
+    output = io.BytesIO()
+    asm.assemble_file(io.StringIO(source), output, binary=True)
+    parsed = image.parse(output.getvalue())
+
+    assert bytes(parsed.payload) == asm.assemble(source, banks={})
+    assert parsed.symbols == {"TABLE": 3 << 8 | 1}
+    assert parsed.banks == {3: bytes([1, 2])}
@@ -0,0 +1,59 @@
+"""Tests for the headless batch runner"""
+
+import shutil
+
+import pytest
+
+import batch
+import image
+from cpu import CYCLE_LIMIT, HALTED, MEMORY_FAULT
+
+from conftest import EXAMPLES, EXPECTED_OUTPUT, assemble_source
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """a directory of programs, with a manifest listing some of them"""
+    programs = tmp_path / "programs"
+    (programs / "nested").mkdir(parents=True)
+    for name in ("call", "stackoverflow", "interrupts"):
+        shutil.copy(EXAMPLES / f"{name}.ls8", programs)
+    (programs / "nested" / f"printstr{image.EXTENSION}").write_bytes(assemble_source("printstr", binary=True))
+    (programs / "broken.ls8").write_text("not a program\n")
+    (programs / "notes.txt").write_text("not collected\n")
+    (tmp_path / "manifest").write_text("# a comment\nprograms/call.ls8\n\nprograms/interrupts.ls8\n")
+    return tmp_path
+
+
+def test_directory(corpus):
+    paths = batch.collect_programs(corpus / "programs")
+    ordered = list(batch.run_batch(paths, max_cycles=10_000, workers=2))
+    results = {result.path: result for result in ordered}
+
+    assert [result.path for result in ordered] == paths
+    assert sorted(results) == sorted(str(corpus / "programs" / name) for name in (
+        "broken.ls8", "call.ls8", "interrupts.ls8", f"nested/printstr{image.EXTENSION}", "stackoverflow.ls8"
+    ))
+
+    call = results[str(corpus / "programs" / "call.ls8")]
+    assert (call.exit_reason, call.output, call.error) == (HALTED, EXPECTED_OUTPUT["call"], None)
+    printstr = results[str(corpus / "programs" / "nested" / f"printstr{image.EXTENSION}")]
+    assert (printstr.exit_reason, printstr.output) == (HALTED, EXPECTED_OUTPUT["printstr"])
+    stackoverflow = results[str(corpus / "programs" / "stackoverflow.ls8")]
+    assert (stackoverflow.exit_reason, stackoverflow.cycles) == (MEMORY_FAULT, 911)
+    # spins waiting for a timer that never comes, until the budget runs out
+    interrupts = results[str(corpus / "programs" / "interrupts.ls8")]
+    assert (interrupts.exit_reason, interrupts.cycles, interrupts.output) == (CYCLE_LIMIT, 10_000, "")
+    broken = results[str(corpus / "programs" / "broken.ls8")]
+    assert broken.exit_reason == batch.ERROR and broken.error.startswith("ValueError")
+
+
+def test_manifest(corpus):
+    paths = batch.collect_programs(corpus / "manifest")
+    assert paths == [str(corpus / "programs" / "call.ls8"), str(corpus / "programs" / "interrupts.ls8")]
+
+    results = list(batch.run_batch(paths, max_cycles=500, workers=1))
+    assert [(result.exit_reason, result.output) for result in results] == [
+        (HALTED, EXPECTED_OUTPUT["call"]), (CYCLE_LIMIT, ""),
+    ]
+    assert results[0].registers[7] == 0xF4
@@ -0,0 +1,90 @@
+"""Tests for the benchmark suite"""
+
+import json
+
+import pytest
+
+import bench
+from bench import Measurement
+
+from conftest import asm
+
+RESULTS = {
+    "cpu.interpreter.tight_loop": Measurement(1000.0, "instructions/s", True),
+    "asm.assemble": Measurement(2.0, "s", False),
+}
+
+
+def baseline_file(tmp_path, values):
+    """RESULTS as an earlier run's JSON, with some values changed"""
+    document = bench.to_json(RESULTS)
+    for name, value in values.items():
+        document["benchmarks"][name]["value"] = value
+    path = tmp_path / "baseline.json"
+    path.write_text(json.dumps(document))
+    return path
+
+
+def test_json_output(tmp_path):
+    path = tmp_path / "results.json"
+    assert bench.main(["--output", str(path), "--cycles", "1000", "--repeat", "1"]) == 0
+
+    document = json.loads(path.read_text())
+    assert document["version"] == bench.RESULTS_VERSION
+    assert {"version", "implementation"} <= document["python"].keys()
+    benchmarks = document["benchmarks"]
+    assert benchmarks.keys() == {
+        *(f"cpu.{engine}.{name}" for engine in bench.ENGINES for name in bench.WORKLOADS),
+        "asm.assemble", "load.text", "load.image",
+    }
+    for name, measurement in benchmarks.items():
+        assert measurement["value"] > 0
+        assert measurement["higher_is_better"] == name.startswith("cpu.")
+        assert measurement["unit"] == ("instructions/s" if name.startswith("cpu.") else "s")
+
+
+def test_generated_source_assembles():
+    banks = {}
+    code = asm.assemble(bench.generate_source(100), banks=banks)
+
+    assert code[-1] == asm.OPCODE_BYTES["HLT"]
+    assert len(banks) == -(-100 // bench.CHUNKS_PER_BANK)
+
+
+@pytest.mark.parametrize("values, regressed", [
+    ({}, {}),
+    # both got better
+    ({"cpu.interpreter.tight_loop": 500.0, "asm.assemble": 3.0}, {}),
+    # both got worse, but within the threshold
+    ({"cpu.interpreter.tight_loop": 1050.0, "asm.assemble": 1.9}, {}),
+    # half the instructions per second
+    ({"cpu.interpreter.tight_loop": 2000.0}, {"cpu.interpreter.tight_loop": 0.5}),
+    # twice the time
+    ({"asm.assemble": 1.0}, {"asm.assemble": 1.0}),
+])
+def test_compare(tmp_path, values, regressed):
+    baseline = json.loads(baseline_file(tmp_path, values).read_text())
+    regressions = bench.compare(RESULTS, baseline, 0.1)
+
+    assert {regression.name: regression.change for regression in regressions} == pytest.approx(regressed)
+
+
+def test_compare_skips_benchmarks_missing_from_the_baseline(tmp_path):
+    baseline = json.loads(baseline_file(tmp_path, {}).read_text())
+    del baseline["benchmarks"]["asm.assemble"]
+
+    assert bench.compare({**RESULTS, "asm.assemble": Measurement(99.0, "s", False)}, baseline, 0.1) == []
+
+
+@pytest.mark.parametrize("values, status", [({}, 0), ({"asm.assemble": 1.0}, 1)])
+def test_regression_exit_status(tmp_path, monkeypatch, capsys, values, status):
+    monkeypatch.setattr(bench, "run_benchmarks", lambda cycles, repeat: RESULTS)
+    baseline = baseline_file(tmp_path, values)
+
+    assert bench.main(["--baseline", str(baseline)]) == status
+    captured = capsys.readouterr()
+    assert json.loads(captured.out)["benchmarks"]["asm.assemble"]["value"] == 2.0
+    if status:
+        assert "REGRESSION asm.assemble: 1 -> 2 (100.0% worse)" in captured.err
+    else:
+        assert "no regressions beyond 10%" in captured.err
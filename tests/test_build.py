@@ -0,0 +1,104 @@
+"""Tests for the incremental build"""
+
+import shutil
+
+import pytest
+
+import build
+
+from conftest import EXAMPLES, SOURCES
+
+NAMES = ["call", "mult", "stack"]
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """copies of a few example sources, so they can be changed"""
+    directory = tmp_path / "src"
+    directory.mkdir()
+    for name in NAMES:
+        shutil.copy(SOURCES / f"{name}.asm", directory)
+    return [directory / f"{name}.asm" for name in NAMES]
+
+
+def build_all(tmp_path, sources, **options):
+    return build.build_all(sources, tmp_path / "out", tmp_path / "cache", jobs=1, **options)
+
+
+def test_first_build_assembles_every_source(tmp_path, sources):
+    summary = build_all(tmp_path, sources)
+
+    assert summary == build.BuildSummary(3, 0, 0, [])
+    for name in NAMES:
+        assert (tmp_path / "out" / f"{name}.ls8").read_text() == (EXAMPLES / f"{name}.ls8").read_text()
+
+
+def test_rebuild_without_changes_does_nothing(tmp_path, sources):
+    build_all(tmp_path, sources)
+    outputs = {path: path.stat().st_mtime_ns for path in (tmp_path / "out").iterdir()}
+
+    assert build_all(tmp_path, sources) == build.BuildSummary(0, 0, 3, [])
+    assert {path: path.stat().st_mtime_ns for path in (tmp_path / "out").iterdir()} == outputs
+
+
+def test_changed_source_is_assembled_again(tmp_path, sources):
+    build_all(tmp_path, sources)
+    sources[1].write_text(sources[1].read_text() + "\nHLT\n")
+
+    assert build_all(tmp_path, sources) == build.BuildSummary(1, 0, 2, [])
+    assert (tmp_path / "out" / "mult.ls8").read_text().endswith("00000001 # HLT\n00000001 # HLT\n")
+
+
+def test_source_changed_back_comes_from_the_cache(tmp_path, sources, monkeypatch):
+    original = sources[1].read_text()
+    build_all(tmp_path, sources)
+    sources[1].write_text(original + "\nHLT\n")
+    build_all(tmp_path, sources)
+    sources[1].write_text(original)
+
+    # nothing may be assembled on the way back
+    monkeypatch.setattr(build, "build", lambda *args: pytest.fail("assembled a cached source"))
+    assert build_all(tmp_path, sources) == build.BuildSummary(0, 1, 2, [])
+    assert (tmp_path / "out" / "mult.ls8").read_text() == (EXAMPLES / "mult.ls8").read_text()
+
+
+def test_new_assembler_rebuilds_everything(tmp_path, sources, monkeypatch):
+    # ASSEMBLER_VERSION is the hash of asm.py and image.py, so this is what editing either does
+    build_all(tmp_path, sources)
+    monkeypatch.setattr(build, "ASSEMBLER_VERSION", "0" * 64)
+
+    assert build_all(tmp_path, sources) == build.BuildSummary(3, 0, 0, [])
+
+
+def test_build_options_are_part_of_the_key(tmp_path, sources):
+    build_all(tmp_path, sources)
+
+    assert build_all(tmp_path, sources, optimized=True) == build.BuildSummary(3, 0, 0, [])
+    assert build_all(tmp_path, sources) == build.BuildSummary(0, 3, 0, [])
+
+
+def test_force_assembles_up_to_date_sources(tmp_path, sources):
+    build_all(tmp_path, sources)
+
+    assert build_all(tmp_path, sources, force=True) == build.BuildSummary(3, 0, 0, [])
+
+
+def test_failed_source_keeps_no_output(tmp_path, sources):
+    sources[0].write_text("FROB R0\n")
+
+    summary = build_all(tmp_path, sources)
+
+    assert summary.assembled == 2
+    assert [source for source, _ in summary.failed] == [str(sources[0])]
+    assert not (tmp_path / "out" / "call.ls8").exists()
+
+
+def test_default_build_leaves_hand_written_examples_alone(tmp_path, capsys):
+    status = build.main(["build.py", "-j", "1", "--output-dir", str(tmp_path / "out"),
+                         "--cache-dir", str(tmp_path / "cache")])
+
+    assert status == 0
+    built = {path.stem for path in (tmp_path / "out").glob("*.ls8")}
+    assert built == {path.stem for path in SOURCES.glob("*.asm")} - build.HAND_WRITTEN
+    assert "print8" not in built
+    assert (EXAMPLES / "print8.ls8").read_text().startswith("# Print the number 8")
@@ -0,0 +1,78 @@
+"""Tests for buffered console output"""
+
+import io
+
+import console
+from console import Console
+from cpu import CPU
+
+from conftest import asm
+
+
+def test_flushes_at_max_size():
+    sink = io.StringIO()
+    buffered = Console(sink, max_size=4, interval=None)
+    buffered.write("abc")
+    assert sink.getvalue() == ""
+    buffered.write("d")
+    assert sink.getvalue() == "abcd"
+
+
+def test_line_buffered_flushes_on_newline():
+    sink = io.StringIO()
+    buffered = Console(sink, interval=None, line_buffered=True)
+    buffered.write("ab")
+    assert sink.getvalue() == ""
+    buffered.write("c\n")
+    assert sink.getvalue() == "abc\n"
+
+    # newlines alone don't flush otherwise
+    buffered.line_buffered = False
+    buffered.write("d\n")
+    assert sink.getvalue() == "abc\n"
+
+
+def test_interval_flushes_only_on_poll(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(console.time, "monotonic", lambda: now[0])
+    sink = io.StringIO()
+    buffered = Console(sink, interval=1.0)
+
+    buffered.write("a")
+    now[0] = 5.0
+    buffered.write("b")
+    assert sink.getvalue() == ""
+
+    buffered.poll()
+    assert sink.getvalue() == "ab"
+    buffered.write("c")
+    now[0] = 5.5
+    buffered.poll()
+    assert sink.getvalue() == "ab"
+    now[0] = 6.0
+    buffered.poll()
+    assert sink.getvalue() == "abc"
+
+
+def test_write_doesnt_read_the_clock(monkeypatch):
+    buffered = Console(io.StringIO())
+
+    def monotonic():
+        raise AssertionError("write() read the clock")
+
+    monkeypatch.setattr(console.time, "monotonic", monotonic)
+    for _ in range(10):
+        buffered.write("x")
+
+
+def test_run_flushes_when_it_stops():
+    cpu = CPU()
+    cpu.load_program(asm.assemble("""
+        LDI R0,65
+        PRA R0
+        HLT
+    """))
+    sink = io.StringIO()
+    cpu.console = Console(sink, interval=None)
+    cpu.run()
+    assert sink.getvalue() == "A"
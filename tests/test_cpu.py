@@ -0,0 +1,347 @@
+"""Regression tests for the CPU core"""
+
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import analyzer
+import image
+from blocks import BlockEngine
+from cpu import CPU, CALL, CYCLE_LIMIT, HALTED, HLT, MEMORY_FAULT, parse_program
+from devices import ConsoleDevice
+from server import Server
+
+from conftest import EXAMPLES, ROOT, asm
+
+ENGINES = {
+    "interpreter": lambda cpu: cpu.run,
+    "blocks": lambda cpu: BlockEngine(cpu).run,
+}
+
+
+def run_source(source, engine="interpreter", max_cycles=1000):
+    cpu = CPU()
+    cpu.load_program(asm.assemble(source))
+    output = io.StringIO()
+    result = ENGINES[engine](cpu)(max_cycles=max_cycles, output=output)
+    return cpu, result, output.getvalue()
+
+
+INT_PROGRAM = """
+    LDI R0,Handler
+    LDI R1,0xF8
+    ST R1,R0
+    LDI R5,{mask}
+    LDI R0,0
+    INT R0
+    LDI R2,2
+    PRN R2
+    HLT
+Handler:
+    LDI R2,1
+    PRN R2
+    IRET
+"""
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_int_returns_past_itself(engine):
+    _, result, output = run_source(INT_PROGRAM.format(mask=1), engine)
+
+    assert output == "1\n2\n"
+    assert result == (HALTED, 12)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_masked_int_falls_through(engine):
+    _, result, output = run_source(INT_PROGRAM.format(mask=0), engine)
+
+    assert output == "2\n"
+    assert result == (HALTED, 9)
+
+
+BANKED_PROGRAM = """
+    LDI R0,Table.BANK
+    LDI R1,0xF5
+    ST R1,R0
+    LDI R1,Table
+    LD R2,R1
+    PRN R2
+    HLT
+BANK 3
+Table:
+    DB 42
+"""
+
+# reads the byte at 0xF5, then stores to 0x80 -- plain RAM, unless a bus is left over
+PLAIN_PROGRAM = """
+    LDI R0,0xF5
+    LD R1,R0
+    PRN R1
+    LDI R0,0x80
+    LDI R1,7
+    ST R0,R1
+    HLT
+"""
+
+
+def load_banked(cpu):
+    code_image = io.BytesIO()
+    asm.assemble_file(io.StringIO(BANKED_PROGRAM), code_image, binary=True)
+    cpu.load_image(image.load_buffer(code_image.getvalue(), cpu.ram))
+
+
+def test_restore_drops_banks():
+    cpu = CPU()
+    clean = cpu.snapshot()
+    load_banked(cpu)
+    output = io.StringIO()
+    assert cpu.run(output=output).stop_reason == HALTED
+    assert output.getvalue() == "42\n"
+
+    cpu.restore(clean)
+    cpu.load_program(asm.assemble(PLAIN_PROGRAM))
+    output = io.StringIO()
+    assert cpu.run(output=output).stop_reason == HALTED
+    assert output.getvalue() == "0\n"
+    assert cpu.ram[0x80] == 7
+    assert cpu.bus is None and cpu.window is cpu.ram
+
+
+def test_server_requests_are_isolated():
+    server = Server(workers=1)
+    cpu = server.cpus[0]
+    banked = io.BytesIO()
+    asm.assemble_file(io.StringIO(BANKED_PROGRAM), banked, binary=True)
+    plain = asm.assemble(PLAIN_PROGRAM)
+
+    banked_output, plain_output = io.StringIO(), io.StringIO()
+    server.execute(cpu, banked.getvalue(), "image", 1000, banked_output)
+    server.execute(cpu, plain, "raw", 1000, plain_output)
+    server.executor.shutdown()
+
+    assert banked_output.getvalue() == "42\n"
+    assert plain_output.getvalue() == "0\n"
+
+
+def test_snapshot_keeps_banks():
+    cpu = CPU()
+    load_banked(cpu)
+    cpu.run(output=io.StringIO())
+    snapshot = cpu.snapshot()
+    assert snapshot.banks.keys() == {3} and snapshot.banks[3][0] == 42 and snapshot.bank == 3
+
+    # the clone gets banks of its own, still with bank 3 selected
+    clone = cpu.fork()
+    assert clone.banked_memory is not cpu.banked_memory
+    assert clone.window == cpu.window and clone.window is not cpu.window
+    clone.window[0] = 99
+    assert cpu.window[0] == 42
+
+    cpu.window[0] = 0
+    cpu.restore(snapshot)
+    assert cpu.window[0] == 42
+    assert cpu.banked_memory.selected == 3
+
+
+@pytest.mark.parametrize("fast_path", [False, True])
+def test_call_at_end_of_memory_wraps(fast_path):
+    cpu = CPU()
+    cpu.load_program([HLT])
+    if fast_path:
+        cpu.enable_fast_path(analyzer.analyze(cpu.ram))
+    cpu.pc = 0xFE
+    cpu.reg[0] = 0x10
+    cpu.handlers[CALL](0)
+
+    assert cpu.pc == 0x10
+    assert cpu.ram[cpu.sp] == 0
+
+
+def test_load_decodes_lazily():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "print8.ls8"))
+    assert cpu.decoded == [None] * len(cpu.ram)
+
+    cpu.run(output=io.StringIO())
+    assert [address for address, decoded in enumerate(cpu.decoded) if decoded] == [0, 3, 5]
+
+
+@pytest.mark.parametrize("program", [
+    # the stack runs down through the program until a JMP operand is no longer a register
+    (EXAMPLES / "stackoverflow.ls8").read_text(),
+    # LDI R9,1
+    "10000010\n00001001\n00000001\n",
+    # NOPs all the way to the end of memory
+    "00000000\n" * 256,
+])
+def test_memory_fault_is_a_stop_reason(program):
+    results = []
+    for run in ("interpreter", "stepper", "blocks"):
+        cpu = CPU()
+        cpu.load_program(parse_program(program.splitlines()))
+        output = io.StringIO()
+        if run == "stepper":
+            result = cpu.run_stepper(cpu.step, output=output)
+        else:
+            result = ENGINES[run](cpu)(output=output)
+        results.append((result, cpu.pc, output.getvalue()))
+
+    assert results[0][0].stop_reason == MEMORY_FAULT
+    assert results[1] == results[0]
+    assert results[2] == results[0]
+
+
+@pytest.mark.parametrize("name, status", [("call", 0), ("stackoverflow", 1)])
+def test_exit_status(name, status):
+    run = subprocess.run(
+        [sys.executable, "ls8/ls8.py", f"examples/{name}.ls8"],
+        cwd=ROOT, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=30,
+    )
+
+    assert run.returncode == status
+    assert "Traceback" not in run.stderr
+    assert ("HALTING" in run.stdout) == (status == 0)
+
+
+@pytest.mark.parametrize("options", [["--engine", "blocks"], ["--replay", "log"]])
+def test_record_rejects_conflicting_options(options, tmp_path):
+    run = subprocess.run(
+        [sys.executable, "ls8/ls8.py", "examples/call.ls8", "--record", str(tmp_path / "log"), *options],
+        cwd=ROOT, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=30,
+    )
+
+    assert run.returncode == 2
+    assert "--record" in run.stderr
+    assert not (tmp_path / "log").exists()
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:4] + bytes([9]) + data[5:],
+    lambda data: data[:-1],
+])
+def test_bad_image_is_reported(tmp_path, corrupt):
+    path = tmp_path / f"bad{image.EXTENSION}"
+    path.write_bytes(corrupt(image.dump(bytes([HLT]), symbols={"START": 0})))
+    # ls8.py looks programs up relative to ls8/
+    run = subprocess.run(
+        [sys.executable, "ls8/ls8.py", os.path.relpath(path, ROOT / "ls8")],
+        cwd=ROOT, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=30,
+    )
+
+    assert "Traceback" not in run.stderr
+    assert "Can't load" in run.stdout
+    # print8.ls8 is run instead, as for a file that can't be read
+    assert "8\n" in run.stdout and run.returncode == 0
+
+
+def run_state(cpu, max_cycles=None):
+    output = io.StringIO()
+    result = cpu.run(max_cycles=max_cycles, output=output)
+    return result, output.getvalue(), bytes(cpu.ram), bytes(cpu.reg), cpu.pc, cpu.sp, cpu.fl
+
+
+def test_restore_and_run_again():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "call.ls8"))
+    # part way through, inside the second call
+    assert cpu.run(max_cycles=9, output=io.StringIO()).stop_reason == CYCLE_LIMIT
+    snapshot = cpu.snapshot()
+
+    first = run_state(cpu)
+    cpu.restore(snapshot)
+    assert run_state(cpu) == first
+    assert first[:2] == ((HALTED, 13), "30\n36\n60\n")
+
+
+def test_fork_is_independent():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "call.ls8"))
+    cpu.run(max_cycles=9, output=io.StringIO())
+    snapshot = cpu.snapshot()
+    clone = cpu.fork()
+
+    # the clone changes its copy of memory and registers, and runs to the end
+    clone.ram[0x80] = 7
+    clone.reg[2] = 5
+    clone_state = run_state(clone)
+    assert clone_state[:2] == ((HALTED, 13), "30\n36\n60\n")
+
+    # none of which the parent sees
+    assert cpu.snapshot() == snapshot
+    parent_state = run_state(cpu)
+    assert parent_state[:2] == clone_state[:2]
+    assert (parent_state[2][0x80], parent_state[3][2]) == (0, 0)
+    assert (clone_state[2][0x80], clone_state[3][2]) == (7, 5)
+
+    # and the parent running on doesn't reach into a fresh clone either
+    cpu.restore(snapshot)
+    clone = cpu.fork()
+    run_state(cpu)
+    assert clone.snapshot() == snapshot
+
+
+def test_fork_prints_through_its_own_console():
+    cpu = CPU()
+    cpu.load_program(asm.assemble("""
+        LDI R0,0xF0
+        LDI R1,0x41
+        ST R0,R1
+        HLT
+    """))
+    cpu.map_device(ConsoleDevice(cpu.console), 0xF0)
+    clone = cpu.fork()
+
+    parent_output, clone_output = io.StringIO(), io.StringIO()
+    cpu.console.redirect(parent_output)
+    assert clone.run(output=clone_output).stop_reason == HALTED
+    assert (clone_output.getvalue(), parent_output.getvalue()) == ("A", "")
+    assert cpu.bus.devices[0xF0].console is cpu.console
+
+
+SPIN_PROGRAM = """
+    LDI R0,Handler
+    LDI R1,0xF8
+    ST R1,R0
+    LDI R5,1
+    LDI R0,Loop
+Loop:
+    JMP R0
+Handler:
+    LDI R2,42
+    PRN R2
+    HLT
+"""
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_spin_loop_uses_up_the_budget_at_once(engine):
+    start = time.monotonic()
+    cpu, result, output = run_source(SPIN_PROGRAM, engine, max_cycles=10_000_000)
+
+    assert result == (CYCLE_LIMIT, 10_000_000)
+    assert time.monotonic() - start < 1
+    assert cpu.pc == 0x0F
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_posted_interrupt_wakes_a_spin_loop(engine):
+    cpu = CPU()
+    cpu.load_program(asm.assemble(SPIN_PROGRAM))
+    # stands in for a running timer, so the idle CPU waits instead of giving up
+    source = object()
+    cpu.interrupt_sources.add(source)
+    timer = threading.Timer(0.05, cpu.post_interrupt, [0])
+    timer.start()
+    output = io.StringIO()
+    result = ENGINES[engine](cpu)(output=output)
+    timer.join()
+
+    # the setup, one JMP, then the handler
+    assert result == (HALTED, 9)
+    assert output.getvalue() == "42\n"
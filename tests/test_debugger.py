@@ -0,0 +1,25 @@
+"""Tests for the debugger"""
+
+import io
+import sys
+
+from cpu import CPU
+from debugger import BREAKPOINT, Debugger
+
+from conftest import EXAMPLES, SOURCES
+
+
+def test_breakpoint_on_label():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "call.ls8"))
+    cpu.console.redirect(io.StringIO())
+    debugger = Debugger(cpu)
+    path_entries = len(sys.path)
+    debugger.load_symbols(SOURCES / "call.asm")
+    debugger.load_symbols(SOURCES / "call.asm")
+
+    assert len(sys.path) == path_entries
+    debugger.break_at("Mult2Print")
+    stop = debugger.cont()
+    assert stop.reason == BREAKPOINT
+    assert stop.pc == cpu.pc == debugger.symbols["MULT2PRINT"]
@@ -0,0 +1,88 @@
+"""Tests for memory-mapped devices"""
+
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from cpu import CPU, HALTED
+from devices import ConsoleDevice, FramebufferDevice, KeyboardDevice, TimerDevice, parse_mapping
+
+from conftest import ROOT, asm
+
+
+def test_parse_mapping():
+    cpu = CPU()
+    keyboard, start = parse_mapping("keyboard@0xF4", cpu)
+    assert isinstance(keyboard, KeyboardDevice) and start == 0xF4
+
+    timer, start = parse_mapping("timer:0.5@240", cpu)
+    assert isinstance(timer, TimerDevice) and timer.tick == 0.5 and start == 240
+
+    console, _ = parse_mapping("console@0xF0", cpu)
+    assert isinstance(console, ConsoleDevice) and console.console is cpu.console
+
+    framebuffer, _ = parse_mapping("framebuffer:4x2@0x40", cpu)
+    assert isinstance(framebuffer, FramebufferDevice) and framebuffer.size == 8
+
+
+@pytest.mark.parametrize("spec", ["console", "console@", "printer@0x10", "framebuffer:4@0", "timer:0@0"])
+def test_parse_mapping_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_mapping(spec, CPU())
+
+
+def test_ld_and_st_reach_devices():
+    cpu = CPU()
+    cpu.load_program(asm.assemble("""
+        LDI R0,0xF4
+        LD R1,R0
+        LDI R0,0xF0
+        ST R0,R1
+        LDI R0,0x41
+        LDI R2,9
+        ST R0,R2
+        HLT
+    """))
+    keyboard, framebuffer = KeyboardDevice(), FramebufferDevice(2, 2)
+    for spec, device in (("console@0xF0", None), ("keyboard@0xF4", keyboard), ("framebuffer:2x2@0x40", framebuffer)):
+        mapped, start = parse_mapping(spec, cpu)
+        cpu.map_device(device or mapped, start)
+    keyboard.key = ord("k")
+    output = io.StringIO()
+
+    assert cpu.run(output=output).stop_reason == HALTED
+    assert output.getvalue() == "k"
+    assert framebuffer.cells == bytearray([0, 9, 0, 0])
+    # the stores went to the devices, not to RAM
+    assert cpu.ram[0xF0] == cpu.ram[0x41] == 0
+
+
+def test_device_option(tmp_path):
+    program = tmp_path / "devices.ls8"
+    program.write_text("".join(f"{byte:08b}\n" for byte in asm.assemble("""
+        LDI R0,0xF0
+        LDI R1,0x2A
+        ST R0,R1
+        LDI R1,0x0A
+        ST R0,R1
+        HLT
+    """)))
+    # ls8.py looks programs up relative to ls8/
+    seed_file = os.path.relpath(program, ROOT / "ls8")
+    run = subprocess.run(
+        [sys.executable, "ls8/ls8.py", seed_file, "--device", "console@0xF0"],
+        cwd=ROOT, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=30,
+    )
+
+    assert run.returncode == 0
+    assert "*" in run.stdout.splitlines()
+
+    run = subprocess.run(
+        [sys.executable, "ls8/ls8.py", seed_file, "--device", "printer@0xF0"],
+        cwd=ROOT, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=30,
+    )
+    assert run.returncode == 2
+    assert "unknown device" in run.stderr
@@ -0,0 +1,159 @@
+"""Every way of running a program has to behave exactly like the plain interpreter
+
+The predecode cache, the bytearray machine state, the block engine, the dense handler
+list, the verified fast path, binary images, the peephole optimizer and VectorCPU are all
+meant to change how fast a program runs, never what it does.
+"""
+
+import io
+
+import pytest
+
+import analyzer
+import image
+from blocks import BlockEngine
+from cpu import CPU, HALTED, ILLEGAL_INSTRUCTION, parse_program
+from vector import VectorCPU, np
+
+from conftest import EXAMPLES, EXPECTED_OUTPUT, assemble_source, asm
+
+
+def interpreter(cpu, output):
+    return cpu.run(output=output)
+
+
+def stepper(cpu, output):
+    return cpu.run_stepper(cpu.step, output=output)
+
+
+def blocks(cpu, output):
+    return BlockEngine(cpu).run(output=output)
+
+
+def verified(run):
+    def run_verified(cpu, output):
+        cpu.enable_fast_path(analyzer.analyze(cpu.ram))
+        return run(cpu, output)
+    return run_verified
+
+
+ENGINES = {
+    "interpreter": interpreter,
+    "stepper": stepper,
+    "blocks": blocks,
+    "verified interpreter": verified(interpreter),
+    "verified blocks": verified(blocks),
+}
+
+
+def run_file(path, engine):
+    cpu = CPU()
+    cpu.load_file(str(path))
+    output = io.StringIO()
+    result = ENGINES[engine](cpu, output)
+    return cpu, result, output.getvalue()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", EXPECTED_OUTPUT)
+def test_example_matches_interpreter(name, engine):
+    path = EXAMPLES / f"{name}.ls8"
+    expected_cpu, expected, _ = run_file(path, "interpreter")
+    cpu, result, output = run_file(path, engine)
+
+    assert output == EXPECTED_OUTPUT[name]
+    assert result == expected
+    assert result.stop_reason == HALTED
+    assert (cpu.reg, cpu.ram, cpu.pc, cpu.sp, cpu.fl) == (
+        expected_cpu.reg, expected_cpu.ram, expected_cpu.pc, expected_cpu.sp, expected_cpu.fl
+    )
+
+
+@pytest.mark.parametrize("name", EXPECTED_OUTPUT)
+def test_assembler_matches_examples(name):
+    listing = assemble_source(name)
+    with open(EXAMPLES / f"{name}.ls8") as example:
+        assert parse_program(listing.splitlines()) == parse_program(example)
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "blocks"])
+@pytest.mark.parametrize("name", EXPECTED_OUTPUT)
+def test_image_matches_text(name, engine):
+    cpu = CPU()
+    cpu.load_image(image.load_buffer(assemble_source(name, binary=True), cpu.ram))
+    output = io.StringIO()
+    result = ENGINES[engine](cpu, output)
+
+    assert output.getvalue() == EXPECTED_OUTPUT[name]
+    assert result == run_file(EXAMPLES / f"{name}.ls8", engine)[1]
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "blocks"])
+@pytest.mark.parametrize("name", EXPECTED_OUTPUT)
+def test_optimized_output_matches(name, engine):
+    cpu = CPU()
+    cpu.load_program(parse_program(assemble_source(name, optimized=True).splitlines()))
+    output = io.StringIO()
+    result = ENGINES[engine](cpu, output)
+
+    assert output.getvalue() == EXPECTED_OUTPUT[name]
+    assert result.stop_reason == HALTED
+
+
+@pytest.mark.skipif(np is None, reason="VectorCPU needs NumPy")
+@pytest.mark.parametrize("name", EXPECTED_OUTPUT)
+def test_vector_matches_interpreter(name):
+    expected_cpu, expected, _ = run_file(EXAMPLES / f"{name}.ls8", "interpreter")
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / f"{name}.ls8"))
+    vector = VectorCPU.from_snapshot(cpu.snapshot(), 3)
+    results = vector.run()
+
+    assert results == [expected] * 3
+    assert vector.outputs() == [EXPECTED_OUTPUT[name]] * 3
+    assert bytes(vector.reg[0]) == bytes(expected_cpu.reg)
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "stepper", "blocks"])
+def test_self_modifying_code(engine):
+    # the NOPs at Patch run once, then are overwritten with PRN R2 after they've been cached
+    program = asm.assemble("""
+        LDI R2,7
+        LDI R3,10
+        LDI R4,Patch
+        JMP R4
+    Patch:
+        NOP
+    Operand:
+        NOP
+        LDI R0,Patch
+        LDI R1,0b01000111
+        ST R0,R1
+        LDI R0,Operand
+        LDI R1,2
+        ST R0,R1
+        INC R2
+        CMP R2,R3
+        JNE R4
+        HLT
+    """)
+    cpu = CPU()
+    cpu.load_program(program)
+    output = io.StringIO()
+    result = ENGINES[engine](cpu, output)
+
+    assert result.stop_reason == HALTED
+    assert output.getvalue() == "8\n9\n"
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "stepper", "blocks"])
+def test_illegal_instruction(engine):
+    cpu = CPU()
+    # LDI R0,1 ; PRN R0 ; an opcode with no handler
+    cpu.load_program([0b10000010, 0, 1, 0b01000111, 0, 0b11111111, 0b00000001])
+    output = io.StringIO()
+    result = ENGINES[engine](cpu, output)
+
+    assert result == (ILLEGAL_INSTRUCTION, 3)
+    assert cpu.pc == 5
+    assert output.getvalue() == "1\n"
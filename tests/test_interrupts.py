@@ -0,0 +1,44 @@
+"""Tests for the external interrupt sources"""
+
+import io
+
+import pytest
+
+from blocks import BlockEngine
+from cpu import CPU, CYCLE_LIMIT
+from devices import KeyboardDevice
+from interrupts import KEYBOARD_INTERRUPT, KEY_PRESSED_ADDRESS, KeyboardSource
+
+from conftest import EXAMPLES
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "blocks"])
+@pytest.mark.parametrize("mapped", [False, True])
+def test_keys_typed_ahead_are_all_handled(engine, mapped):
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "keyboard.ls8"))
+    if mapped:
+        cpu.map_device(KeyboardDevice(), KEY_PRESSED_ADDRESS)
+    # registered as a started keyboard would be, without a thread reading stdin
+    keyboard = KeyboardSource(cpu, io.StringIO())
+    cpu.acknowledging_sources[KEYBOARD_INTERRUPT] = keyboard
+    # all three arrive before the program has even hooked the interrupt
+    for key in b"abc":
+        keyboard.press(key)
+    assert cpu.posted_interrupts == 1 << KEYBOARD_INTERRUPT
+
+    output = io.StringIO()
+    run = BlockEngine(cpu).run if engine == "blocks" else cpu.run
+    result = run(max_cycles=200, output=output)
+
+    assert result.stop_reason == CYCLE_LIMIT
+    assert output.getvalue() == "abc"
+    assert not keyboard.keys
+
+
+def test_int_without_a_key_leaves_the_queue_alone():
+    cpu = CPU()
+    keyboard = KeyboardSource(cpu, io.StringIO())
+    keyboard.acknowledge()
+
+    assert cpu.ram[KEY_PRESSED_ADDRESS] == 0 and not cpu.posted_interrupts
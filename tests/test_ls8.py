@@ -0,0 +1,43 @@
+"""Tests for the ls8.py command line"""
+
+import contextlib
+import sys
+
+import pytest
+
+import ls8
+
+from conftest import ROOT
+
+
+@pytest.fixture
+def started(monkeypatch):
+    """run ls8.main() from the repository root, recording which interrupt sources it starts"""
+    started = []
+
+    @contextlib.contextmanager
+    def interrupt_sources(cpu, timer=True, keyboard=True):
+        started.append((timer, keyboard))
+        yield []
+
+    monkeypatch.setattr(ls8, "interrupt_sources", interrupt_sources)
+    monkeypatch.chdir(ROOT)
+    return started
+
+
+@pytest.mark.parametrize("name, options, expected", [
+    ("call", [], False),
+    ("keyboard", [], True),
+    ("interrupts", ["--interrupts", "off", "--line-buffered"], False),
+    ("call", ["--interrupts", "on"], True),
+])
+def test_interrupt_sources_start_only_when_wanted(started, monkeypatch, capsys, name, options, expected):
+    monkeypatch.setattr(sys, "argv", ["ls8.py", f"examples/{name}.ls8", *options])
+    if name == "call":
+        assert ls8.main() == 0
+    else:
+        # these wait for interrupts forever, so only the setup is run
+        monkeypatch.setattr(ls8.CPU, "run", lambda cpu, *args, **kwargs: ls8.RunResult(ls8.CYCLE_LIMIT, 0))
+        assert ls8.main() == 1
+
+    assert started == [(expected, expected and not sys.stdin.closed)]
@@ -0,0 +1,64 @@
+"""Tests for the profiler"""
+
+import io
+
+import image
+from alu import AluOperations
+from cpu import CPU, CALL, HALTED, HLT, LDI, PRN, RET
+from profiler import Profiler
+
+from conftest import EXAMPLES, assemble_source
+
+
+def profile(cpu):
+    profiler = Profiler(cpu)
+    output = io.StringIO()
+    result = profiler.run(output=output)
+    assert result == (HALTED, 22)
+    assert output.getvalue() == "20\n30\n36\n60\n"
+    return profiler
+
+
+def test_counts():
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "call.ls8"))
+    profiler = profile(cpu)
+
+    assert profiler.cycles == sum(profiler.op_counts) == sum(profiler.pc_counts) == 22
+    assert {ir: count for ir, count in enumerate(profiler.op_counts) if count} == {
+        LDI: 5, CALL: 4, HLT: 1, AluOperations.ADD: 4, PRN: 4, RET: 4,
+    }
+    # main runs once, Mult2Print (at 0x18) four times
+    assert {pc: count for pc, count in enumerate(profiler.pc_counts) if count} == {
+        0x00: 1, 0x03: 1, 0x06: 1, 0x08: 1, 0x0B: 1, 0x0D: 1, 0x10: 1, 0x12: 1, 0x15: 1, 0x17: 1,
+        0x18: 4, 0x1B: 4, 0x1D: 4,
+    }
+    assert profiler.calls == {0x18: 4}
+    # ADD, PRN and RET per call
+    assert profiler.inclusive_cycles == {0x18: 12}
+
+    report = io.StringIO()
+    profiler.report(report)
+    assert "profiled 22 cycles" in report.getvalue()
+    assert "sub_18" in report.getvalue()
+
+
+def test_collapsed_stacks_use_labels():
+    cpu = CPU()
+    cpu.load_image(image.load_buffer(assemble_source("call", binary=True), cpu.ram))
+    profiler = profile(cpu)
+
+    collapsed = io.StringIO()
+    profiler.write_collapsed(collapsed)
+    # CALL counts towards its caller, RET towards the subroutine
+    assert collapsed.getvalue() == "main 10\nmain;MULT2PRINT 12\n"
+
+
+def test_ret_without_call_is_ignored():
+    cpu = CPU()
+    cpu.load_program([RET])
+    cpu.ram[cpu.sp] = 1
+    cpu.ram[1] = HLT
+    profiler = Profiler(cpu)
+    assert profiler.run().stop_reason == HALTED
+    assert profiler.inclusive_cycles == {} and len(profiler.frames) == 1
@@ -0,0 +1,75 @@
+"""Tests for interrupt record and replay"""
+
+import io
+
+import pytest
+
+from blocks import BlockEngine
+from cpu import CPU, CYCLE_LIMIT
+from interrupts import KEYBOARD_INTERRUPT, TIMER_INTERRUPT
+from interrupts import KeyboardSource
+from replay import LOG_EVENT, LOG_HEADER, LOG_MAGIC, LOG_VERSION, Event, InterruptRecorder, InterruptReplayer, read_log
+
+from conftest import EXAMPLES
+
+
+def write_log(path, events, end):
+    with open(path, "wb") as file:
+        file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, len(events), end))
+        for event in events:
+            file.write(LOG_EVENT.pack(*event))
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "blocks"])
+@pytest.mark.parametrize("name, events, expected", [
+    ("interrupts", [Event(cycle, 1 << TIMER_INTERRUPT, 0) for cycle in (20, 60, 100)], "AAA"),
+    ("keyboard", [Event(cycle, 1 << KEYBOARD_INTERRUPT, ord(key)) for cycle, key in ((20, "h"), (60, "i"))], "hi"),
+])
+def test_replay_is_deterministic(tmp_path, engine, name, events, expected):
+    log = tmp_path / "log"
+    write_log(log, events, 200)
+    assert read_log(log) == (events, 200)
+
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / f"{name}.ls8"))
+    output = io.StringIO()
+    run = BlockEngine(cpu).run if engine == "blocks" else cpu.run
+    result = InterruptReplayer(cpu, log).run(run, output=output)
+
+    assert result == (CYCLE_LIMIT, 200)
+    assert output.getvalue() == expected
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "blocks"])
+def test_replay_reproduces_keys_typed_during_the_handler(tmp_path, engine):
+    log = tmp_path / "log"
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "keyboard.ls8"))
+    # registered as a started keyboard would be, with keys pressed at known cycles
+    keyboard = KeyboardSource(cpu, io.StringIO())
+    cpu.acknowledging_sources[KEYBOARD_INTERRUPT] = keyboard
+    recorder = InterruptRecorder(cpu, log)
+    # the second key arrives while the handler for the first is still running
+    presses = {5: ord("h"), 6: ord("i")}
+    step = recorder.step
+
+    def pressing_step():
+        if recorder.cycles in presses:
+            keyboard.press(presses[recorder.cycles])
+        step()
+
+    recorder.step = pressing_step
+    recorded = io.StringIO()
+    result = recorder.run(max_cycles=100, output=recorded)
+    assert recorded.getvalue() == "hi"
+
+    events, end = read_log(log)
+    assert [event.key for event in events] == [ord("h"), ord("i")]
+    assert end == result.cycles == 100
+
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / "keyboard.ls8"))
+    output = io.StringIO()
+    run = BlockEngine(cpu).run if engine == "blocks" else cpu.run
+    assert InterruptReplayer(cpu, log).run(run, output=output) == result
+    assert output.getvalue() == "hi"
@@ -0,0 +1,69 @@
+"""Tests for the ring-buffer trace recorder"""
+
+import io
+
+import pytest
+
+import tracer
+from cpu import CPU, HALTED, MEMORY_FAULT
+from tracer import TraceRecord, TraceRecorder, read_trace
+
+from conftest import EXAMPLES
+
+# the PC of every instruction call.ls8 executes, in order
+CALL_PCS = [
+    0x00, 0x03, 0x06, 0x18, 0x1B, 0x1D, 0x08, 0x0B, 0x18, 0x1B, 0x1D, 0x0D, 0x10,
+    0x18, 0x1B, 0x1D, 0x12, 0x15, 0x18, 0x1B, 0x1D, 0x17,
+]
+
+
+def trace(tmp_path, name, capacity):
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / f"{name}.ls8"))
+    path = tmp_path / "trace"
+    result = TraceRecorder(cpu, path, capacity).run(output=io.StringIO())
+    return result, read_trace(path)
+
+
+def live_states(name):
+    """the state before every instruction, from stepping a CPU by hand"""
+    cpu = CPU()
+    cpu.load_file(str(EXAMPLES / f"{name}.ls8"))
+    cpu.console.redirect(io.StringIO())
+    states = []
+    while True:
+        ir, op_a, op_b = cpu.ram[cpu.pc:cpu.pc + 3]
+        states.append(TraceRecord(cpu.pc, ir, op_a, op_b, cpu.fl, cpu.sp, bytes(cpu.reg)))
+        try:
+            cpu.step()
+        except Exception:
+            return states
+
+
+@pytest.mark.parametrize("capacity", [5, 22, 23, 4096])
+def test_keeps_the_last_records(tmp_path, capacity):
+    result, records = trace(tmp_path, "call", capacity)
+
+    assert result == (HALTED, 22)
+    assert [record.pc for record in records] == CALL_PCS[-capacity:]
+
+
+def test_dump_reads_back(tmp_path):
+    _, records = trace(tmp_path, "call", 4096)
+
+    assert records == live_states("call")
+    assert tracer.format_record(records[0]) == "00: LDI      | 82 01 18 | FL=00 SP=F4 | 00 00 00 00 00 00 00 F4"
+
+
+def test_dumped_on_a_fault(tmp_path):
+    result, records = trace(tmp_path, "stackoverflow", 16)
+
+    assert result == (MEMORY_FAULT, 911)
+    assert records == live_states("stackoverflow")[-16:]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "trace"
+    path.write_bytes(b"LS8R" + bytes(8))
+    with pytest.raises(ValueError):
+        read_trace(path)
@@ -0,0 +1,90 @@
+"""VectorCPU has to run every machine exactly as CPU.run() would"""
+
+import io
+import random
+
+import pytest
+
+from alu import AluOperations
+from cpu import (
+    CPU, CALL, CYCLE_LIMIT, HLT, JEQ, JGE, JGT, JLE, JLT, JMP, JNE, LD, LDI, MEMORY_FAULT, NOP, POP, PRA, PRN,
+    PUSH, RET, ST,
+)
+from vector import IDLE, UNSUPPORTED, VectorCPU, np
+
+pytestmark = pytest.mark.skipif(np is None, reason="VectorCPU needs NumPy")
+
+ALU = [value for name, value in vars(AluOperations).items() if name.isupper()]
+JUMPS = [JMP, JEQ, JNE, JGT, JGE, JLT, JLE]
+OPCODES = ALU + JUMPS + [NOP, HLT, LDI, LD, ST, PRN, PRA, PUSH, POP, CALL, RET]
+
+
+def random_program(rng, size=48):
+    """random instructions, with each jump preceded by an LDI of a target in the program"""
+    program = []
+    while len(program) < size:
+        ir = rng.choice(OPCODES)
+        # now and then, a register past R7
+        register = rng.choice(range(10)) if rng.random() < 0.05 else rng.choice(range(8))
+        if ir in JUMPS or ir == CALL:
+            program += [LDI, register, rng.randrange(size)]
+        operands = [register, rng.randrange(256) if ir == LDI else rng.randrange(8)]
+        program += [ir, *operands][:1 + (ir >> 6)]
+    return program[:size] + [HLT]
+
+
+def run_cpu(program, max_cycles):
+    cpu = CPU()
+    cpu.load_program(program)
+    output = io.StringIO()
+    result = cpu.run(max_cycles=max_cycles, output=output)
+    return cpu, result, output.getvalue()
+
+
+def test_random_programs_match_interpreter():
+    rng = random.Random(8)
+    programs = [random_program(rng) for _ in range(600)]
+    vector = VectorCPU(len(programs))
+    for row, program in enumerate(programs):
+        vector.ram[row, :len(program)] = program
+    results = vector.run(max_cycles=300)
+
+    compared = 0
+    for row, program in enumerate(programs):
+        # a stray ST can leave an INT or IRET to run into, which has no lockstep form
+        if results[row].stop_reason == UNSUPPORTED:
+            continue
+        compared += 1
+        cpu, expected, output = run_cpu(program, 300)
+        assert results[row] == expected, row
+        assert vector.outputs()[row] == output, row
+        assert (bytes(vector.reg[row]), vector.fl[row], vector.pc[row], vector.sp[row]) == (
+            bytes(cpu.reg), cpu.fl, cpu.pc, cpu.sp
+        ), row
+        assert vector.ram[row].tobytes() == bytes(cpu.ram), row
+    assert compared > 500
+
+
+def test_register_past_r7_faults():
+    # LDI R9,1
+    program = [LDI, 9, 1, PRN, 1, HLT]
+    vector = VectorCPU(1, program)
+
+    assert vector.run() == [run_cpu(program, None)[1]] == [(MEMORY_FAULT, 1)]
+    assert bytes(vector.reg[0]) == bytes(8)[:7] + b"\xf4"
+
+
+def test_fault_counts_the_faulting_instruction():
+    # jumps to a HLT at 0xFF, which can't be fetched with its operands
+    program = [LDI, 0, 0xFF, JMP, 0]
+    vector = VectorCPU(1, program)
+
+    assert vector.run() == [run_cpu(program, None)[1]] == [(MEMORY_FAULT, 3)]
+
+
+def test_self_jump():
+    # Loop: JMP R0
+    program = [LDI, 0, 3, JMP, 0]
+    assert VectorCPU(1, program).run(max_cycles=50) == [run_cpu(program, 50)[1]] == [(CYCLE_LIMIT, 50)]
+    # with no budget to use up, it stops rather than spinning forever
+    assert VectorCPU(1, program).run() == [(IDLE, 2)]